@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""Construye la matriz de características compartida (memmap) a partir del dataset procesado.
+
+Uso:
+  python scripts/build_feature_matrix.py
+
+Genera en output/feature_matrix/:
+ - XT.npy (X traspuesta, float32) e y.npy (uint8), con las filas ordenadas como [train | test]
+ - train_idx.npy / test_idx.npy: índices originales de la división estratificada
+ - manifest.json: columnas, tamaños y firma del archivo de origen
+
+Los scripts de entrenamiento y evaluación abren estos archivos con
+np.load(mmap_mode="r") mientras el dataset de origen no cambie.
+"""
+import os
+
+from dataset_io import MATRIX_DIR, build_feature_matrix, find_dataset
+
+
+CSV_PATH = os.path.join(os.path.dirname(__file__), "KDD_TRAIN_FULL.csv")
+
+
+def main():
+    data_path = find_dataset(CSV_PATH)
+    if data_path is None:
+        raise SystemExit(f"CSV procesado no encontrado en: {CSV_PATH}\nEjecuta primero scripts/download_and_chunk.py")
+
+    manifest = build_feature_matrix(data_path)
+    print(f"Matriz de características guardada en: {MATRIX_DIR}")
+    print(f"  Filas: {manifest['n_rows']} ({manifest['n_train']} train, {manifest['n_rows'] - manifest['n_train']} test)")
+    print(f"  Columnas: {len(manifest['columns'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,15 @@ import os
 import joblib
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
 from sklearn.metrics import (
     accuracy_score, precision_score, recall_score, f1_score, 
     roc_auc_score, confusion_matrix, classification_report
 )
 import time
 
+from dataset_io import load_split
+from prediction_cache import holdout_proba, split_hash
+
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 CSV_PATH = os.path.join(os.path.dirname(__file__), "KDD_TRAIN_FULL.csv")
@@ -24,43 +26,61 @@ def load_model(model_path):
     return None
 
 
-def evaluate_model(model, X_test, y_test, model_name):
-    """Evalua un modelo y retorna metricas."""
+def evaluate_model(model, X_test, y_test, model_name, cache_key=None, model_path=None, split=None,
+                   sample_weight=None):
+    """Evalua un modelo y retorna metricas.
+
+    Con `cache_key` las probabilidades de prueba se leen de (o se guardan en) la
+    cache de prediction_cache, indexada por el artefacto `model_path` y la
+    particion `split`; la prediccion se obtiene con umbral 0.5, igual que
+    `predict` en los clasificadores binarios de sklearn. Con `sample_weight`
+    (dataset deduplicado) cada fila cuenta tantas veces como su conteo.
+    """
+    w = sample_weight
     print(f"\nEvaluando {model_name}...")
     
-    start_time = time.time()
-    y_pred = model.predict(X_test)
-    prediction_time = time.time() - start_time
+    if cache_key is not None and hasattr(model, 'predict_proba'):
+        y_proba, prediction_time, cached = holdout_proba(cache_key, model, model_path, X_test, split)
+        if cached:
+            print("  Probabilidades leidas de la cache")
+        y_pred = (y_proba > 0.5).astype(int)
+    else:
+        start_time = time.time()
+        y_pred = model.predict(X_test)
+        prediction_time = time.time() - start_time
+        y_proba = None
     
     # Calcular metricas
     metrics = {
         'Model': model_name,
-        'Accuracy': accuracy_score(y_test, y_pred),
-        'Precision': precision_score(y_test, y_pred),
-        'Recall': recall_score(y_test, y_pred),
-        'F1-Score': f1_score(y_test, y_pred),
+        'Accuracy': accuracy_score(y_test, y_pred, sample_weight=w),
+        'Precision': precision_score(y_test, y_pred, sample_weight=w),
+        'Recall': recall_score(y_test, y_pred, sample_weight=w),
+        'F1-Score': f1_score(y_test, y_pred, sample_weight=w),
         'Prediction_Time': prediction_time
     }
     
     # ROC-AUC si el modelo soporta predict_proba
-    if hasattr(model, 'predict_proba'):
+    if y_proba is not None:
+        metrics['ROC-AUC'] = roc_auc_score(y_test, y_proba, sample_weight=w) if len(set(y_test)) > 1 else None
+    elif hasattr(model, 'predict_proba'):
         try:
             y_proba = model.predict_proba(X_test)[:, 1]
-            metrics['ROC-AUC'] = roc_auc_score(y_test, y_proba)
+            metrics['ROC-AUC'] = roc_auc_score(y_test, y_proba, sample_weight=w)
         except:
             metrics['ROC-AUC'] = None
     else:
         metrics['ROC-AUC'] = None
     
     # Confusion matrix
-    cm = confusion_matrix(y_test, y_pred)
+    cm = confusion_matrix(y_test, y_pred, sample_weight=w).astype(int)
     metrics['True_Negatives'] = cm[0, 0]
     metrics['False_Positives'] = cm[0, 1]
     metrics['False_Negatives'] = cm[1, 0]
     metrics['True_Positives'] = cm[1, 1]
     
     # Calcular tasas de error
-    total = len(y_test)
+    total = cm.sum()
     metrics['Error_Rate'] = (metrics['False_Positives'] + metrics['False_Negatives']) / total
     metrics['FP_Rate'] = metrics['False_Positives'] / (metrics['False_Positives'] + metrics['True_Negatives'])
     metrics['FN_Rate'] = metrics['False_Negatives'] / (metrics['False_Negatives'] + metrics['True_Positives'])
@@ -80,47 +100,53 @@ def main():
     
     # Cargar datos
     print("\nCargando datos...")
-    if not os.path.exists(CSV_PATH):
-        raise SystemExit(f"CSV no encontrado: {CSV_PATH}")
-    
-    df = pd.read_csv(CSV_PATH)
-    X = df.drop(columns=["binario"])
-    y = df["binario"]
+    # Usar la misma division que en el entrenamiento (matriz memmap compartida si existe)
+    # (con el dataset deduplicado, w_test es el conteo de cada fila)
+    X_train, X_test, y_train, y_test, w_train, w_test = load_split(CSV_PATH, with_weights=True)
+    counts = np.bincount(y_test, weights=w_test, minlength=2).astype(int)
     
-    # Usar la misma division que en el entrenamiento
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.20, random_state=42, stratify=y
-    )
-    
-    print(f"Datos de prueba: {len(X_test)} muestras")
-    print(f"  - Normal: {sum(y_test == 0)}")
-    print(f"  - Attack: {sum(y_test == 1)}")
+    print(f"Datos de prueba: {counts.sum()} muestras")
+    if w_test is not None:
+        print(f"  ({len(X_test)} filas únicas)")
+    print(f"  - Normal: {counts[0]}")
+    print(f"  - Attack: {counts[1]}")
     
     # Definir modelos a comparar
     models_info = [
         {
             'name': 'Random Forest',
             'path': os.path.join(OUTPUT_DIR, 'rf_kdd_model.joblib'),
+            'cache_key': 'random_forest',
             'short_name': 'RF'
         },
         {
             'name': 'AdaBoost',
             'path': os.path.join(OUTPUT_DIR, 'adaboost_kdd_model.joblib'),
+            'cache_key': 'adaboost',
             'short_name': 'ADA'
         },
         {
             'name': 'Gradient Boosting',
             'path': os.path.join(OUTPUT_DIR, 'gradient_boosting_kdd_model.joblib'),
+            'cache_key': 'gradient_boosting',
             'short_name': 'GBM'
         },
+        {
+            'name': 'Hist Gradient Boosting',
+            'path': os.path.join(OUTPUT_DIR, 'hist_gradient_boosting_kdd_model.joblib'),
+            'cache_key': 'hist_gradient_boosting',
+            'short_name': 'HGB'
+        },
         {
             'name': 'Voting Classifier',
             'path': os.path.join(OUTPUT_DIR, 'voting_classifier_kdd_model.joblib'),
+            'cache_key': 'voting_classifier',
             'short_name': 'VC'
         }
     ]
     
-    # Evaluar cada modelo
+    # Evaluar cada modelo (las probabilidades de prueba se guardan en output/predictions/)
+    split = split_hash(X_test, y_test)
     results = []
     print("\n" + "="*80)
     print("EVALUANDO MODELOS")
@@ -129,7 +155,8 @@ def main():
     for model_info in models_info:
         model = load_model(model_info['path'])
         if model is not None:
-            metrics = evaluate_model(model, X_test, y_test, model_info['name'])
+            metrics = evaluate_model(model, X_test, y_test, model_info['name'],
+                                     model_info['cache_key'], model_info['path'], split, w_test)
             results.append(metrics)
         else:
             print(f"\n⚠️  {model_info['name']}: Modelo no encontrado en {model_info['path']}")
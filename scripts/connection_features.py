@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""Extracción en línea de las características KDD a partir de conexiones.
+
+El modelo espera los 41 campos de KDD Cup 1999, pero los de tráfico (`count`,
+`srv_count`, `serror_rate`, `dst_host_count`, ...) no vienen en ningún log:
+son agregados sobre las conexiones anteriores. `ConnectionFeatureExtractor`
+los mantiene de forma incremental sobre dos ventanas deslizantes:
+
+ - Ventana temporal (KDD_TIME_WINDOW, 2 s): conexiones de los últimos dos
+   segundos. `count` cuenta las que van al mismo host destino que la actual y
+   `srv_count` las que van al mismo servicio (a cualquier host).
+ - Ventana de host (KDD_HOST_WINDOW, 100 conexiones): las últimas N
+   conexiones. `dst_host_count` cuenta las que van al mismo host destino y
+   `dst_host_srv_count` las que van al mismo servicio.
+
+Cada ventana es una cola con contadores por host, por servicio y por par
+(host, servicio); al llegar una conexión se descuentan las que salen de la
+ventana y se suma la nueva, así que el costo por evento es O(1) amortizado e
+independiente del tamaño de las ventanas. Las tasas se redondean a dos
+decimales como en el dataset publicado y la conexión actual cuenta dentro de
+sus propias ventanas.
+
+La documentación de KDD describe la ventana de host como las últimas 100
+conexiones, aunque en los datos publicados los conteos llegan a 255; con
+KDD_HOST_WINDOW=255 se reproduce ese rango.
+
+Las características de contenido (`hot`, `num_failed_logins`, ...) requieren
+inspeccionar la carga útil; si el registro no las trae quedan en 0, igual que
+`wrong_fragment` y `urgent`.
+
+Uso:
+  python scripts/connection_features.py conn.log -o features.txt
+  tail -n +1 -f conn.log | python scripts/connection_features.py -
+  python scripts/connection_features.py tcp://127.0.0.1:9999 --format json
+
+La entrada es un conn.log de Zeek (TSV con cabecera `#fields` o JSON, una
+conexión por línea) leído de un archivo, de stdin (`-`) o de un socket TCP
+(`tcp://host:puerto`). La salida tiene una fila por conexión con los 41 campos
+en el orden de `RAW_FEATURE_COLUMNS`, el formato de texto de KDD que aceptan
+`/api/predict` y `KDDEncoder.encode_raw`.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+from collections import deque, namedtuple
+from operator import itemgetter
+
+from kdd_schema import RAW_FEATURE_COLUMNS
+
+
+TIME_WINDOW = float(os.environ.get("KDD_TIME_WINDOW", "2"))
+HOST_WINDOW = int(os.environ.get("KDD_HOST_WINDOW", "100"))
+
+# Estados con error de SYN (`serror_*`, 1) y de rechazo (`rerror_*`, 2); es
+# también la posición del contador en las estadísticas por clave
+ERROR_KIND = {"S0": 1, "S1": 1, "S2": 1, "S3": 1, "REJ": 2}
+
+# Las 13 características de contenido (de `hot` a `is_guest_login`)
+CONTENT_COLUMNS = RAW_FEATURE_COLUMNS[RAW_FEATURE_COLUMNS.index("hot"):RAW_FEATURE_COLUMNS.index("count")]
+NO_CONTENT = (0,) * len(CONTENT_COLUMNS)
+
+Connection = namedtuple("Connection", [
+    "ts", "src", "src_port", "dst", "dst_port", "protocol_type", "service", "flag",
+    "duration", "src_bytes", "dst_bytes", "wrong_fragment", "urgent", "content",
+], defaults=(0, 0, NO_CONTENT))
+Connection.__doc__ = """Una conexión terminada.
+
+`ts` en segundos (monótono dentro del flujo), `protocol_type`, `service` y
+`flag` con el vocabulario de KDD (ver `kdd_schema.CATEGORIES`) y `content` con
+las 13 características de contenido en el orden de `CONTENT_COLUMNS`.
+"""
+
+
+class ConnectionFeatureExtractor:
+    """Calcula los 41 campos KDD de cada conexión a medida que llegan.
+
+    `update` recibe una `Connection` (o una tupla con sus mismos 14 campos) y
+    devuelve el registro crudo de la conexión (lista en el orden de
+    `RAW_FEATURE_COLUMNS`). Las conexiones deben llegar en orden de `ts`; una
+    marca de tiempo menor que la anterior no rompe el estado, pero la ventana
+    temporal la expira según el orden de llegada.
+    """
+
+    def __init__(self, time_window=TIME_WINDOW, host_window=HOST_WINDOW):
+        if time_window <= 0 or host_window <= 0:
+            raise ValueError("Las ventanas deben ser positivas")
+        self.time_window = float(time_window)
+        self.host_window = int(host_window)
+        self.n_connections = 0
+
+        # Ventana temporal: (ts, host, servicio, (host, servicio), tipo de error)
+        self._time_queue = deque()
+        self._time_host = {}     # host -> [conexiones, serror, rerror]
+        self._time_srv = {}      # servicio -> [conexiones, serror, rerror]
+        self._time_pair = {}     # (host, servicio) -> conexiones
+
+        # Ventana de host: (host, servicio, (host, servicio), (host, puerto origen), tipo de error)
+        self._host_queue = deque()
+        self._host_host = {}
+        self._host_srv = {}
+        self._host_pair = {}
+        self._host_port = {}     # (host, puerto origen) -> conexiones
+        # _rates[n][a]: a / n redondeado a dos decimales, para n <= host_window
+        self._rates = [[]] + [[(200 * a + n) // (2 * n) / 100 for a in range(n + 1)]
+                              for n in range(1, self.host_window + 1)]
+
+    def update(self, conn):
+        """Incorpora una conexión y devuelve su registro de 41 campos."""
+        (ts, src, src_port, dst, dst_port, protocol, service, flag,
+         duration, src_bytes, dst_bytes, wrong_fragment, urgent, content) = conn
+        err = ERROR_KIND.get(flag, 0)
+        pair = (dst, service)
+
+        # Ventana temporal: expirar lo anterior a ts - time_window y sumar la
+        # conexión actual. Los contadores en cero se eliminan para que la
+        # memoria dependa solo de lo que hay dentro de la ventana
+        queue = self._time_queue
+        by_host, by_srv, by_pair = self._time_host, self._time_srv, self._time_pair
+        horizon = ts - self.time_window
+        while queue and queue[0][0] < horizon:
+            _, h, s, p, e = queue.popleft()
+            st = by_host[h]
+            if st[0] == 1:
+                del by_host[h]
+            else:
+                st[0] -= 1
+                if e:
+                    st[e] -= 1
+            st = by_srv[s]
+            if st[0] == 1:
+                del by_srv[s]
+            else:
+                st[0] -= 1
+                if e:
+                    st[e] -= 1
+            n = by_pair[p]
+            if n == 1:
+                del by_pair[p]
+            else:
+                by_pair[p] = n - 1
+        queue.append((ts, dst, service, pair, err))
+        t_host = by_host.get(dst)
+        if t_host is None:
+            t_host = by_host[dst] = [0, 0, 0]
+        t_srv = by_srv.get(service)
+        if t_srv is None:
+            t_srv = by_srv[service] = [0, 0, 0]
+        t_host[0] += 1
+        t_srv[0] += 1
+        if err:
+            t_host[err] += 1
+            t_srv[err] += 1
+        t_same = by_pair[pair] = by_pair.get(pair, 0) + 1
+
+        # Ventana de host: las últimas host_window conexiones
+        queue = self._host_queue
+        by_host, by_srv, by_pair, by_port = self._host_host, self._host_srv, self._host_pair, self._host_port
+        port = (dst, src_port)
+        if len(queue) >= self.host_window:
+            h, s, p, q, e = queue.popleft()
+            st = by_host[h]
+            if st[0] == 1:
+                del by_host[h]
+            else:
+                st[0] -= 1
+                if e:
+                    st[e] -= 1
+            st = by_srv[s]
+            if st[0] == 1:
+                del by_srv[s]
+            else:
+                st[0] -= 1
+                if e:
+                    st[e] -= 1
+            n = by_pair[p]
+            if n == 1:
+                del by_pair[p]
+            else:
+                by_pair[p] = n - 1
+            n = by_port[q]
+            if n == 1:
+                del by_port[q]
+            else:
+                by_port[q] = n - 1
+        queue.append((dst, service, pair, port, err))
+        h_host = by_host.get(dst)
+        if h_host is None:
+            h_host = by_host[dst] = [0, 0, 0]
+        h_srv = by_srv.get(service)
+        if h_srv is None:
+            h_srv = by_srv[service] = [0, 0, 0]
+        h_host[0] += 1
+        h_srv[0] += 1
+        if err:
+            h_host[err] += 1
+            h_srv[err] += 1
+        h_same = by_pair[pair] = by_pair.get(pair, 0) + 1
+        h_port = by_port[port] = by_port.get(port, 0) + 1
+        self.n_connections += 1
+
+        # Tasas redondeadas a dos decimales con aritmética entera:
+        # (200 a + n) // (2 n) == floor(100 a / n + 0.5), sin el costo de round().
+        # En la ventana de host n <= host_window y se leen de la tabla
+        tn, tm = t_host[0], t_srv[0]
+        tn2, tm2 = 2 * tn, 2 * tm
+        host_rates, srv_rates = self._rates[h_host[0]], self._rates[h_srv[0]]
+        return [
+            duration, protocol, service, flag, src_bytes, dst_bytes,
+            1 if src == dst and src_port == dst_port else 0, wrong_fragment, urgent,
+            *content,
+            tn, tm,
+            (200 * t_host[1] + tn) // tn2 / 100, (200 * t_srv[1] + tm) // tm2 / 100,
+            (200 * t_host[2] + tn) // tn2 / 100, (200 * t_srv[2] + tm) // tm2 / 100,
+            (200 * t_same + tn) // tn2 / 100, (200 * (tn - t_same) + tn) // tn2 / 100,
+            (200 * (tm - t_same) + tm) // tm2 / 100,
+            h_host[0], h_srv[0],
+            host_rates[h_same], host_rates[h_host[0] - h_same], host_rates[h_port],
+            srv_rates[h_srv[0] - h_same],
+            host_rates[h_host[1]], srv_rates[h_srv[1]], host_rates[h_host[2]], srv_rates[h_srv[2]],
+        ]
+
+    def extract(self, connections):
+        """Genera el registro de cada conexión de un iterable, en orden."""
+        update = self.update
+        for conn in connections:
+            yield update(conn)
+
+    def window_sizes(self):
+        """Conexiones actualmente dentro de cada ventana."""
+        return {"time": len(self._time_queue), "host": len(self._host_queue)}
+
+
+# --- Lectura de conn.log de Zeek ---------------------------------------------
+
+# Puerto destino -> servicio KDD
+TCP_SERVICES = {
+    7: "echo", 9: "discard", 11: "systat", 13: "daytime", 15: "netstat", 20: "ftp_data",
+    21: "ftp", 22: "ssh", 23: "telnet", 25: "smtp", 37: "time", 42: "name", 43: "whois",
+    53: "domain", 57: "mtp", 70: "gopher", 71: "remote_job", 77: "rje", 79: "finger",
+    80: "http", 84: "ctf", 87: "link", 95: "supdup", 101: "hostnames", 102: "iso_tsap",
+    105: "csnet_ns", 109: "pop_2", 110: "pop_3", 111: "sunrpc", 113: "auth", 117: "uucp_path",
+    119: "nntp", 139: "netbios_ssn", 143: "imap4", 150: "sql_net", 175: "vmnet", 179: "bgp",
+    194: "IRC", 210: "Z39_50", 389: "ldap", 433: "nnsp", 443: "http_443", 512: "exec",
+    513: "login", 514: "shell", 515: "printer", 520: "efs", 530: "courier", 540: "uucp",
+    543: "klogin", 544: "kshell", 2784: "http_2784", 5190: "aol", 6667: "IRC", 8001: "http_8001",
+    **{port: "X11" for port in range(6000, 6064)},
+}
+UDP_SERVICES = {53: "domain_u", 69: "tftp_u", 123: "ntp_u", 137: "netbios_ns", 138: "netbios_dgm"}
+# Tipo ICMP (Zeek lo guarda en id.orig_p) -> servicio KDD
+ICMP_SERVICES = {0: "ecr_i", 8: "eco_i", 5: "red_i", 13: "tim_i", 14: "tim_i"}
+
+# conn_state de Zeek -> flag KDD (los estados sin equivalente van al más cercano)
+ZEEK_FLAGS = {
+    "S0": "S0", "S1": "S1", "S2": "S2", "S3": "S3", "SF": "SF", "REJ": "REJ",
+    "RSTO": "RSTO", "RSTR": "RSTR", "RSTOS0": "RSTOS0", "RSTRH": "RSTR",
+    "SH": "SH", "SHR": "SH", "OTH": "OTH",
+}
+
+ZEEK_FIELDS = ("ts", "id.orig_h", "id.orig_p", "id.resp_h", "id.resp_p", "proto",
+               "duration", "orig_bytes", "resp_bytes", "conn_state")
+# Orden por defecto de conn.log cuando la entrada no trae cabecera `#fields`
+ZEEK_DEFAULT_FIELDS = ["ts", "uid", "id.orig_h", "id.orig_p", "id.resp_h", "id.resp_p", "proto",
+                       "service", "duration", "orig_bytes", "resp_bytes", "conn_state"]
+
+
+def kdd_service(protocol, src_port, dst_port):
+    """Servicio KDD a partir del protocolo y los puertos (tipo/código en ICMP)."""
+    if protocol == "tcp":
+        return TCP_SERVICES.get(dst_port, "private")
+    if protocol == "udp":
+        return UDP_SERVICES.get(dst_port, "private")
+    if src_port == 3:
+        return "urp_i" if dst_port == 3 else "urh_i"
+    return ICMP_SERVICES.get(src_port, "other")
+
+
+def zeek_connection(ts, src, src_port, dst, dst_port, proto, duration, orig_bytes, resp_bytes, state):
+    """Convierte los campos de una línea de conn.log en una conexión.
+
+    Devuelve una tupla simple con los campos de `Connection` (construir la
+    namedtuple cuesta más que extraer las características). Zeek escribe cada
+    conexión al terminar, así que `ts` se toma como el fin de la conexión
+    (inicio + duración): es el orden en que llegan al log. Los campos sin
+    valor (`-`) cuentan como 0.
+    """
+    src_port = int(src_port) if src_port != "-" else 0
+    dst_port = int(dst_port) if dst_port != "-" else 0
+    duration = float(duration) if duration != "-" else 0.0
+    if proto == "tcp":
+        service = TCP_SERVICES.get(dst_port, "private")
+        flag = ZEEK_FLAGS.get(state, "OTH")
+    else:
+        if proto not in ("udp", "icmp"):
+            proto = "tcp"
+        service = kdd_service(proto, src_port, dst_port)
+        flag = "SF" if proto != "tcp" else ZEEK_FLAGS.get(state, "OTH")
+    return (
+        float(ts) + duration, src, src_port, dst, dst_port, proto, service, flag,
+        int(duration), int(orig_bytes) if orig_bytes != "-" else 0,
+        int(resp_bytes) if resp_bytes != "-" else 0, 0, 0, NO_CONTENT,
+    )
+
+
+def parse_zeek_tsv(lines, on_error=None):
+    """Genera conexiones desde un conn.log en TSV (con o sin cabecera).
+
+    Una línea mal formada lanza la excepción o, si se pasa `on_error`, se
+    descarta llamando a `on_error(línea, excepción)`.
+    """
+    index = [ZEEK_DEFAULT_FIELDS.index(f) for f in ZEEK_FIELDS]
+    getter, width = itemgetter(*index), max(index)
+    for line in lines:
+        if line.startswith("#"):
+            if line.startswith("#fields"):
+                names = line.rstrip("\r\n").split("\t")[1:]
+                missing = [f for f in ZEEK_FIELDS if f not in names]
+                if missing:
+                    raise ValueError(f"Faltan campos en el conn.log: {', '.join(missing)}")
+                index = [names.index(f) for f in ZEEK_FIELDS]
+                getter, width = itemgetter(*index), max(index)
+            continue
+        parts = line.rstrip("\r\n").split("\t")
+        if len(parts) > width:
+            try:
+                conn = zeek_connection(*getter(parts))
+            except ValueError as e:
+                if on_error is None:
+                    raise
+                on_error(line, e)
+                continue
+            yield conn
+        elif on_error is not None and line.strip():
+            on_error(line, ValueError(f"Se esperaban al menos {width + 1} campos"))
+
+
+def parse_zeek_json(lines, on_error=None):
+    """Genera conexiones desde un conn.log en JSON (un objeto por línea)."""
+    for line in lines:
+        if line.strip():
+            try:
+                record = json.loads(line)
+                conn = zeek_connection(*["-" if record.get(f) is None else record[f] for f in ZEEK_FIELDS])
+            except (ValueError, TypeError, AttributeError) as e:
+                if on_error is None:
+                    raise
+                on_error(line, e)
+                continue
+            yield conn
+
+
+PARSERS = {"zeek": parse_zeek_tsv, "json": parse_zeek_json}
+
+
+def open_lines(source):
+    """Líneas de texto de un archivo, de stdin (`-`) o de `tcp://host:puerto`."""
+    if source == "-":
+        return sys.stdin
+    if source.startswith("tcp://"):
+        host, _, port = source[len("tcp://"):].rpartition(":")
+        sock = socket.create_connection((host or "127.0.0.1", int(port)))
+        return sock.makefile("r", encoding="utf-8", errors="replace", newline="\n")
+    return open(source, "r", encoding="utf-8", errors="replace")
+
+
+def format_record(record):
+    return ",".join(map(str, record))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Calcula las características KDD de un flujo de conexiones.")
+    parser.add_argument("source", help="conn.log de Zeek, '-' para stdin o tcp://host:puerto")
+    parser.add_argument("-o", "--output", default="-", help="Archivo de salida (por defecto stdout)")
+    parser.add_argument("--format", choices=sorted(PARSERS), default="zeek",
+                        help="Formato del conn.log: TSV (zeek) o JSON")
+    parser.add_argument("--time-window", type=float, default=TIME_WINDOW,
+                        help="Ventana temporal en segundos")
+    parser.add_argument("--host-window", type=int, default=HOST_WINDOW,
+                        help="Ventana de host en número de conexiones")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    extractor = ConnectionFeatureExtractor(args.time_window, args.host_window)
+    lines = open_lines(args.source)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        for record in extractor.extract(PARSERS[args.format](lines)):
+            out.write(format_record(record) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if lines is not sys.stdin:
+            lines.close()
+    print(f"Conexiones procesadas: {extractor.n_connections}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""Lectura y escritura del dataset procesado en formato columnar tipado.
+
+`download_and_chunk.py` escribe, además de `KDD_TRAIN_FULL.csv`, un archivo
+`KDD_TRAIN_FULL.parquet` con tipos compactos (uint8 para one-hot, flags
+binarias y tasas). Los scripts de entrenamiento y evaluación cargan
+el Parquet cuando existe y recurren al CSV en caso contrario.
+
+`build_feature_matrix.py` materializa además X (float32) e y (uint8) como
+archivos `.npy` en `output/feature_matrix/`, ordenados según la división
+train/test estratificada. `load_split` los abre con `np.load(mmap_mode="r")`,
+de modo que cargar los datos no cuesta casi nada y los procesos que entrenan
+en paralelo comparten las mismas páginas de memoria.
+
+X se guarda traspuesta (`XT.npy`, columnas x filas): pandas almacena los
+DataFrames por columnas, así que el bloque interno del DataFrame es el propio
+memmap (o una vista con saltos) y joblib lo reconstruye correctamente en los
+procesos hijos. Con X en orden fila-mayor el bloque sería una vista traspuesta
+contigua, que joblib reconstruye con el orden equivocado (datos mezclados).
+
+Si el dataset viene deduplicado (columna `conteo` de `download_and_chunk.py`),
+el conteo no forma parte de X: se guarda aparte en `w.npy` y `load_split`
+lo devuelve como pesos de muestra con `with_weights=True`.
+"""
+import json
+import os
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+from kdd_schema import COUNT_COLUMN, LABEL_COLUMN, CATEGORICAL_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow es opcional: sin él solo se usa el CSV
+    pa = None
+    pq = None
+
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+OUTPUT_DIR = os.path.join(BASE_DIR, "output")
+PARQUET_NAME = "KDD_TRAIN_FULL.parquet"
+MATRIX_DIR = os.path.join(OUTPUT_DIR, "feature_matrix")
+MATRIX_LAYOUT = "columns"  # XT.npy: una fila por característica
+
+# División usada por todos los scripts de entrenamiento y evaluación
+TEST_SIZE = 0.20
+RANDOM_STATE = 42
+
+BINARY_COLUMNS = ["land", "logged_in", "root_shell", "is_host_login", "is_guest_login", LABEL_COLUMN]
+WIDE_COLUMNS = ["src_bytes", "dst_bytes"]
+
+
+def column_dtype(col: str) -> str:
+    """Tipo compacto para una columna del dataset procesado."""
+    if col in BINARY_COLUMNS or any(col.startswith(f"{c}_") for c in CATEGORICAL_COLUMNS):
+        return "uint8"
+    if col.endswith("_rate"):
+        # process_dataset trunca las tasas (0.0-1.0) a int, igual que
+        # `truncate_numeric` en el backend: solo pueden valer 0 o 1
+        return "uint8"
+    if col in WIDE_COLUMNS:
+        return "int64"
+    return "int32"
+
+
+def column_dtypes(columns) -> dict:
+    return {col: column_dtype(col) for col in columns}
+
+
+def to_columnar(df: pd.DataFrame) -> pd.DataFrame:
+    """Convierte el DataFrame procesado (todo int64) a tipos compactos."""
+    return df.astype(column_dtypes(df.columns))
+
+
+def parquet_available() -> bool:
+    return pq is not None
+
+
+def parquet_path_for(csv_path: str) -> str:
+    """Ruta del Parquet hermano de un CSV procesado."""
+    return os.path.splitext(csv_path)[0] + ".parquet"
+
+
+def save_columnar(df: pd.DataFrame, path: str) -> bool:
+    """Guarda `df` como Parquet tipado. Retorna False si pyarrow no está instalado."""
+    if not parquet_available():
+        print("pyarrow no está instalado: se omite el archivo Parquet")
+        return False
+    to_columnar(df).to_parquet(path, index=False)
+    return True
+
+
+class ColumnarWriter:
+    """Escritor incremental de Parquet para el modo streaming.
+
+    Cada llamada a `write` agrega un row group; todos los bloques deben tener
+    las mismas columnas (lo garantiza el esquema fijo de `kdd_schema`).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._writer = None
+
+    def write(self, df: pd.DataFrame):
+        table = pa.Table.from_pandas(to_columnar(df), preserve_index=False)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def find_dataset(csv_path: str):
+    """Localiza el dataset procesado, priorizando el Parquet sobre el CSV.
+
+    Busca el Parquet junto a `csv_path` y en `output/`; si no hay Parquet
+    utilizable retorna `csv_path` si existe, o None.
+    """
+    if parquet_available():
+        for candidate in (parquet_path_for(csv_path), os.path.join(OUTPUT_DIR, PARQUET_NAME)):
+            if os.path.exists(candidate):
+                return candidate
+    if os.path.exists(csv_path):
+        return csv_path
+    return None
+
+
+def load_processed_dataset(path: str, columns=None) -> pd.DataFrame:
+    """Carga el dataset procesado desde Parquet o CSV con tipos compactos."""
+    print(f"Cargando dataset desde: {path}")
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, columns=columns)
+    header = pd.read_csv(path, nrows=0).columns
+    return pd.read_csv(path, usecols=columns, dtype=column_dtypes(header))
+
+
+def _source_signature(path: str) -> dict:
+    st = os.stat(path)
+    return {"source": os.path.abspath(path), "source_size": st.st_size, "source_mtime_ns": st.st_mtime_ns}
+
+
+def build_feature_matrix(data_path: str, out_dir: str = MATRIX_DIR, test_size: float = TEST_SIZE,
+                         random_state: int = RANDOM_STATE) -> dict:
+    """Materializa X (traspuesta) e y en `.npy` con las filas ordenadas como [train | test].
+
+    X_train y X_test quedan así como rebanadas del mismo memmap (sin copias) y
+    en el mismo orden que devolvería `train_test_split`. También se
+    guardan los índices originales de cada partición. El manifiesto se escribe
+    al final, por lo que un lector nunca ve una matriz a medio construir.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    df = load_processed_dataset(data_path)
+    if LABEL_COLUMN not in df.columns:
+        raise SystemExit(f"No se encontró la columna '{LABEL_COLUMN}' en: {data_path}")
+    y = df.pop(LABEL_COLUMN).to_numpy(dtype=np.uint8)
+    w = df.pop(COUNT_COLUMN).to_numpy(dtype=np.uint32) if COUNT_COLUMN in df.columns else None
+    columns = list(df.columns)
+
+    train_idx, test_idx = train_test_split(
+        np.arange(len(y)), test_size=test_size, random_state=random_state, stratify=y
+    )
+    order = np.concatenate([train_idx, test_idx])
+
+    XT_out = np.lib.format.open_memmap(os.path.join(out_dir, "XT.npy"), mode="w+",
+                                       dtype=np.float32, shape=(len(columns), len(order)))
+    for j, col in enumerate(columns):
+        XT_out[j] = df[col].to_numpy(dtype=np.float32)[order]
+    XT_out.flush()
+    del XT_out
+
+    np.save(os.path.join(out_dir, "y.npy"), y[order])
+    w_path = os.path.join(out_dir, "w.npy")
+    if w is not None:
+        np.save(w_path, w[order])
+    elif os.path.exists(w_path):
+        os.remove(w_path)
+    np.save(os.path.join(out_dir, "train_idx.npy"), train_idx)
+    np.save(os.path.join(out_dir, "test_idx.npy"), test_idx)
+
+    manifest = dict(_source_signature(data_path), layout=MATRIX_LAYOUT, columns=columns, n_rows=int(len(order)),
+                    n_train=int(len(train_idx)), test_size=test_size, random_state=random_state,
+                    weighted=w is not None)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_feature_matrix(out_dir: str = MATRIX_DIR, data_path: str = None):
+    """Abre la matriz materializada en modo memmap.
+
+    Retorna None si no existe, o si `data_path` cambió desde que se construyó.
+    """
+    manifest_path = os.path.join(out_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if manifest.get("layout") != MATRIX_LAYOUT:
+        print(f"La matriz en {out_dir} usa un formato anterior; ejecuta scripts/build_feature_matrix.py")
+        return None
+
+    if data_path is not None and os.path.exists(data_path):
+        signature = _source_signature(data_path)
+        if any(manifest.get(k) != v for k, v in signature.items()):
+            print(f"La matriz en {out_dir} está desactualizada respecto a {data_path}; "
+                  "ejecuta scripts/build_feature_matrix.py")
+            return None
+
+    manifest["XT"] = np.load(os.path.join(out_dir, "XT.npy"), mmap_mode="r")
+    manifest["y"] = np.load(os.path.join(out_dir, "y.npy"), mmap_mode="r")
+    manifest["w"] = np.load(os.path.join(out_dir, "w.npy"), mmap_mode="r") if manifest.get("weighted") else None
+    return manifest
+
+
+def load_split(csv_path: str, with_weights: bool = False):
+    """Retorna (X_train, X_test, y_train, y_test) para los scripts de `scripts/`.
+
+    Usa la matriz memmap de `build_feature_matrix.py` si está al día; si no,
+    carga el dataset procesado y aplica la misma división estratificada. Los
+    DataFrames construidos sobre el memmap no copian los datos.
+
+    Con `with_weights=True` agrega (w_train, w_test): el conteo de cada fila
+    del dataset deduplicado (float64), o (None, None) si no está deduplicado.
+    """
+    data_path = find_dataset(csv_path)
+    matrix = load_feature_matrix(MATRIX_DIR, data_path)
+    if matrix is not None:
+        print(f"Usando matriz de características memmap en: {MATRIX_DIR}")
+        n_train = matrix["n_train"]
+        X = pd.DataFrame(matrix["XT"].T, columns=matrix["columns"], copy=False)
+        y = pd.Series(matrix["y"], name=LABEL_COLUMN, copy=False)
+        split = [X.iloc[:n_train], X.iloc[n_train:], y.iloc[:n_train], y.iloc[n_train:]]
+        if with_weights:
+            w = None if matrix["w"] is None else np.asarray(matrix["w"], dtype=np.float64)
+            split += [None, None] if w is None else [w[:n_train], w[n_train:]]
+        return split
+
+    if data_path is None:
+        raise SystemExit(f"CSV procesado no encontrado en: {csv_path}\nEjecuta primero scripts/download_and_chunk.py")
+
+    df = load_processed_dataset(data_path)
+    if LABEL_COLUMN not in df.columns:
+        raise SystemExit("No se encontró la columna 'binario' en el CSV procesado.")
+
+    X = df.drop(columns=[LABEL_COLUMN, COUNT_COLUMN], errors="ignore")
+    y = df[LABEL_COLUMN]
+    if COUNT_COLUMN not in df.columns:
+        split = train_test_split(X, y, test_size=TEST_SIZE, random_state=RANDOM_STATE, stratify=y)
+        return split + [None, None] if with_weights else split
+    w = df[COUNT_COLUMN].to_numpy(dtype=np.float64)
+    split = train_test_split(X, y, w, test_size=TEST_SIZE, random_state=RANDOM_STATE, stratify=y)
+    return split if with_weights else split[:4]
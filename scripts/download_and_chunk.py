@@ -10,14 +10,28 @@ Notas:
 """
 import os
 import sys
+import tempfile
 import pandas as pd
 import numpy as np
 import requests as rq
 
+from kdd_schema import (
+    RAW_COLUMNS, CATEGORICAL_COLUMNS, CATEGORIES, COUNT_COLUMN, LABEL_COLUMN, SCHEMA_PATH,
+    build_schema, processed_columns, save_schema, schema_from_columns,
+)
+from dataset_io import ColumnarWriter, parquet_available, parquet_path_for, save_columnar
+
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "content")
 # Cambiar a True para guardar un único archivo CSV procesado en lugar de dividir en chunks
 SAVE_SINGLE_CSV = True
+# Cambiar a True para procesar el archivo por bloques (memoria acotada, útil con el KDD'99 completo)
+STREAMING = False
+# Filas leídas por bloque en modo streaming
+STREAM_CHUNK_ROWS = 200_000
+# Colapsar las filas idénticas (características + etiqueta) en una sola con la
+# columna `conteo`; los trainers la usan como sample_weight
+DEDUPLICATE = True
 OUT_DIR = os.path.join(os.path.dirname(__file__), "..", "output")
 
 
@@ -43,32 +57,143 @@ def download_file(url: str, out_path: str) -> bool:
         return False
 
 
-def process_dataset(txt_path: str) -> pd.DataFrame:
-    cols = [
-        "duration","protocol_type","service","flag","src_bytes","dst_bytes","land","wrong_fragment",
-        "urgent","hot","num_failed_logins","logged_in","num_compromised","root_shell","su_attempted",
-        "num_root","num_file_creations","num_shells","num_access_files","num_outbound_cmds",
-        "is_host_login","is_guest_login","count","srv_count","serror_rate","srv_serror_rate",
-        "rerror_rate","srv_rerror_rate","same_srv_rate","diff_srv_rate","srv_diff_host_rate",
-        "dst_host_count","dst_host_srv_count","dst_host_same_srv_rate","dst_host_diff_srv_rate",
-        "dst_host_same_src_port_rate","dst_host_srv_diff_host_rate","dst_host_serror_rate",
-        "dst_host_srv_serror_rate","dst_host_rerror_rate","dst_host_srv_rerror_rate","class","difficulty"
-    ]
+def deduplicate(df: pd.DataFrame) -> pd.DataFrame:
+    """Colapsa las filas idénticas en una sola, con su número de apariciones
+    en la columna `conteo` (orden de primera aparición).
+
+    El KDD'99 está dominado por filas repetidas (sobre todo smurf y neptune):
+    entrenar con cada fila distinta ponderada por su conteo equivale a
+    entrenar con todas las copias, con una fracción de las filas.
+    """
+    # Grupos numerados en orden de primera aparición
+    groups = df.groupby(list(df.columns), sort=False, dropna=False).ngroup().to_numpy()
+    _, first, counts = np.unique(groups, return_index=True, return_counts=True)
+    unique = df.iloc[first].reset_index(drop=True)
+    unique[COUNT_COLUMN] = counts
+    return unique
+
 
+def process_dataset(txt_path: str, dedup: bool = DEDUPLICATE) -> pd.DataFrame:
     print(f"Leyendo CSV desde: {txt_path}")
-    df = pd.read_csv(txt_path, header=None, names=cols, low_memory=False)
+    df = pd.read_csv(txt_path, header=None, names=RAW_COLUMNS, low_memory=False)
 
-    # Crear columna binario
-    df["binario"] = [0 if valor == "normal" else 1 for valor in df["class"]]
+    # Crear columna binario (el KDD'99 original termina las etiquetas con ".")
+    df[LABEL_COLUMN] = (df["class"].astype(str).str.rstrip(".") != "normal").astype(int)
 
     tabla = df.drop("class", axis=1)
 
     # Dummies para columnas categóricas
-    tabla2 = pd.get_dummies(tabla, columns=["protocol_type", "service", "flag"]).astype(int)
+    tabla2 = pd.get_dummies(tabla, columns=CATEGORICAL_COLUMNS).astype(int)
+
+    if dedup:
+        n_rows = len(tabla2)
+        tabla2 = deduplicate(tabla2)
+        print(f"Filas únicas: {len(tabla2)} de {n_rows} ({len(tabla2) / n_rows:.1%})")
 
     return tabla2
 
 
+def encode_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    """Procesa un bloque crudo con el esquema fijo de `kdd_schema`.
+
+    A diferencia de `process_dataset`, las columnas one-hot no dependen de las
+    categorías presentes en el bloque: todos los bloques producen exactamente
+    las columnas de `processed_columns()`. Categorías desconocidas quedan con
+    todas sus columnas one-hot en 0.
+    """
+    df[LABEL_COLUMN] = (df["class"].astype(str).str.rstrip(".") != "normal").astype(int)
+    df = df.drop(columns="class")
+    for col in CATEGORICAL_COLUMNS:
+        df[col] = pd.Categorical(df[col], categories=CATEGORIES[col])
+    encoded = pd.get_dummies(df, columns=CATEGORICAL_COLUMNS)
+    return encoded.reindex(columns=processed_columns(), fill_value=0).astype(int)
+
+
+def _read_encoded_chunks(txt_path: str, chunk_rows: int):
+    """Lee el archivo crudo por bloques de `chunk_rows` filas y los codifica."""
+    print(f"Leyendo CSV por bloques de {chunk_rows} filas desde: {txt_path}")
+    dtypes = {col: "string" for col in CATEGORICAL_COLUMNS + ["class"]}
+    reader = pd.read_csv(txt_path, header=None, names=RAW_COLUMNS, dtype=dtypes, chunksize=chunk_rows)
+    for chunk in reader:
+        yield encode_chunk(chunk)
+
+
+def iter_deduplicated_chunks(txt_path: str, chunk_rows: int = STREAM_CHUNK_ROWS):
+    """Bloques con las filas únicas de todo el archivo y su `conteo` global.
+
+    Hace dos pasadas. La primera colapsa cada bloque, identifica cada fila por
+    un hash de 64 bits y guarda en un CSV temporal solo las filas que no
+    aparecieron en bloques anteriores, acumulando los conteos por hash. La
+    segunda relee el temporal por bloques y completa la columna `conteo`.
+    La memoria queda acotada por el bloque más un hash y un conteo por fila
+    única, y el orden es el de primera aparición, como en `deduplicate`.
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix=".csv", prefix="kdd_unique_")
+    try:
+        known = pd.Index([], dtype="uint64")
+        counts = np.zeros(0, dtype=np.int64)
+        n_rows = 0
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            for i, chunk in enumerate(_read_encoded_chunks(txt_path, chunk_rows)):
+                n_rows += len(chunk)
+                chunk = deduplicate(chunk)
+                features = chunk.drop(columns=COUNT_COLUMN)
+                hashes = pd.util.hash_pandas_object(features, index=False).to_numpy()
+                is_new = known.get_indexer(hashes) == -1
+                known = known.append(pd.Index(hashes[is_new]))
+                counts = np.concatenate([counts, np.zeros(int(is_new.sum()), dtype=np.int64)])
+                np.add.at(counts, known.get_indexer(hashes), chunk[COUNT_COLUMN].to_numpy())
+                features[is_new].to_csv(f, index=False, header=(i == 0))
+        print(f"Filas únicas: {len(counts)} de {n_rows} ({len(counts) / max(n_rows, 1):.1%})")
+
+        offset = 0
+        for chunk in pd.read_csv(tmp_path, chunksize=chunk_rows):
+            count = pd.Series(counts[offset:offset + len(chunk)], index=chunk.index, name=COUNT_COLUMN)
+            chunk = pd.concat([chunk, count], axis=1)
+            offset += len(chunk)
+            yield chunk
+    finally:
+        os.remove(tmp_path)
+
+
+def iter_processed_chunks(txt_path: str, chunk_rows: int = STREAM_CHUNK_ROWS, dedup: bool = False):
+    """Lee el archivo crudo por bloques de `chunk_rows` filas y los codifica.
+
+    Con `dedup` las filas repetidas se colapsan en todo el archivo, no solo
+    dentro de cada bloque (ver `iter_deduplicated_chunks`).
+    """
+    if dedup:
+        yield from iter_deduplicated_chunks(txt_path, chunk_rows)
+    else:
+        yield from _read_encoded_chunks(txt_path, chunk_rows)
+
+
+def process_dataset_streaming(txt_path: str, out_path: str, chunk_rows: int = STREAM_CHUNK_ROWS,
+                              parquet_path: str = None, dedup: bool = DEDUPLICATE) -> int:
+    """Procesa `txt_path` por bloques y escribe un único CSV de forma incremental.
+
+    Si se indica `parquet_path`, cada bloque se agrega también al Parquet tipado.
+    El pico de memoria depende de `chunk_rows` (y, con `dedup`, del número de
+    filas únicas), no del tamaño del archivo.
+    Retorna el número total de filas escritas.
+    """
+    ensure_dir(os.path.dirname(out_path))
+    total_rows = 0
+    columnar = ColumnarWriter(parquet_path) if parquet_path else None
+    try:
+        with open(out_path, "w", encoding="utf-8", newline="") as f:
+            for i, chunk in enumerate(iter_processed_chunks(txt_path, chunk_rows, dedup)):
+                chunk.to_csv(f, index=False, header=(i == 0))
+                if columnar is not None:
+                    columnar.write(chunk)
+                total_rows += len(chunk)
+                print(f"  Bloque {i+1}: {total_rows} filas procesadas")
+    finally:
+        if columnar is not None:
+            columnar.close()
+    return total_rows
+
+
 def chunk_and_save(df: pd.DataFrame, out_dir: str, chunk_size: int = 1500, prefix: str = "VPN_TRAIN_"):
     ensure_dir(out_dir)
     total_rows = len(df)
@@ -84,6 +209,30 @@ def chunk_and_save(df: pd.DataFrame, out_dir: str, chunk_size: int = 1500, prefi
     print(f"Se generaron {num_files} archivos CSV de aproximadamente {chunk_size} registros cada uno.")
 
 
+def chunk_and_save_streaming(txt_path: str, out_dir: str, chunk_size: int = 1500, prefix: str = "VPN_TRAIN_",
+                             chunk_rows: int = STREAM_CHUNK_ROWS, dedup: bool = DEDUPLICATE):
+    """Equivalente a `chunk_and_save` pero leyendo el archivo crudo por bloques
+    (con la misma deduplicación que `process_dataset`)."""
+    ensure_dir(out_dir)
+    num_files = 0
+    pending = None
+    for block in iter_processed_chunks(txt_path, chunk_rows, dedup):
+        if pending is not None:
+            block = pd.concat([pending, block], ignore_index=True)
+        full = (len(block) // chunk_size) * chunk_size
+        for start_row in range(0, full, chunk_size):
+            num_files += 1
+            out_path = os.path.join(out_dir, f"{prefix}{num_files}.csv")
+            block.iloc[start_row:start_row + chunk_size].to_csv(out_path, index=False)
+        pending = block.iloc[full:]
+
+    if pending is not None and len(pending) > 0:
+        num_files += 1
+        pending.to_csv(os.path.join(out_dir, f"{prefix}{num_files}.csv"), index=False)
+
+    print(f"Se generaron {num_files} archivos CSV de aproximadamente {chunk_size} registros cada uno.")
+
+
 def main():
     # URL provista en el prompt (nota: firma truncada)
     DATA_URL = (
@@ -120,9 +269,31 @@ def main():
 
         local_file = out_file
 
+    if STREAMING:
+        # El esquema fijo de kdd_schema define las columnas de todos los bloques
+        save_schema(build_schema())
+        print(f"Esquema de características guardado en: {SCHEMA_PATH}")
+
+        # Procesar por bloques escribiendo la salida de forma incremental
+        if SAVE_SINGLE_CSV:
+            out_path = os.path.join(os.path.abspath(OUT_DIR), "KDD_TRAIN_FULL.csv")
+            parquet_path = parquet_path_for(out_path) if parquet_available() else None
+            total_rows = process_dataset_streaming(local_file, out_path, parquet_path=parquet_path)
+            print(f"Archivo CSV procesado guardado en: {out_path} ({total_rows} filas)")
+            if parquet_path:
+                print(f"Archivo Parquet tipado guardado en: {parquet_path}")
+        else:
+            chunks_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "chunks"))
+            chunk_and_save_streaming(local_file, chunks_dir, chunk_size=1500, prefix="KDD_TRAIN_")
+        return
+
     # Procesar el archivo encontrado
     tabla2 = process_dataset(local_file)
 
+    # Guardar el esquema (orden de columnas y vocabularios) que usará el backend
+    save_schema(schema_from_columns(tabla2.columns))
+    print(f"Esquema de características guardado en: {SCHEMA_PATH}")
+
     if SAVE_SINGLE_CSV:
         # Guardar como un único archivo CSV procesado
         out_dir = os.path.abspath(OUT_DIR)
@@ -130,6 +301,11 @@ def main():
         out_path = os.path.join(out_dir, "KDD_TRAIN_FULL.csv")
         tabla2.to_csv(out_path, index=False)
         print(f"Archivo CSV procesado guardado en: {out_path}")
+
+        # Copia columnar tipada (uint8/int32/int64) que cargan los scripts de entrenamiento
+        parquet_path = parquet_path_for(out_path)
+        if save_columnar(tabla2, parquet_path):
+            print(f"Archivo Parquet tipado guardado en: {parquet_path}")
     else:
         # Guardar chunks en la carpeta chunks/ (raíz del proyecto)
         chunks_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "chunks"))
@@ -6,7 +6,6 @@ import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import plotly.figure_factory as ff
-from sklearn.model_selection import train_test_split
 from sklearn.metrics import (
     confusion_matrix,
     classification_report,
@@ -17,6 +16,9 @@ from sklearn.metrics import (
 from sklearn.inspection import permutation_importance
 import json
 
+from dataset_io import load_split
+from prediction_cache import holdout_proba, split_hash
+
 # Configuración de rutas
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 CSV_PATH = os.path.join(os.path.dirname(__file__), "KDD_TRAIN_FULL.csv")
@@ -35,28 +37,31 @@ def load_model_and_data():
 
     model = joblib.load(MODEL_PATH)
 
-    # Cargar datos
-    if not os.path.exists(CSV_PATH):
-        raise FileNotFoundError(f"Datos no encontrados en: {CSV_PATH}")
+    # Cargar datos con la misma división train/test (matriz memmap compartida si existe);
+    # con el dataset deduplicado, w_* es el conteo de cada fila
+    X_train, X_test, y_train, y_test, w_train, w_test = load_split(CSV_PATH, with_weights=True)
 
-    df = pd.read_csv(CSV_PATH)
-    X = df.drop(columns=["binario"])
-    y = df["binario"]
+    # Solo la distribución de clases necesita el dataset completo (una fila por conexión)
+    y_all = np.concatenate([y_train.to_numpy(), y_test.to_numpy()])
+    if w_train is not None:
+        y_all = np.repeat(y_all, np.concatenate([w_train, w_test]).astype(np.int64))
+    df = pd.DataFrame({"binario": y_all})
 
-    # Recrear la división train/test con la misma semilla
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.20, random_state=42, stratify=y
-    )
+    # Probabilidades de prueba: una sola inferencia compartida por todos los
+    # gráficos (o ninguna si compare_models.py ya las dejó en la caché)
+    y_proba, _, cached = holdout_proba("random_forest", model, MODEL_PATH, X_test, split_hash(X_test, y_test))
+    if cached:
+        print("Probabilidades de prueba leídas de la caché")
 
-    return model, X_train, X_test, y_train, y_test, df
+    return model, X_train, X_test, y_train, y_test, w_test, y_proba, df
 
 
-def create_confusion_matrix_heatmap(model, X_test, y_test):
+def create_confusion_matrix_heatmap(y_test, y_proba, sample_weight=None):
     """Crear matriz de confusión con Plotly."""
     print("Generando matriz de confusión...")
 
-    y_pred = model.predict(X_test)
-    cm = confusion_matrix(y_test, y_pred)
+    y_pred = (y_proba > 0.5).astype(int)
+    cm = confusion_matrix(y_test, y_pred, sample_weight=sample_weight).astype(int)
 
     # Crear etiquetas con porcentajes
     cm_normalized = cm.astype("float") / cm.sum(axis=1)[:, np.newaxis]
@@ -88,15 +93,12 @@ def create_confusion_matrix_heatmap(model, X_test, y_test):
     return fig
 
 
-def create_roc_curve(model, X_test, y_test):
+def create_roc_curve(y_test, y_proba, sample_weight=None):
     """Crear curva ROC."""
     print("Generando curva ROC...")
 
-    # Obtener probabilidades
-    y_proba = model.predict_proba(X_test)[:, 1]
-
     # Calcular ROC
-    fpr, tpr, _ = roc_curve(y_test, y_proba)
+    fpr, tpr, _ = roc_curve(y_test, y_proba, sample_weight=sample_weight)
     roc_auc = auc(fpr, tpr)
 
     fig = go.Figure()
@@ -135,12 +137,11 @@ def create_roc_curve(model, X_test, y_test):
     return fig
 
 
-def create_precision_recall_curve(model, X_test, y_test):
+def create_precision_recall_curve(y_test, y_proba, sample_weight=None):
     """Crear curva Precision-Recall."""
     print("Generando curva Precision-Recall...")
 
-    y_proba = model.predict_proba(X_test)[:, 1]
-    precision, recall, _ = precision_recall_curve(y_test, y_proba)
+    precision, recall, _ = precision_recall_curve(y_test, y_proba, sample_weight=sample_weight)
     pr_auc = auc(recall, precision)
 
     fig = go.Figure()
@@ -232,12 +233,11 @@ def create_class_distribution_plot(df):
     return fig
 
 
-def create_performance_summary(model, X_test, y_test):
+def create_performance_summary(y_test, y_proba, sample_weight=None):
     """Crear resumen de rendimiento del modelo."""
     print("Generando resumen de rendimiento...")
 
-    y_pred = model.predict(X_test)
-    y_proba = model.predict_proba(X_test)[:, 1]
+    y_pred = (y_proba > 0.5).astype(int)
 
     # Métricas
     from sklearn.metrics import (
@@ -249,11 +249,11 @@ def create_performance_summary(model, X_test, y_test):
     )
 
     metrics = {
-        "Accuracy": accuracy_score(y_test, y_pred),
-        "Precision": precision_score(y_test, y_pred),
-        "Recall": recall_score(y_test, y_pred),
-        "F1-Score": f1_score(y_test, y_pred),
-        "ROC-AUC": roc_auc_score(y_test, y_proba),
+        "Accuracy": accuracy_score(y_test, y_pred, sample_weight=sample_weight),
+        "Precision": precision_score(y_test, y_pred, sample_weight=sample_weight),
+        "Recall": recall_score(y_test, y_pred, sample_weight=sample_weight),
+        "F1-Score": f1_score(y_test, y_pred, sample_weight=sample_weight),
+        "ROC-AUC": roc_auc_score(y_test, y_proba, sample_weight=sample_weight),
     }
 
     # Crear gráfico de barras
@@ -293,15 +293,15 @@ def save_plots():
     os.makedirs(PLOTS_DIR, exist_ok=True)
 
     # Cargar datos y modelo
-    model, X_train, X_test, y_train, y_test, df = load_model_and_data()
+    model, X_train, X_test, y_train, y_test, w_test, y_proba, df = load_model_and_data()
 
     plots = {
-        "confusion_matrix": create_confusion_matrix_heatmap(model, X_test, y_test),
-        "roc_curve": create_roc_curve(model, X_test, y_test),
-        "precision_recall": create_precision_recall_curve(model, X_test, y_test),
+        "confusion_matrix": create_confusion_matrix_heatmap(y_test, y_proba, w_test),
+        "roc_curve": create_roc_curve(y_test, y_proba, w_test),
+        "precision_recall": create_precision_recall_curve(y_test, y_proba, w_test),
         "feature_importance": create_feature_importance_plot(model, X_train),
         "class_distribution": create_class_distribution_plot(df),
-        "performance_summary": create_performance_summary(model, X_test, y_test),
+        "performance_summary": create_performance_summary(y_test, y_proba, w_test),
     }
 
     # Guardar cada plot como HTML e imagen
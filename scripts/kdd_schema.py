@@ -0,0 +1,221 @@
+"""Esquema fijo de columnas del dataset KDD Cup 1999 / NSL-KDD.
+
+Define el orden de las columnas crudas y los vocabularios de las variables
+categóricas, de modo que el one-hot encoding produzca siempre las mismas
+columnas (en el mismo orden que `pd.get_dummies` sobre el dataset completo),
+independientemente de qué categorías aparezcan en un chunk o archivo concreto.
+
+El esquema se persiste en `output/kdd_feature_schema.json` y `KDDEncoder`
+lo usa para convertir registros crudos de 41 campos directamente en la
+matriz float32 que espera el modelo (entrenamiento y backend comparten así
+exactamente el mismo orden de columnas).
+"""
+import json
+import os
+
+import numpy as np
+
+# Columnas del archivo de texto original (KDDTrain.txt / DDTrain.txt)
+RAW_COLUMNS = [
+    "duration","protocol_type","service","flag","src_bytes","dst_bytes","land","wrong_fragment",
+    "urgent","hot","num_failed_logins","logged_in","num_compromised","root_shell","su_attempted",
+    "num_root","num_file_creations","num_shells","num_access_files","num_outbound_cmds",
+    "is_host_login","is_guest_login","count","srv_count","serror_rate","srv_serror_rate",
+    "rerror_rate","srv_rerror_rate","same_srv_rate","diff_srv_rate","srv_diff_host_rate",
+    "dst_host_count","dst_host_srv_count","dst_host_same_srv_rate","dst_host_diff_srv_rate",
+    "dst_host_same_src_port_rate","dst_host_srv_diff_host_rate","dst_host_serror_rate",
+    "dst_host_srv_serror_rate","dst_host_rerror_rate","dst_host_srv_rerror_rate","class","difficulty"
+]
+
+# Los 41 campos de una conexión (sin `class` ni `difficulty`)
+RAW_FEATURE_COLUMNS = [c for c in RAW_COLUMNS if c not in ("class", "difficulty")]
+
+LABEL_COLUMN = "binario"
+# Veces que aparece cada fila en el dataset crudo (dataset deduplicado). No es
+# una característica: los trainers la usan como `sample_weight`
+COUNT_COLUMN = "conteo"
+CATEGORICAL_COLUMNS = ["protocol_type", "service", "flag"]
+
+# Columnas numéricas en el orden en que quedan tras eliminar `class`
+NUMERIC_COLUMNS = [c for c in RAW_COLUMNS if c not in CATEGORICAL_COLUMNS and c != "class"]
+
+# Vocabularios en el orden lexicográfico que usa pd.get_dummies
+CATEGORIES = {
+    "protocol_type": ["icmp", "tcp", "udp"],
+    "service": [
+        "IRC", "X11", "Z39_50", "aol", "auth", "bgp", "courier", "csnet_ns", "ctf", "daytime",
+        "discard", "domain", "domain_u", "echo", "eco_i", "ecr_i", "efs", "exec", "finger", "ftp",
+        "ftp_data", "gopher", "harvest", "hostnames", "http", "http_2784", "http_443", "http_8001",
+        "imap4", "iso_tsap", "klogin", "kshell", "ldap", "link", "login", "mtp", "name",
+        "netbios_dgm", "netbios_ns", "netbios_ssn", "netstat", "nnsp", "nntp", "ntp_u", "other",
+        "pm_dump", "pop_2", "pop_3", "printer", "private", "red_i", "remote_job", "rje", "shell",
+        "smtp", "sql_net", "ssh", "sunrpc", "supdup", "systat", "telnet", "tftp_u", "tim_i", "time",
+        "urh_i", "urp_i", "uucp", "uucp_path", "vmnet", "whois",
+    ],
+    "flag": ["OTH", "REJ", "RSTO", "RSTOS0", "RSTR", "S0", "S1", "S2", "S3", "SF", "SH"],
+}
+
+
+def dummy_columns(categories=None):
+    """Nombres de las columnas one-hot (`<columna>_<categoria>`) en orden."""
+    categories = categories or CATEGORIES
+    return [f"{col}_{cat}" for col in CATEGORICAL_COLUMNS for cat in categories[col]]
+
+
+def processed_columns(categories=None):
+    """Columnas del CSV procesado, igual que las genera `process_dataset`."""
+    return NUMERIC_COLUMNS + [LABEL_COLUMN] + dummy_columns(categories)
+
+
+def feature_columns(categories=None):
+    """Columnas de entrada del modelo (CSV procesado sin `binario`)."""
+    return NUMERIC_COLUMNS + dummy_columns(categories)
+
+
+SCHEMA_VERSION = 1
+SCHEMA_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "output", "kdd_feature_schema.json"))
+
+
+def build_schema(categories=None) -> dict:
+    """Esquema serializable: orden de columnas y vocabularios categóricos.
+
+    `truncate_numeric` refleja que `process_dataset` convierte todo a int, por
+    lo que las tasas (0.0-1.0) se truncan antes de entrenar.
+    """
+    categories = categories or CATEGORIES
+    return {
+        "version": SCHEMA_VERSION,
+        "label": LABEL_COLUMN,
+        "numeric_columns": list(NUMERIC_COLUMNS),
+        "categories": {col: list(categories[col]) for col in CATEGORICAL_COLUMNS},
+        "feature_columns": feature_columns(categories),
+        "truncate_numeric": True,
+    }
+
+
+def schema_from_columns(columns) -> dict:
+    """Reconstruye el esquema a partir de las columnas de un dataset procesado o
+    de `model.feature_names_in_`, respetando su orden exacto."""
+    columns = [c for c in columns if c not in (LABEL_COLUMN, COUNT_COLUMN)]
+    categories = {col: [] for col in CATEGORICAL_COLUMNS}
+    for c in columns:
+        for col in CATEGORICAL_COLUMNS:
+            if c.startswith(f"{col}_"):
+                categories[col].append(c[len(col) + 1:])
+                break
+    schema = build_schema(categories)
+    schema["feature_columns"] = list(columns)
+    return schema
+
+
+def save_schema(schema: dict, path: str = SCHEMA_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(schema, f, indent=2)
+
+
+def load_schema(path: str = SCHEMA_PATH, fallback_columns=None) -> dict:
+    """Carga el esquema guardado; si no existe lo deriva de `fallback_columns`
+    (p. ej. `model.feature_names_in_`) o usa el vocabulario por defecto."""
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    if fallback_columns is not None:
+        return schema_from_columns(fallback_columns)
+    return build_schema()
+
+
+class KDDEncoder:
+    """Codificador vectorizado de registros KDD a la matriz densa del modelo.
+
+    Acepta registros crudos de 41 campos (sin etiqueta), 42 (con `class`) o
+    43 (con `class` y `difficulty`). Cuando falta `difficulty` se rellena con 0.
+    Las categorías desconocidas dejan sus columnas one-hot en 0.
+    """
+
+    def __init__(self, schema: dict = None):
+        schema = schema or build_schema()
+        self.schema = schema
+        self.feature_columns = list(schema["feature_columns"])
+        self.n_features = len(self.feature_columns)
+        self.truncate = schema.get("truncate_numeric", True)
+
+        col_index = {c: i for i, c in enumerate(self.feature_columns)}
+        self._numeric = [(c, col_index[c]) for c in schema["numeric_columns"] if c in col_index]
+        self._lookup = {
+            col: {cat: col_index[f"{col}_{cat}"] for cat in schema["categories"][col]
+                  if f"{col}_{cat}" in col_index}
+            for col in CATEGORICAL_COLUMNS
+        }
+
+    def _finish(self, X: np.ndarray) -> np.ndarray:
+        if self.truncate:
+            np.trunc(X, out=X)
+        return X
+
+    def _one_hot(self, X: np.ndarray, col: str, values):
+        """Activa las columnas one-hot de `col` resolviendo cada valor único una sola vez."""
+        uniques, inverse = np.unique(np.asarray(values).astype(str), return_inverse=True)
+        lookup = self._lookup[col]
+        targets = np.array([lookup.get(u, -1) for u in uniques], dtype=np.int64)[inverse.ravel()]
+        known = targets >= 0
+        X[np.flatnonzero(known), targets[known]] = 1.0
+
+    def encode_raw(self, records) -> np.ndarray:
+        """Codifica una secuencia de registros crudos (listas/tuplas de campos)."""
+        if len(records) == 0:
+            return np.zeros((0, self.n_features), dtype=np.float32)
+        if not isinstance(records[0], (list, tuple, np.ndarray)):
+            records = [records]
+        arr = np.asarray(records, dtype=object)
+        if arr.ndim != 2:
+            raise ValueError("Todos los registros deben tener el mismo número de campos")
+        n_fields = arr.shape[1]
+        if n_fields == len(RAW_FEATURE_COLUMNS):
+            names = RAW_FEATURE_COLUMNS
+        elif n_fields in (len(RAW_COLUMNS) - 1, len(RAW_COLUMNS)):
+            names = RAW_COLUMNS[:n_fields]
+        else:
+            raise ValueError(f"Se esperaban 41, 42 o 43 campos por registro y se recibieron {n_fields}")
+        raw_index = {c: i for i, c in enumerate(names)}
+
+        X = np.zeros((arr.shape[0], self.n_features), dtype=np.float32)
+        present = [(raw_index[c], j) for c, j in self._numeric if c in raw_index]
+        if present:
+            src, dst = zip(*present)
+            X[:, list(dst)] = arr[:, list(src)].astype(np.float32)
+        for col in CATEGORICAL_COLUMNS:
+            self._one_hot(X, col, arr[:, raw_index[col]])
+        return self._finish(X)
+
+    def encode_records(self, records) -> np.ndarray:
+        """Codifica una lista de dicts con claves de `RAW_COLUMNS`."""
+        X = np.zeros((len(records), self.n_features), dtype=np.float32)
+        for c, j in self._numeric:
+            X[:, j] = np.fromiter((float(r.get(c, 0)) for r in records), dtype=np.float32, count=len(records))
+        for col in CATEGORICAL_COLUMNS:
+            self._one_hot(X, col, [r.get(col, "") for r in records])
+        return self._finish(X)
+
+    def encode_frame(self, df) -> np.ndarray:
+        """Codifica un DataFrame con columnas crudas (`protocol_type`, `service`, ...)."""
+        X = np.zeros((len(df), self.n_features), dtype=np.float32)
+        for c, j in self._numeric:
+            if c in df.columns:
+                X[:, j] = df[c].to_numpy(dtype=np.float32)
+        for col in CATEGORICAL_COLUMNS:
+            self._one_hot(X, col, df[col].to_numpy())
+        return self._finish(X)
+
+    def align(self, df) -> np.ndarray:
+        """Reordena un DataFrame ya procesado (one-hot) al orden del esquema.
+
+        Las columnas one-hot ausentes se rellenan con 0 y las sobrantes se descartan.
+        """
+        return df.reindex(columns=self.feature_columns, fill_value=0).to_numpy(dtype=np.float32)
+
+
+def labels_from_classes(classes) -> np.ndarray:
+    """Etiqueta binaria (0 normal, 1 ataque) a partir de la columna `class`."""
+    classes = np.char.rstrip(np.asarray(classes).astype(str), ".")
+    return (classes != "normal").astype(np.uint8)
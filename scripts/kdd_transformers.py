@@ -0,0 +1,62 @@
+"""Transformadores de scikit-learn específicos del dataset KDD.
+
+Se guardan dentro de los pipelines serializados con joblib, por lo que este
+módulo debe poder importarse al cargar el modelo (el backend agrega
+`scripts/` al sys.path).
+"""
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils.validation import check_is_fitted, validate_data
+
+from kdd_schema import CATEGORICAL_COLUMNS
+
+
+class OneHotToOrdinal(TransformerMixin, BaseEstimator):
+    """Colapsa los grupos one-hot (`protocol_type_*`, `service_*`, `flag_*`) en
+    una columna ordinal por variable categórica.
+
+    Permite entrenar modelos con soporte categórico nativo (p. ej.
+    HistGradientBoostingClassifier) sin cambiar el formato de entrada: el
+    pipeline sigue recibiendo las mismas columnas one-hot que el resto de
+    modelos. Las columnas numéricas se conservan en su orden original y las
+    ordinales se agregan al final. Una fila sin ninguna categoría activa se
+    codifica como NaN (valor faltante).
+    """
+
+    def fit(self, X, y=None):
+        X = validate_data(self, X, dtype=np.float32, ensure_all_finite="allow-nan", reset=True)
+        names = getattr(self, "feature_names_in_", None)
+        if names is None:
+            raise ValueError("OneHotToOrdinal necesita un DataFrame con los nombres de columna")
+
+        self.groups_ = {}
+        grouped = set()
+        for col in CATEGORICAL_COLUMNS:
+            idx = [i for i, name in enumerate(names) if name.startswith(f"{col}_")]
+            self.groups_[col] = np.array(idx, dtype=np.intp)
+            grouped.update(idx)
+        self.numeric_idx_ = np.array([i for i in range(len(names)) if i not in grouped], dtype=np.intp)
+        return self
+
+    @property
+    def categorical_idx_(self):
+        """Posiciones de las columnas ordinales en la salida de `transform`."""
+        start = len(self.numeric_idx_)
+        return list(range(start, start + len(CATEGORICAL_COLUMNS)))
+
+    def transform(self, X):
+        check_is_fitted(self, "groups_")
+        X = validate_data(self, X, dtype=np.float32, ensure_all_finite="allow-nan", reset=False)
+        out = np.empty((X.shape[0], len(self.numeric_idx_) + len(CATEGORICAL_COLUMNS)), dtype=np.float32)
+        out[:, :len(self.numeric_idx_)] = X[:, self.numeric_idx_]
+        for j, col in enumerate(CATEGORICAL_COLUMNS):
+            block = X[:, self.groups_[col]]
+            codes = block.argmax(axis=1).astype(np.float32) if block.shape[1] else np.zeros(len(X), np.float32)
+            codes[block.max(axis=1, initial=0) <= 0] = np.nan
+            out[:, len(self.numeric_idx_) + j] = codes
+        return out
+
+    def get_feature_names_out(self, input_features=None):
+        check_is_fitted(self, "groups_")
+        numeric = [self.feature_names_in_[i] for i in self.numeric_idx_]
+        return np.asarray(numeric + list(CATEGORICAL_COLUMNS), dtype=object)
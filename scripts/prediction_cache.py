@@ -0,0 +1,152 @@
+"""Caché en disco de probabilidades out-of-fold (OOF) y de holdout por modelo.
+
+Cada entrada guarda el vector de probabilidades de la clase ataque (float32)
+de un modelo sobre una partición concreta y se identifica por:
+
+ - el hash del artefacto joblib del modelo (si se reentrena, la entrada deja
+   de ser válida), y
+ - el hash de la partición: nombres de columnas, X, y y, para las OOF, la
+   configuración de los folds.
+
+Con KDD_SAVE_OOF=1 los trainers de los modelos base del Voting Classifier
+guardan las OOF de su mejor configuración (con los mismos folds de la
+búsqueda, a costa de 3 entrenamientos más) y el Voting Classifier en modo
+prefit las combina; las que falten las calcula y guarda él mismo.
+`compare_models.py` y `generate_visualizations.py` guardan y reutilizan las
+del conjunto de prueba. Las entradas se escriben en
+`output/predictions/<modelo>/<tipo>-<hash modelo>-<hash partición>.npy` junto
+con un JSON de metadatos.
+"""
+import hashlib
+import json
+import os
+import time
+import numpy as np
+from sklearn.base import clone
+from sklearn.model_selection import cross_val_predict
+
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+PREDICTIONS_DIR = os.path.join(BASE_DIR, "output", "predictions")
+KEY_LENGTH = 16  # caracteres del hash usados en los nombres de archivo
+
+_artifact_hashes = {}
+
+
+def artifact_hash(path: str) -> str:
+    """SHA-256 del artefacto del modelo (memorizado por tamaño y mtime)."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo_key not in _artifact_hashes:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        _artifact_hashes[memo_key] = h.hexdigest()
+    return _artifact_hashes[memo_key]
+
+
+def split_hash(X, y, cv=None, sample_weight=None) -> str:
+    """Hash de una partición (X, y) y, opcionalmente, de los folds `cv` y los
+    pesos de muestra.
+
+    X se recorre columna a columna en float32, por lo que el hash es el mismo
+    si los datos vienen del CSV, del Parquet o de la matriz memmap.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps([str(c) for c in X.columns]).encode("utf-8"))
+    h.update(np.ascontiguousarray(np.asarray(y), dtype=np.uint8).data)
+    for col in X.columns:
+        h.update(np.ascontiguousarray(X[col].to_numpy(dtype=np.float32)).data)
+    if cv is not None:
+        h.update(repr(cv).encode("utf-8"))
+    if sample_weight is not None:
+        h.update(np.ascontiguousarray(sample_weight, dtype=np.float64).data)
+    return h.hexdigest()
+
+
+def _entry_path(model_name: str, kind: str, model_key: str, split: str) -> str:
+    return os.path.join(PREDICTIONS_DIR, model_name, f"{kind}-{model_key[:KEY_LENGTH]}-{split[:KEY_LENGTH]}.npy")
+
+
+def load_predictions(model_name: str, kind: str, model_path: str, split: str):
+    """Retorna (probabilidades, metadatos) o None si no hay entrada válida."""
+    if not os.path.exists(model_path):
+        return None
+    path = _entry_path(model_name, kind, artifact_hash(model_path), split)
+    meta_path = os.path.splitext(path)[0] + ".json"
+    if not (os.path.exists(path) and os.path.exists(meta_path)):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return np.load(path), meta
+
+
+def save_predictions(model_name: str, kind: str, proba, model_path: str, split: str, **meta) -> str:
+    """Guarda una entrada y elimina las del mismo tipo de artefactos anteriores."""
+    model_key = artifact_hash(model_path)
+    path = _entry_path(model_name, kind, model_key, split)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    model_dir = os.path.dirname(path)
+    for name in os.listdir(model_dir):
+        if name.startswith(f"{kind}-") and not name.startswith(f"{kind}-{model_key[:KEY_LENGTH]}-"):
+            os.remove(os.path.join(model_dir, name))
+
+    proba = np.asarray(proba, dtype=np.float32)
+    # Metadatos primero y el .npy al final con rename atómico: un lector nunca
+    # ve una entrada incompleta
+    meta = dict(meta, model=model_name, kind=kind, artifact_sha256=model_key, split=split,
+                n_rows=int(len(proba)), created=time.strftime("%Y-%m-%d %H:%M:%S"))
+    with open(os.path.splitext(path)[0] + ".json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, proba)
+    os.replace(tmp_path, path)
+    return path
+
+
+def compute_oof(estimator, X, y, cv, n_jobs=None, sample_weight=None) -> np.ndarray:
+    """Probabilidades OOF de la clase 1 para una copia sin entrenar de `estimator`
+    (entrenada en cada fold con `sample_weight`, si se indica).
+
+    Si `estimator` pide `sample_weight` (como el `best_estimator_` de una búsqueda
+    ponderada), debe llamarse dentro de `search_config.weight_routing`.
+    """
+    params = None if sample_weight is None else {"sample_weight": sample_weight}
+    proba = cross_val_predict(clone(estimator), X, y, cv=cv, method="predict_proba", n_jobs=n_jobs,
+                              params=params)
+    return proba[:, 1].astype(np.float32)
+
+
+def oof_requested() -> bool:
+    """Si los trainers deben calcular y guardar sus OOF (KDD_SAVE_OOF=1)."""
+    return os.environ.get("KDD_SAVE_OOF", "0").strip().lower() in ("1", "true", "yes")
+
+
+def save_oof(model_name: str, proba, model_path: str, split: str) -> str:
+    return save_predictions(model_name, "oof", proba, model_path, split)
+
+
+def load_oof(model_name: str, model_path: str, split: str):
+    """Probabilidades OOF de `model_name` para el artefacto y la partición dados, o None."""
+    entry = load_predictions(model_name, "oof", model_path, split)
+    return None if entry is None else entry[0]
+
+
+def holdout_proba(model_name: str, model, model_path: str, X_test, split: str):
+    """Probabilidades de la clase 1 sobre el conjunto de prueba, desde la caché
+    o calculadas (y guardadas) con `model.predict_proba`.
+
+    Retorna (probabilidades, segundos de inferencia, si venían de la caché);
+    para una entrada en caché el tiempo es el medido al calcularla.
+    """
+    entry = load_predictions(model_name, "holdout", model_path, split)
+    if entry is not None:
+        proba, meta = entry
+        return proba, meta["predict_seconds"], True
+    start = time.time()
+    proba = model.predict_proba(X_test)[:, 1].astype(np.float32)
+    seconds = time.time() - start
+    save_predictions(model_name, "holdout", proba, model_path, split, predict_seconds=seconds)
+    return proba, seconds, False
@@ -0,0 +1,224 @@
+"""Configuración compartida de la búsqueda de hiperparámetros.
+
+Centraliza los espacios de búsqueda y el presupuesto de cada trainer y permite
+elegir entre dos modos:
+
+ - "random":  RandomizedSearchCV con pocos candidatos evaluados sobre todo el
+              conjunto de entrenamiento (comportamiento original).
+ - "halving": HalvingRandomSearchCV (successive halving). Evalúa muchos
+              candidatos sobre submuestras pequeñas de cada fold estratificado,
+              promueve solo a los mejores (1/`factor` en cada ronda) a
+              submuestras más grandes y reentrena al ganador con todos los datos.
+
+El modo se elige con la variable de entorno KDD_SEARCH_MODE (por defecto
+`SEARCH_MODE`), de modo que `train_all_models.py` puede propagarlo a todos los
+scripts sin modificarlos.
+
+KDD_N_JOBS limita los procesos/hilos de joblib que usan la búsqueda y los
+estimadores (ver `limit_n_jobs`); `train_all_models.py` lo fija a los núcleos
+reservados para cada etapa.
+
+Con un dataset deduplicado, `make_search(..., weighted=True)` entrena cada
+candidato con el conteo de cada fila como `sample_weight` y puntúa los folds
+con el mismo peso (enrutamiento de metadatos de scikit-learn), de modo que la
+búsqueda equivale a la que se haría sobre todas las filas repetidas. El
+enrutamiento no se activa de forma global: el `fit` de la búsqueda debe
+ejecutarse dentro de `weight_routing`. AdaBoost no implementa el
+enrutamiento: se entrena con los pesos, pero sus folds se puntúan sin
+ponderar.
+"""
+import os
+import numpy as np
+import sklearn
+from scipy.stats import randint, uniform
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import RandomizedSearchCV, HalvingRandomSearchCV
+from sklearn.pipeline import Pipeline
+from sklearn.utils.class_weight import compute_class_weight
+
+
+SEARCH_MODE = "random"
+SEARCH_MODES = ("random", "halving")
+
+SEARCH_SPACES = {
+    "random_forest": {
+        "n_estimators": randint(50, 150),
+        "max_depth": randint(10, 30),
+        "min_samples_split": randint(2, 8),
+        "min_samples_leaf": randint(1, 5),
+        "max_features": ["sqrt", "log2"],
+    },
+    "adaboost": {
+        "n_estimators": randint(50, 200),
+        "learning_rate": uniform(0.01, 1.0),
+    },
+    "gradient_boosting": {
+        "n_estimators": randint(50, 200),
+        "learning_rate": uniform(0.01, 0.3),
+        "max_depth": randint(3, 10),
+        "min_samples_split": randint(2, 10),
+        "min_samples_leaf": randint(1, 5),
+        "subsample": uniform(0.6, 0.4),  # 0.6 a 1.0
+        "max_features": ["sqrt", "log2", None],
+    },
+    # Parámetros del paso "hgb" del pipeline de train_hist_gradient_boosting.py
+    "hist_gradient_boosting": {
+        "hgb__learning_rate": uniform(0.03, 0.27),
+        "hgb__max_leaf_nodes": randint(15, 128),
+        "hgb__max_depth": [None, 6, 10, 16],
+        "hgb__min_samples_leaf": randint(10, 100),
+        "hgb__l2_regularization": uniform(0.0, 1.0),
+    },
+}
+
+# Presupuesto por modelo:
+#  - n_iter / n_jobs / verbose: modo "random"
+#  - n_candidates / min_resources / factor: modo "halving". Con n_candidates="exhaust"
+#    se generan tantos candidatos como permita llegar a usar todas las muestras en la
+#    última ronda partiendo de `min_resources` muestras.
+SEARCH_BUDGETS = {
+    "random_forest": {
+        "n_iter": 5, "n_jobs": 1, "verbose": 1,
+        "n_candidates": "exhaust", "min_resources": 1000, "factor": 3,
+    },
+    "adaboost": {
+        "n_iter": 10, "n_jobs": 2, "verbose": 2,
+        "n_candidates": "exhaust", "min_resources": 1000, "factor": 3,
+    },
+    "gradient_boosting": {
+        "n_iter": 10, "n_jobs": 2, "verbose": 2,
+        "n_candidates": "exhaust", "min_resources": 1000, "factor": 3,
+    },
+    # HistGradientBoosting ya usa todos los núcleos por árbol (OpenMP)
+    "hist_gradient_boosting": {
+        "n_iter": 10, "n_jobs": 1, "verbose": 2,
+        "n_candidates": "exhaust", "min_resources": 1000, "factor": 3,
+    },
+}
+
+
+def search_mode():
+    """Modo de búsqueda activo (KDD_SEARCH_MODE o `SEARCH_MODE`)."""
+    mode = os.environ.get("KDD_SEARCH_MODE", SEARCH_MODE).strip().lower()
+    if mode not in SEARCH_MODES:
+        raise SystemExit(f"KDD_SEARCH_MODE inválido: {mode!r} (opciones: {', '.join(SEARCH_MODES)})")
+    return mode
+
+
+def cpu_budget():
+    """Núcleos disponibles para este proceso (KDD_N_JOBS), o None si no hay límite."""
+    value = os.environ.get("KDD_N_JOBS", "").strip()
+    return max(1, int(value)) if value else None
+
+
+def limit_n_jobs(n_jobs):
+    """`n_jobs` acotado por KDD_N_JOBS (sin límite, se devuelve tal cual)."""
+    budget = cpu_budget()
+    if budget is None:
+        return n_jobs
+    return budget if n_jobs is None or n_jobs < 0 else max(1, min(n_jobs, budget))
+
+
+def supports_routing(estimator) -> bool:
+    """Si `estimator` implementa el enrutamiento de metadatos de scikit-learn."""
+    with sklearn.config_context(enable_metadata_routing=True):
+        try:
+            estimator.get_metadata_routing()
+        except NotImplementedError:
+            return False
+    return True
+
+
+def weight_routing(estimator, sample_weight):
+    """Contexto de scikit-learn con el enrutamiento de metadatos activo solo si
+    se entrena con pesos y `estimator` lo implementa (como en `make_search`)."""
+    enabled = sample_weight is not None and supports_routing(estimator)
+    return sklearn.config_context(enable_metadata_routing=enabled)
+
+
+def request_sample_weight(estimator):
+    """Pide `sample_weight` en el `fit` de `estimator` (en un Pipeline, en su
+    último paso). Requiere el enrutamiento activo. Retorna `estimator`."""
+    target = estimator.steps[-1][1] if isinstance(estimator, Pipeline) else estimator
+    target.set_fit_request(sample_weight=True)
+    return estimator
+
+
+def weighted_scorer(scoring="f1"):
+    """Scorer de `scoring` que pondera cada fila con `sample_weight`.
+    Requiere el enrutamiento activo."""
+    return get_scorer(scoring).set_score_request(sample_weight=True)
+
+
+def fit_params(sample_weight):
+    """Parámetros extra de `fit`: {} sin pesos, {"sample_weight": w} con pesos."""
+    return {} if sample_weight is None else {"sample_weight": sample_weight}
+
+
+def balanced_class_weight(y, sample_weight=None):
+    """Equivalente de class_weight="balanced" que cuenta las filas ponderadas.
+
+    "balanced" en los estimadores de scikit-learn cuenta filas sin ponderar,
+    que en un dataset deduplicado son filas únicas y no conexiones.
+    """
+    if sample_weight is None:
+        return "balanced"
+    classes = np.unique(y)
+    weights = compute_class_weight("balanced", classes=classes, y=y, sample_weight=sample_weight)
+    return {int(c): float(w) for c, w in zip(classes, weights)}
+
+
+def make_search(model_name, estimator, cv, scoring="f1", random_state=42, mode=None, weighted=False):
+    """Construye el buscador de hiperparámetros configurado para `model_name`.
+
+    Con `weighted=True` el buscador espera `fit(X, y, sample_weight=w)`
+    dentro de `weight_routing(estimator, w)`.
+    """
+    mode = mode or search_mode()
+    params = SEARCH_SPACES[model_name]
+    budget = SEARCH_BUDGETS[model_name]
+    if weighted and supports_routing(estimator):
+        with sklearn.config_context(enable_metadata_routing=True):
+            estimator = request_sample_weight(estimator)
+            scoring = weighted_scorer(scoring)
+    elif weighted:
+        # Sin enrutamiento, scikit-learn pasa `sample_weight` al `fit` de cada
+        # fold, pero el scorer no lo recibe
+        print(f"{type(estimator).__name__} no admite enrutamiento de metadatos: "
+              "la búsqueda entrena con pesos y puntúa los folds sin ponderar")
+
+    if mode == "halving":
+        return HalvingRandomSearchCV(
+            estimator,
+            param_distributions=params,
+            n_candidates=budget["n_candidates"],
+            factor=budget["factor"],
+            resource="n_samples",
+            min_resources=budget["min_resources"],
+            cv=cv,
+            scoring=scoring,
+            refit=True,
+            n_jobs=limit_n_jobs(budget["n_jobs"]),
+            verbose=budget["verbose"],
+            random_state=random_state,
+        )
+
+    return RandomizedSearchCV(
+        estimator,
+        param_distributions=params,
+        n_iter=budget["n_iter"],
+        cv=cv,
+        scoring=scoring,
+        n_jobs=limit_n_jobs(budget["n_jobs"]),
+        verbose=budget["verbose"],
+        random_state=random_state,
+    )
+
+
+def describe_search(search):
+    """Resumen de una línea de la búsqueda ejecutada (para consola y métricas)."""
+    if isinstance(search, HalvingRandomSearchCV):
+        return (f"halving: {search.n_candidates_[0]} candidatos, {search.n_iterations_} rondas, "
+                f"recursos {search.n_resources_}")
+    return f"random: {len(search.cv_results_['params'])} candidatos"
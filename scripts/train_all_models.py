@@ -1,120 +1,405 @@
 """
 Script maestro para entrenar todos los modelos de ML
-Ejecuta el entrenamiento de todos los modelos secuencialmente
+
+Modela el pipeline como un grafo de dependencias:
+
+    build_feature_matrix -> {random_forest, adaboost, gradient_boosting,
+                             hist_gradient_boosting, voting}
+                         -> {tree_export, compare_models -> visualize_comparison}
+
+Los entrenamientos independientes se ejecutan en paralelo respetando un
+presupuesto de CPU y memoria configurable. Las etapas cuyas entradas no han
+cambiado desde la última ejecución exitosa se omiten, y al final se muestra
+un reporte de tiempos por etapa.
+
+Uso:
+  python scripts/train_all_models.py [--max-cpus N] [--max-mem-gb G] [--force] [--stages a,b]
+                                     [--search-mode random|halving]
 """
 import os
 import sys
-import subprocess
+import json
 import time
+import hashlib
+import argparse
+import subprocess
+
+from dataset_io import MATRIX_DIR, find_dataset
+from search_config import SEARCH_MODES, search_mode
+from tree_export import file_signature
 
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-SCRIPTS_DIR = os.path.dirname(__file__)
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_DIR = os.path.join(BASE_DIR, "output")
+LOGS_DIR = os.path.join(OUTPUT_DIR, "logs")
+STATE_PATH = os.path.join(OUTPUT_DIR, "pipeline_state.json")
+REPORT_PATH = os.path.join(OUTPUT_DIR, "pipeline_report.txt")
+CSV_PATH = os.path.join(SCRIPTS_DIR, "KDD_TRAIN_FULL.csv")
+MATRIX_MANIFEST = os.path.join(MATRIX_DIR, "manifest.json")
 
+# Módulos compartidos: si cambian, todas las etapas se consideran modificadas
+SHARED_MODULES = [os.path.join(SCRIPTS_DIR, m)
+                  for m in ("dataset_io.py", "kdd_schema.py", "search_config.py", "prediction_cache.py")]
 
-def run_script(script_name, description):
-    """Ejecuta un script de Python y muestra el progreso."""
-    print("\n" + "="*80)
-    print(f"🚀 {description}")
-    print("="*80)
-    
-    script_path = os.path.join(SCRIPTS_DIR, script_name)
-    
-    if not os.path.exists(script_path):
-        print(f"❌ Error: Script no encontrado: {script_path}")
-        return False
-    
-    start_time = time.time()
-    
+
+def _out(name):
+    return os.path.join(OUTPUT_DIR, name)
+
+
+# Grafo de etapas. `cpus` y `mem_gb` son la reserva de recursos de cada etapa;
+# el proceso de cada etapa se limita a los núcleos reservados (ver `stage_env`).
+STAGES = [
+    {
+        "name": "features",
+        "script": "build_feature_matrix.py",
+        "description": "Construyendo matriz de caracteristicas compartida",
+        "deps": [],
+        "inputs": [],  # el dataset procesado se resuelve en tiempo de ejecución
+        "outputs": [MATRIX_MANIFEST],
+        "cpus": 1,
+        "mem_gb": 2.0,
+    },
+    {
+        "name": "random_forest",
+        "script": "train_random_forest.py",
+        "uses_search": True,
+        "description": "Entrenando Random Forest",
+        "deps": ["features"],
+        "inputs": [MATRIX_MANIFEST],
+        "outputs": [_out("rf_kdd_model.joblib"), _out("rf_kdd_metrics.txt")],
+        "cpus": 2,
+        "mem_gb": 3.0,
+    },
+    {
+        "name": "adaboost",
+        "script": "train_adaboost.py",
+        "uses_search": True,
+        "description": "Entrenando AdaBoost",
+        "deps": ["features"],
+        "inputs": [MATRIX_MANIFEST],
+        "outputs": [_out("adaboost_kdd_model.joblib"), _out("adaboost_kdd_metrics.txt")],
+        "cpus": 2,
+        "mem_gb": 2.0,
+    },
+    {
+        "name": "gradient_boosting",
+        "script": "train_gradient_boosting.py",
+        "uses_search": True,
+        "description": "Entrenando Gradient Boosting Machine",
+        "deps": ["features"],
+        "inputs": [MATRIX_MANIFEST],
+        "outputs": [_out("gradient_boosting_kdd_model.joblib"), _out("gradient_boosting_kdd_metrics.txt")],
+        "cpus": 2,
+        "mem_gb": 2.0,
+    },
+    {
+        "name": "hist_gradient_boosting",
+        "script": "train_hist_gradient_boosting.py",
+        "uses_search": True,
+        "description": "Entrenando Histogram Gradient Boosting",
+        "deps": ["features"],
+        "inputs": [MATRIX_MANIFEST],
+        "outputs": [_out("hist_gradient_boosting_kdd_model.joblib"), _out("hist_gradient_boosting_kdd_metrics.txt")],
+        "cpus": 4,
+        "mem_gb": 2.0,
+    },
+    {
+        "name": "voting",
+        "script": "train_voting_classifier.py",
+        "description": "Ensamblando Voting Classifier (modelos base ya entrenados)",
+        # Modo prefit: reutiliza los artefactos y las probabilidades OOF de los trainers
+        "deps": ["features", "random_forest", "adaboost", "gradient_boosting"],
+        "inputs": [
+            MATRIX_MANIFEST,
+            _out("rf_kdd_model.joblib"),
+            _out("adaboost_kdd_model.joblib"),
+            _out("gradient_boosting_kdd_model.joblib"),
+        ],
+        "outputs": [_out("voting_classifier_kdd_model.joblib"), _out("voting_classifier_kdd_metrics.txt")],
+        "cpus": 1,
+        "mem_gb": 2.0,
+    },
+    {
+        "name": "export",
+        "script": "tree_export.py",
+        "description": "Exportando los ensembles al formato compacto (.trees)",
+        # Todos los trainers: el script exporta cada joblib de output/ (y omite hist_gradient_boosting)
+        "deps": ["random_forest", "adaboost", "gradient_boosting", "hist_gradient_boosting", "voting"],
+        "inputs": [
+            os.path.join(SCRIPTS_DIR, "tree_engine.py"),
+            _out("rf_kdd_model.joblib"),
+            _out("adaboost_kdd_model.joblib"),
+            _out("gradient_boosting_kdd_model.joblib"),
+            _out("hist_gradient_boosting_kdd_model.joblib"),
+            _out("voting_classifier_kdd_model.joblib"),
+        ],
+        "outputs": [
+            _out("rf_kdd_model.trees"),
+            _out("adaboost_kdd_model.trees"),
+            _out("gradient_boosting_kdd_model.trees"),
+            _out("voting_classifier_kdd_model.trees"),
+        ],
+        "cpus": 1,
+        "mem_gb": 1.0,
+    },
+    {
+        "name": "compare",
+        "script": "compare_models.py",
+        "description": "Comparacion de Modelos",
+        "deps": ["random_forest", "adaboost", "gradient_boosting", "hist_gradient_boosting", "voting"],
+        "inputs": [
+            MATRIX_MANIFEST,
+            _out("rf_kdd_model.joblib"),
+            _out("adaboost_kdd_model.joblib"),
+            _out("gradient_boosting_kdd_model.joblib"),
+            _out("hist_gradient_boosting_kdd_model.joblib"),
+            _out("voting_classifier_kdd_model.joblib"),
+        ],
+        "outputs": [_out("models_comparison.csv"), _out("models_comparison.txt")],
+        "cpus": 1,
+        "mem_gb": 2.0,
+    },
+    {
+        "name": "visualize",
+        "script": "visualize_comparison.py",
+        "description": "Visualizaciones Comparativas",
+        "deps": ["compare"],
+        "inputs": [_out("models_comparison.csv")],
+        "outputs": [],
+        "cpus": 1,
+        "mem_gb": 1.0,
+    },
+]
+
+
+def default_mem_gb():
+    """Memoria física total en GB (8 GB si no se puede determinar)."""
     try:
-        result = subprocess.run(
-            [sys.executable, script_path],
-            cwd=BASE_DIR,
-            capture_output=False,
-            text=True
-        )
-        
-        elapsed = time.time() - start_time
-        
-        if result.returncode == 0:
-            print(f"\n✅ {description} completado en {elapsed:.2f} segundos")
-            return True
-        else:
-            print(f"\n❌ {description} fallo con codigo {result.returncode}")
-            return False
-            
-    except Exception as e:
-        print(f"\n❌ Error ejecutando {script_name}: {e}")
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3
+    except (ValueError, OSError, AttributeError):
+        return 8.0
+
+
+def input_signature(path):
+    """Firma de una entrada de etapa para el manifiesto (None si no existe)."""
+    if not os.path.exists(path):
+        return None
+    return list(file_signature(path))
+
+
+def stage_inputs(stage):
+    paths = [os.path.join(SCRIPTS_DIR, stage["script"])] + SHARED_MODULES + list(stage["inputs"])
+    if stage["name"] == "features":
+        data_path = find_dataset(CSV_PATH)
+        if data_path is not None:
+            paths.append(data_path)
+    return paths
+
+
+def stage_signature(stage):
+    payload = {path: input_signature(path) for path in stage_inputs(stage)}
+    if stage.get("uses_search"):
+        payload["search_mode"] = search_mode()
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_state():
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+    with open(STATE_PATH, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+
+
+def is_up_to_date(stage, state):
+    """Una etapa está al día si sus entradas no cambiaron y sus salidas existen."""
+    previous = state.get(stage["name"])
+    if previous is None or previous.get("signature") != stage_signature(stage):
         return False
+    return all(os.path.exists(p) for p in stage["outputs"])
+
+
+def stage_env(cpus):
+    """Entorno del proceso de una etapa, limitado a los `cpus` núcleos que tiene reservados.
+
+    KDD_N_JOBS acota los procesos/hilos de joblib de la búsqueda y de los
+    estimadores (search_config.limit_n_jobs); las demás variables, los hilos de
+    OpenMP/BLAS (HistGradientBoosting) y de loky.
+    """
+    env = dict(os.environ)
+    env.update({var: str(cpus) for var in ("KDD_N_JOBS", "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                                      "MKL_NUM_THREADS", "LOKY_MAX_CPU_COUNT")})
+    return env
+
+
+def launch(stage, cpus):
+    """Inicia el script de la etapa en segundo plano, con su salida en output/logs/."""
+    os.makedirs(LOGS_DIR, exist_ok=True)
+    log_path = os.path.join(LOGS_DIR, f"{stage['name']}.log")
+    log_file = open(log_path, "w", encoding="utf-8")
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(SCRIPTS_DIR, stage["script"])],
+        cwd=BASE_DIR,
+        env=stage_env(cpus),
+        stdout=log_file,
+        stderr=subprocess.STDOUT,
+    )
+    return proc, log_file, log_path
+
+
+def run_pipeline(stages, max_cpus, max_mem_gb, force=False, poll_interval=0.5):
+    """Ejecuta el grafo de etapas y retorna {nombre: {"status", "elapsed"}}."""
+    state = load_state()
+    by_name = {s["name"]: s for s in stages}
+    results = {}
+    pending = [s["name"] for s in stages]
+    running = {}
+    free_cpus, free_mem = max_cpus, max_mem_gb
+
+    while pending or running:
+        # Lanzar las etapas listas que caben en el presupuesto disponible
+        for name in list(pending):
+            stage = by_name[name]
+            deps = [d for d in stage["deps"] if d in by_name]
+            if any(d not in results for d in deps):
+                continue
+
+            failed = [d for d in deps if results[d]["status"] not in ("ok", "omitida")]
+            if failed:
+                pending.remove(name)
+                results[name] = {"status": "bloqueada", "elapsed": 0.0}
+                print(f"⏭️  {stage['description']}: bloqueada por {', '.join(failed)}")
+                continue
+
+            if not force and is_up_to_date(stage, state):
+                pending.remove(name)
+                results[name] = {"status": "omitida", "elapsed": 0.0}
+                print(f"⏭️  {stage['description']}: sin cambios, se omite")
+                continue
+
+            # Una etapa mayor que el presupuesto total se ejecuta sola
+            cpus = min(stage["cpus"], max_cpus)
+            mem = min(stage["mem_gb"], max_mem_gb)
+            if cpus > free_cpus or mem > free_mem:
+                continue
+
+            pending.remove(name)
+            free_cpus -= cpus
+            free_mem -= mem
+            proc, log_file, log_path = launch(stage, cpus)
+            running[name] = (proc, log_file, time.time(), cpus, mem)
+            print(f"🚀 {stage['description']} (log: {os.path.relpath(log_path, BASE_DIR)})")
+
+        if not running:
+            if pending:
+                # Nada en ejecución y nada lanzable: dependencias imposibles de satisfacer
+                for name in pending:
+                    results[name] = {"status": "bloqueada", "elapsed": 0.0}
+                break
+            continue
+
+        time.sleep(poll_interval)
+        for name, (proc, log_file, start, cpus, mem) in list(running.items()):
+            if proc.poll() is None:
+                continue
+            log_file.close()
+            elapsed = time.time() - start
+            del running[name]
+            free_cpus += cpus
+            free_mem += mem
+
+            stage = by_name[name]
+            if proc.returncode == 0:
+                results[name] = {"status": "ok", "elapsed": elapsed}
+                state[name] = {"signature": stage_signature(stage), "finished_at": time.time()}
+                save_state(state)
+                print(f"✅ {stage['description']} completado en {elapsed:.2f} segundos")
+            else:
+                results[name] = {"status": "fallo", "elapsed": elapsed}
+                print(f"❌ {stage['description']} fallo con codigo {proc.returncode}")
+
+    return results
+
+
+def write_report(stages, results, total_time):
+    width = max([len("Etapa")] + [len(s["name"]) for s in stages])
+    lines = [
+        "=" * 80,
+        "REPORTE DE TIEMPOS POR ETAPA",
+        "=" * 80,
+        f"{'Etapa':<{width}} {'Estado':<12} {'Tiempo (s)':>12}",
+        "-" * 80,
+    ]
+    for stage in stages:
+        r = results.get(stage["name"], {"status": "no ejecutada", "elapsed": 0.0})
+        lines.append(f"{stage['name']:<{width}} {r['status']:<12} {r['elapsed']:>12.2f}")
+    lines.append("-" * 80)
+    lines.append(f"{'Total (pared)':<{width + 13}} {total_time:>12.2f}")
+
+    report = "\n".join(lines) + "\n"
+    os.makedirs(os.path.dirname(REPORT_PATH), exist_ok=True)
+    with open(REPORT_PATH, "w", encoding="utf-8") as f:
+        f.write(report)
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Entrena y compara todos los modelos en paralelo.")
+    parser.add_argument("--max-cpus", type=int, default=os.cpu_count() or 1,
+                        help="Núcleos disponibles para etapas concurrentes")
+    parser.add_argument("--max-mem-gb", type=float, default=default_mem_gb(),
+                        help="Memoria disponible (GB) para etapas concurrentes")
+    parser.add_argument("--force", action="store_true",
+                        help="Ejecuta todas las etapas aunque sus entradas no hayan cambiado")
+    parser.add_argument("--search-mode", choices=SEARCH_MODES, default=None,
+                        help="Modo de búsqueda de hiperparámetros para los trainers (ver search_config.py)")
+    parser.add_argument("--stages", default=None,
+                        help="Lista de etapas a ejecutar separadas por comas (por defecto todas)")
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
+    if args.search_mode:
+        # Los scripts hijos heredan el entorno
+        os.environ["KDD_SEARCH_MODE"] = args.search_mode
+
+    stages = STAGES
+    if args.stages:
+        selected = {s.strip() for s in args.stages.split(",")}
+        unknown = selected - {s["name"] for s in STAGES}
+        if unknown:
+            raise SystemExit(f"Etapas desconocidas: {', '.join(sorted(unknown))}")
+        stages = [s for s in STAGES if s["name"] in selected]
+
+    # Las OOF de los modelos base solo se calculan en los trainers (en paralelo)
+    # si el Voting Classifier prefit las va a usar
+    voting_retrain = os.environ.get("KDD_VOTING_MODE", "").strip().lower() == "retrain"
+    if any(s["name"] == "voting" for s in stages) and not voting_retrain:
+        os.environ["KDD_SAVE_OOF"] = "1"
+
     print("="*80)
     print("ENTRENAMIENTO COMPLETO DE MODELOS DE ML")
     print("Dataset: KDD Cup 1999 - Deteccion de Intrusiones")
     print("="*80)
-    print("\nEste script entrenara los siguientes modelos:")
-    print("  1. Random Forest")
-    print("  2. AdaBoost")
-    print("  3. Gradient Boosting Machine")
-    print("  4. Voting Classifier (Ensemble)")
-    print("\nTiempo estimado total: 30-60 minutos")
-    
-    input("\nPresiona ENTER para comenzar...")
-    
+    print(f"\nEtapas: {', '.join(s['name'] for s in stages)}")
+    print(f"Presupuesto: {args.max_cpus} CPUs, {args.max_mem_gb:.1f} GB")
+    print(f"Búsqueda de hiperparámetros: {search_mode()}\n")
+
     start_total = time.time()
-    
-    # Lista de scripts a ejecutar
-    training_scripts = [
-        ("train_random_forest.py", "Entrenando Random Forest"),
-        ("train_adaboost.py", "Entrenando AdaBoost"),
-        ("train_gradient_boosting.py", "Entrenando Gradient Boosting Machine"),
-        ("train_voting_classifier.py", "Entrenando Voting Classifier"),
-    ]
-    
-    results = {}
-    
-    # Ejecutar cada script
-    for script, description in training_scripts:
-        success = run_script(script, description)
-        results[description] = success
-        
-        if not success:
-            print(f"\n⚠️  Advertencia: {description} fallo")
-            response = input("¿Deseas continuar con los siguientes modelos? (s/n): ")
-            if response.lower() != 's':
-                print("\n❌ Entrenamiento cancelado por el usuario")
-                return
-    
-    # Ejecutar comparacion
-    print("\n" + "="*80)
-    print("COMPARANDO MODELOS")
-    print("="*80)
-    run_script("compare_models.py", "Comparacion de Modelos")
-    
-    # Ejecutar visualizaciones
-    print("\n" + "="*80)
-    print("GENERANDO VISUALIZACIONES")
-    print("="*80)
-    run_script("visualize_comparison.py", "Visualizaciones Comparativas")
-    
-    # Resumen final
+    results = run_pipeline(stages, args.max_cpus, args.max_mem_gb, force=args.force)
     total_time = time.time() - start_total
-    
-    print("\n" + "="*80)
-    print("RESUMEN FINAL")
-    print("="*80)
-    
-    successful = sum(1 for v in results.values() if v)
-    total = len(results)
-    
-    print(f"\nModelos entrenados exitosamente: {successful}/{total}")
-    print(f"Tiempo total: {total_time/60:.2f} minutos\n")
-    
-    for description, success in results.items():
-        status = "✅" if success else "❌"
-        print(f"{status} {description}")
-    
+
+    print("\n" + write_report(stages, results, total_time))
+    print(f"Reporte guardado en: {REPORT_PATH}")
+    print(f"Logs por etapa en: {LOGS_DIR}")
+
     print("\n" + "="*80)
     print("ARCHIVOS GENERADOS")
     print("="*80)
@@ -122,26 +407,31 @@ def main():
     print("  - rf_kdd_model.joblib")
     print("  - adaboost_kdd_model.joblib")
     print("  - gradient_boosting_kdd_model.joblib")
+    print("  - hist_gradient_boosting_kdd_model.joblib")
     print("  - voting_classifier_kdd_model.joblib")
-    
+
     print("\nMetricas guardadas en: output/")
     print("  - rf_kdd_metrics.txt")
     print("  - adaboost_kdd_metrics.txt")
     print("  - gradient_boosting_kdd_metrics.txt")
+    print("  - hist_gradient_boosting_kdd_metrics.txt")
     print("  - voting_classifier_kdd_metrics.txt")
     print("  - models_comparison.txt")
     print("  - models_comparison.csv")
-    
+
     print("\nVisualizaciones en: output/comparison_plots/")
     print("  - metrics_comparison.html/png")
     print("  - errors_comparison.html/png")
     print("  - performance_radar.html/png")
     print("  - ranking_table.html/png")
     print("  - Y mas...")
-    
+
+    failed = [name for name, r in results.items() if r["status"] in ("fallo", "bloqueada")]
     print("\n" + "="*80)
-    print("🎉 PROCESO COMPLETADO")
+    print("🎉 PROCESO COMPLETADO" if not failed else f"⚠️  PROCESO COMPLETADO CON ERRORES: {', '.join(failed)}")
     print("="*80 + "\n")
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
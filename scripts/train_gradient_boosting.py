@@ -1,10 +1,12 @@
 import os
 import joblib
-import pandas as pd
-from sklearn.model_selection import train_test_split, RandomizedSearchCV, StratifiedKFold
+from sklearn.model_selection import StratifiedKFold
 from sklearn.ensemble import GradientBoostingClassifier
 from sklearn.metrics import classification_report, confusion_matrix, accuracy_score, roc_auc_score
-from scipy.stats import randint, uniform
+
+from dataset_io import load_split
+from prediction_cache import compute_oof, oof_requested, save_oof, split_hash
+from search_config import describe_search, fit_params, make_search, weight_routing
 
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -14,49 +16,22 @@ METRICS_OUT = os.path.join(BASE_DIR, "output", "gradient_boosting_kdd_metrics.tx
 
 
 def main():
-    if not os.path.exists(CSV_PATH):
-        raise SystemExit(f"CSV procesado no encontrado en: {CSV_PATH}\nEjecuta primero scripts/download_and_chunk.py")
-
     print("Cargando datos...")
-    df = pd.read_csv(CSV_PATH)
-    if "binario" not in df.columns:
-        raise SystemExit("No se encontró la columna 'binario' en el CSV procesado.")
-
-    X = df.drop(columns=["binario"])
-    y = df["binario"]
-
-    # Split estratificado
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.20, random_state=42, stratify=y
-    )
+    # Split estratificado (usa la matriz memmap compartida si está construida).
+    # Con el dataset deduplicado, w_* es el conteo de cada fila (sample_weight)
+    X_train, X_test, y_train, y_test, w_train, w_test = load_split(CSV_PATH, with_weights=True)
+    if w_train is not None:
+        print(f"Dataset deduplicado: {len(X_train)} filas únicas de entrenamiento ({int(w_train.sum())} conexiones)")
 
     print(f"Datos cargados: {len(X_train)} train, {len(X_test)} test")
 
     # Gradient Boosting Classifier
     clf = GradientBoostingClassifier(random_state=42, verbose=0)
 
-    # Búsqueda de hiperparámetros
-    param_dist = {
-        "n_estimators": randint(50, 200),
-        "learning_rate": uniform(0.01, 0.3),
-        "max_depth": randint(3, 10),
-        "min_samples_split": randint(2, 10),
-        "min_samples_leaf": randint(1, 5),
-        "subsample": uniform(0.6, 0.4),  # 0.6 a 1.0
-        "max_features": ["sqrt", "log2", None]
-    }
-    
+    # Búsqueda de hiperparámetros (espacio y presupuesto en search_config.py;
+    # KDD_SEARCH_MODE=halving activa successive halving)
     cv = StratifiedKFold(n_splits=3, shuffle=True, random_state=42)
-    rsearch = RandomizedSearchCV(
-        clf, 
-        param_distributions=param_dist,
-        n_iter=10, 
-        cv=cv, 
-        scoring="f1", 
-        n_jobs=2, 
-        verbose=2, 
-        random_state=42
-    )
+    rsearch = make_search("gradient_boosting", clf, cv, weighted=w_train is not None)
 
     print("\n" + "="*70)
     print("🚀 ENTRENANDO GRADIENT BOOSTING MACHINE (GBM)")
@@ -64,27 +39,29 @@ def main():
     print("Iniciando búsqueda de hiperparámetros...")
     print("Esto puede tomar varios minutos...\n")
     
-    rsearch.fit(X_train, y_train)
+    with weight_routing(clf, w_train):
+        rsearch.fit(X_train, y_train, **fit_params(w_train))
 
     best = rsearch.best_estimator_
 
     print("\n" + "="*70)
     print("✅ Entrenamiento completado")
     print("="*70)
+    print(f"Búsqueda ({describe_search(rsearch)})")
     print(f"Mejores hiperparámetros: {rsearch.best_params_}")
     print(f"Mejor F1-Score (CV): {rsearch.best_score_:.4f}\n")
 
     # Evaluación en test
     print("Evaluando en conjunto de prueba...")
     y_pred = best.predict(X_test)
-    acc = accuracy_score(y_test, y_pred)
-    report = classification_report(y_test, y_pred, digits=4)
-    cm = confusion_matrix(y_test, y_pred)
+    acc = accuracy_score(y_test, y_pred, sample_weight=w_test)
+    report = classification_report(y_test, y_pred, digits=4, sample_weight=w_test)
+    cm = confusion_matrix(y_test, y_pred, sample_weight=w_test).astype(int)
 
     roc_auc = None
     if hasattr(best, "predict_proba") and len(set(y_test)) > 1:
         try:
-            roc_auc = roc_auc_score(y_test, best.predict_proba(X_test)[:, 1])
+            roc_auc = roc_auc_score(y_test, best.predict_proba(X_test)[:, 1], sample_weight=w_test)
         except Exception:
             roc_auc = None
 
@@ -92,6 +69,16 @@ def main():
     os.makedirs(os.path.dirname(MODEL_OUT), exist_ok=True)
     joblib.dump(best, MODEL_OUT)
 
+    # Probabilidades out-of-fold del mejor modelo con los mismos folds de la búsqueda.
+    # Cuestan 3 entrenamientos más, así que solo se calculan si se piden
+    # (train_all_models.py lo hace cuando el Voting Classifier prefit las va a usar)
+    oof_out = None
+    if oof_requested():
+        print("Calculando probabilidades out-of-fold (3-fold)...")
+        with weight_routing(best, w_train):
+            oof = compute_oof(best, X_train, y_train, cv, n_jobs=rsearch.n_jobs, sample_weight=w_train)
+        oof_out = save_oof("gradient_boosting", oof, MODEL_OUT, split_hash(X_train, y_train, cv, w_train))
+
     with open(METRICS_OUT, "w", encoding="utf-8") as f:
         f.write("="*70 + "\n")
         f.write("GRADIENT BOOSTING MACHINE - RESULTADOS\n")
@@ -115,6 +102,8 @@ def main():
         print(f"ROC-AUC: {roc_auc:.4f}")
     print(f"\nModelo guardado en: {MODEL_OUT}")
     print(f"Métricas guardadas en: {METRICS_OUT}")
+    if oof_out:
+        print(f"Probabilidades OOF guardadas en: {oof_out}")
     print("\nClassification Report:")
     print(report)
     print("="*70 + "\n")
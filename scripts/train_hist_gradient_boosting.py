@@ -0,0 +1,122 @@
+import os
+import joblib
+from sklearn.model_selection import StratifiedKFold
+from sklearn.pipeline import Pipeline
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.metrics import classification_report, confusion_matrix, accuracy_score, roc_auc_score
+
+from dataset_io import load_split
+from kdd_schema import CATEGORICAL_COLUMNS
+from kdd_transformers import OneHotToOrdinal
+from search_config import describe_search, fit_params, make_search, weight_routing
+
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CSV_PATH = os.path.join(os.path.dirname(__file__), "KDD_TRAIN_FULL.csv")
+MODEL_OUT = os.path.join(BASE_DIR, "output", "hist_gradient_boosting_kdd_model.joblib")
+METRICS_OUT = os.path.join(BASE_DIR, "output", "hist_gradient_boosting_kdd_metrics.txt")
+
+
+def main():
+    print("Cargando datos...")
+    # Split estratificado (usa la matriz memmap compartida si está construida).
+    # Con el dataset deduplicado, w_* es el conteo de cada fila (sample_weight)
+    X_train, X_test, y_train, y_test, w_train, w_test = load_split(CSV_PATH, with_weights=True)
+    if w_train is not None:
+        print(f"Dataset deduplicado: {len(X_train)} filas únicas de entrenamiento ({int(w_train.sum())} conexiones)")
+
+    print(f"Datos cargados: {len(X_train)} train, {len(X_test)} test")
+
+    # El pipeline recibe las mismas columnas one-hot que el resto de modelos y las
+    # colapsa en protocol_type/service/flag ordinales (al final de la matriz)
+    n_numeric = sum(
+        1 for c in X_train.columns if not any(c.startswith(f"{cat}_") for cat in CATEGORICAL_COLUMNS)
+    )
+    categorical = list(range(n_numeric, n_numeric + len(CATEGORICAL_COLUMNS)))
+
+    # Histogram Gradient Boosting: splits sobre histogramas, multinúcleo y early stopping
+    clf = Pipeline([
+        ("onehot", OneHotToOrdinal()),
+        ("hgb", HistGradientBoostingClassifier(
+            max_iter=500,
+            categorical_features=categorical,
+            early_stopping=True,
+            validation_fraction=0.1,
+            n_iter_no_change=10,
+            random_state=42,
+        )),
+    ])
+
+    # Búsqueda de hiperparámetros (espacio y presupuesto en search_config.py;
+    # KDD_SEARCH_MODE=halving activa successive halving)
+    cv = StratifiedKFold(n_splits=3, shuffle=True, random_state=42)
+    rsearch = make_search("hist_gradient_boosting", clf, cv, weighted=w_train is not None)
+
+    print("\n" + "="*70)
+    print("🚀 ENTRENANDO HISTOGRAM GRADIENT BOOSTING")
+    print("="*70)
+    print("Iniciando búsqueda de hiperparámetros...")
+    print("Esto puede tomar varios minutos...\n")
+    
+    with weight_routing(clf, w_train):
+        rsearch.fit(X_train, y_train, **fit_params(w_train))
+
+    best = rsearch.best_estimator_
+    n_iter = best.named_steps["hgb"].n_iter_
+
+    print("\n" + "="*70)
+    print("✅ Entrenamiento completado")
+    print("="*70)
+    print(f"Búsqueda ({describe_search(rsearch)})")
+    print(f"Mejores hiperparámetros: {rsearch.best_params_}")
+    print(f"Mejor F1-Score (CV): {rsearch.best_score_:.4f}")
+    print(f"Iteraciones (early stopping): {n_iter}\n")
+
+    # Evaluación en test
+    print("Evaluando en conjunto de prueba...")
+    y_pred = best.predict(X_test)
+    acc = accuracy_score(y_test, y_pred, sample_weight=w_test)
+    report = classification_report(y_test, y_pred, digits=4, sample_weight=w_test)
+    cm = confusion_matrix(y_test, y_pred, sample_weight=w_test).astype(int)
+
+    roc_auc = None
+    if hasattr(best, "predict_proba") and len(set(y_test)) > 1:
+        try:
+            roc_auc = roc_auc_score(y_test, best.predict_proba(X_test)[:, 1], sample_weight=w_test)
+        except Exception:
+            roc_auc = None
+
+    # Guardar modelo y métricas
+    os.makedirs(os.path.dirname(MODEL_OUT), exist_ok=True)
+    joblib.dump(best, MODEL_OUT)
+
+    with open(METRICS_OUT, "w", encoding="utf-8") as f:
+        f.write("="*70 + "\n")
+        f.write("HISTOGRAM GRADIENT BOOSTING - RESULTADOS\n")
+        f.write("="*70 + "\n\n")
+        f.write("Best params:\n")
+        f.write(str(rsearch.best_params_) + "\n\n")
+        f.write(f"Best F1-Score (CV): {rsearch.best_score_:.4f}\n\n")
+        f.write(f"Accuracy: {acc:.6f}\n")
+        if roc_auc is not None:
+            f.write(f"ROC AUC: {roc_auc:.6f}\n")
+        f.write("\nClassification report:\n")
+        f.write(report + "\n")
+        f.write("\nConfusion matrix:\n")
+        f.write(str(cm) + "\n")
+
+    print("\n" + "="*70)
+    print("📊 RESULTADOS FINALES")
+    print("="*70)
+    print(f"Accuracy: {acc:.4f}")
+    if roc_auc is not None:
+        print(f"ROC-AUC: {roc_auc:.4f}")
+    print(f"\nModelo guardado en: {MODEL_OUT}")
+    print(f"Métricas guardadas en: {METRICS_OUT}")
+    print("\nClassification Report:")
+    print(report)
+    print("="*70 + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,21 @@
 import os
 import joblib
-import pandas as pd
-from sklearn.model_selection import train_test_split, StratifiedKFold, cross_val_score
+import numpy as np
+from sklearn.model_selection import StratifiedKFold, cross_val_predict, cross_val_score
 from sklearn.ensemble import (
     VotingClassifier, 
     RandomForestClassifier, 
     GradientBoostingClassifier,
     AdaBoostClassifier
 )
+from sklearn.frozen import FrozenEstimator
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import classification_report, confusion_matrix, accuracy_score, roc_auc_score
+from sklearn.metrics import classification_report, confusion_matrix, accuracy_score, roc_auc_score, f1_score
+
+from dataset_io import load_split
+from prediction_cache import compute_oof, load_oof, save_oof, split_hash
+from search_config import balanced_class_weight, fit_params, limit_n_jobs
 
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -18,38 +23,50 @@ CSV_PATH = os.path.join(os.path.dirname(__file__), "KDD_TRAIN_FULL.csv")
 MODEL_OUT = os.path.join(BASE_DIR, "output", "voting_classifier_kdd_model.joblib")
 METRICS_OUT = os.path.join(BASE_DIR, "output", "voting_classifier_kdd_metrics.txt")
 
+# Modo de construcción del ensemble (variable de entorno KDD_VOTING_MODE):
+#  - "prefit":  usa los modelos ya entrenados por los demás scripts (artefactos
+#               joblib de output/) sin reentrenarlos, y estima el F1 de CV con sus
+#               probabilidades out-of-fold guardadas.
+#  - "retrain": entrena los 4 modelos desde cero y evalúa con cross_val_score
+#               (comportamiento original).
+#  - "auto":    prefit si existen todos los artefactos, retrain en caso contrario.
+VOTING_MODE = "auto"
+VOTING_MODES = ("auto", "prefit", "retrain")
 
-def main():
-    if not os.path.exists(CSV_PATH):
-        raise SystemExit(f"CSV procesado no encontrado en: {CSV_PATH}\nEjecuta primero scripts/download_and_chunk.py")
+# (nombre en el ensemble, nombre en prediction_cache, artefacto del trainer)
+PREFIT_MODELS = [
+    ("rf", "random_forest", os.path.join(BASE_DIR, "output", "rf_kdd_model.joblib")),
+    ("gb", "gradient_boosting", os.path.join(BASE_DIR, "output", "gradient_boosting_kdd_model.joblib")),
+    ("ada", "adaboost", os.path.join(BASE_DIR, "output", "adaboost_kdd_model.joblib")),
+]
 
-    print("Cargando datos...")
-    df = pd.read_csv(CSV_PATH)
-    if "binario" not in df.columns:
-        raise SystemExit("No se encontró la columna 'binario' en el CSV procesado.")
 
-    X = df.drop(columns=["binario"])
-    y = df["binario"]
+def voting_mode():
+    """Modo efectivo: resuelve "auto" según los artefactos disponibles."""
+    mode = os.environ.get("KDD_VOTING_MODE", VOTING_MODE).strip().lower()
+    if mode not in VOTING_MODES:
+        raise SystemExit(f"KDD_VOTING_MODE inválido: {mode!r} (opciones: {', '.join(VOTING_MODES)})")
+    missing = [path for _, _, path in PREFIT_MODELS if not os.path.exists(path)]
+    if mode == "prefit" and missing:
+        raise SystemExit("Faltan modelos base para el modo prefit:\n  " + "\n  ".join(missing)
+                         + "\nEjecuta primero los scripts de entrenamiento correspondientes.")
+    if mode == "auto":
+        mode = "retrain" if missing else "prefit"
+    return mode
 
-    # Split estratificado
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.20, random_state=42, stratify=y
-    )
 
-    print(f"Datos cargados: {len(X_train)} train, {len(X_test)} test")
+def logistic_regression(class_weight='balanced'):
+    return LogisticRegression(
+        max_iter=1000,
+        random_state=42,
+        n_jobs=limit_n_jobs(2),
+        class_weight=class_weight
+    )
 
-    print("\n" + "="*70)
-    print("CREANDO VOTING CLASSIFIER (ENSEMBLE)")
-    print("="*70)
-    print("\nCombinando multiples modelos:")
-    print("  1. Random Forest")
-    print("  2. Gradient Boosting")
-    print("  3. AdaBoost")
-    print("  4. Logistic Regression")
-    print()
 
-    # Definir estimadores individuales con configuraciones optimizadas
-    estimators = [
+def retrain_estimators(class_weight='balanced'):
+    """Estimadores individuales con configuraciones optimizadas (modo retrain)."""
+    return [
         ('rf', RandomForestClassifier(
             n_estimators=100,
             max_depth=16,
@@ -57,8 +74,8 @@ def main():
             min_samples_leaf=1,
             max_features='log2',
             random_state=42,
-            n_jobs=2,
-            class_weight='balanced'
+            n_jobs=limit_n_jobs(2),
+            class_weight=class_weight
         )),
         ('gb', GradientBoostingClassifier(
             n_estimators=100,
@@ -75,47 +92,131 @@ def main():
             learning_rate=0.5,
             random_state=42
         )),
-        ('lr', LogisticRegression(
-            max_iter=1000,
-            random_state=42,
-            n_jobs=2,
-            class_weight='balanced'
-        ))
+        ('lr', logistic_regression(class_weight))
     ]
 
-    # Voting Classifier con votacion suave (soft voting)
-    clf = VotingClassifier(
-        estimators=estimators,
-        voting='soft',
-        n_jobs=2
-    )
 
-    print("Entrenando Voting Classifier...")
-    print("Esto puede tomar varios minutos ya que entrena 4 modelos...\n")
-    
-    clf.fit(X_train, y_train)
+def prefit_estimators(class_weight='balanced'):
+    """Modelos base cargados de output/ envueltos en FrozenEstimator: el
+    VotingClassifier los usa tal cual y `fit` solo entrena la regresión logística."""
+    estimators = []
+    for name, _, path in PREFIT_MODELS:
+        print(f"  Cargando {name}: {path}")
+        estimators.append((name, FrozenEstimator(joblib.load(path))))
+    estimators.append(('lr', logistic_regression(class_weight)))
+    return estimators
+
+
+def fold_f1_scores(y, y_pred, cv, sample_weight=None):
+    """F1 de cada fold de `cv` a partir de predicciones out-of-fold (ponderado
+    por `sample_weight` si se indica); equivale a cross_val_score(scoring='f1')."""
+    y = np.asarray(y)
+    w = sample_weight
+    return np.array([f1_score(y[test], y_pred[test], sample_weight=None if w is None else w[test])
+                     for _, test in cv.split(np.zeros(len(y)), y)])
+
+
+def oof_cv_scores(clf, X_train, y_train, cv, sample_weight=None):
+    """F1 por fold del ensemble a partir de las probabilidades out-of-fold.
+
+    Promediar las probabilidades OOF de cada modelo equivale a la votación suave
+    de los modelos entrenados en cada fold. Los modelos base usan las
+    probabilidades guardadas por su trainer para el mismo artefacto y los mismos
+    folds (si faltan se recalculan y se guardan); la regresión logística, que es
+    barata, se recalcula siempre. Con `sample_weight` (dataset deduplicado) los
+    modelos se entrenan y el F1 de cada fold se calcula con esos pesos.
+    """
+    y = np.asarray(y_train)
+    w = sample_weight
+    split = split_hash(X_train, y, cv, w)
+    probas = []
+    for name, key, path in PREFIT_MODELS:
+        proba = load_oof(key, path, split)
+        if proba is None:
+            print(f"  {name}: calculando probabilidades OOF...")
+            proba = compute_oof(clf.named_estimators[name].estimator, X_train, y, cv, sample_weight=w)
+            save_oof(key, proba, path, split)
+        else:
+            print(f"  {name}: probabilidades OOF en caché")
+        probas.append(proba)
+    print("  lr: calculando probabilidades OOF...")
+    probas.append(compute_oof(clf.named_estimators['lr'], X_train, y, cv, sample_weight=w))
+
+    y_pred = (np.mean(probas, axis=0) > 0.5).astype(y.dtype)
+    return fold_f1_scores(y, y_pred, cv, w)
+
+
+def main():
+    print("Cargando datos...")
+    # Split estratificado (usa la matriz memmap compartida si está construida).
+    # Con el dataset deduplicado, w_* es el conteo de cada fila (sample_weight)
+    X_train, X_test, y_train, y_test, w_train, w_test = load_split(CSV_PATH, with_weights=True)
+    class_weight = balanced_class_weight(y_train, w_train)
+
+    print(f"Datos cargados: {len(X_train)} train, {len(X_test)} test")
 
     print("\n" + "="*70)
-    print("Entrenamiento completado")
+    print("CREANDO VOTING CLASSIFIER (ENSEMBLE)")
     print("="*70)
+    mode = voting_mode()
+    print(f"\nModo: {mode}")
+    print("\nCombinando multiples modelos:")
+    print("  1. Random Forest")
+    print("  2. Gradient Boosting")
+    print("  3. AdaBoost")
+    print("  4. Logistic Regression")
+    print()
 
-    # Evaluacion con validacion cruzada
-    print("\nEvaluando con validacion cruzada (3-fold)...")
     cv = StratifiedKFold(n_splits=3, shuffle=True, random_state=42)
-    cv_scores = cross_val_score(clf, X_train, y_train, cv=cv, scoring='f1', n_jobs=2)
+
+    if mode == "prefit":
+        # Voting Classifier con votacion suave sobre los modelos ya entrenados
+        clf = VotingClassifier(estimators=prefit_estimators(class_weight), voting='soft')
+
+        print("\nEnsamblando Voting Classifier (solo se entrena Logistic Regression)...")
+        clf.fit(X_train, y_train, **fit_params(w_train))
+
+        print("\nEvaluando con probabilidades out-of-fold (3-fold)...")
+        cv_scores = oof_cv_scores(clf, X_train, y_train, cv, w_train)
+    else:
+        # Voting Classifier con votacion suave (soft voting)
+        clf = VotingClassifier(
+            estimators=retrain_estimators(class_weight),
+            voting='soft',
+            n_jobs=limit_n_jobs(2)
+        )
+
+        print("Entrenando Voting Classifier...")
+        print("Esto puede tomar varios minutos ya que entrena 4 modelos...\n")
+
+        clf.fit(X_train, y_train, **fit_params(w_train))
+
+        # Evaluacion con validacion cruzada
+        print("\nEvaluando con validacion cruzada (3-fold)...")
+        if w_train is None:
+            cv_scores = cross_val_score(clf, X_train, y_train, cv=cv, scoring='f1', n_jobs=limit_n_jobs(2))
+        else:
+            # cross_val_score no pondera el F1 de cada fold: se calcula a partir
+            # de las predicciones out-of-fold
+            y_oof = cross_val_predict(clf, X_train, y_train, cv=cv, n_jobs=limit_n_jobs(2), params=fit_params(w_train))
+            cv_scores = fold_f1_scores(y_train, y_oof, cv, w_train)
+
+    print("\n" + "="*70)
+    print("Entrenamiento completado")
+    print("="*70)
     print(f"F1-Score (CV): {cv_scores.mean():.4f} (+/- {cv_scores.std():.4f})")
 
     # Evaluacion en test
     print("\nEvaluando en conjunto de prueba...")
     y_pred = clf.predict(X_test)
-    acc = accuracy_score(y_test, y_pred)
-    report = classification_report(y_test, y_pred, digits=4)
-    cm = confusion_matrix(y_test, y_pred)
+    acc = accuracy_score(y_test, y_pred, sample_weight=w_test)
+    report = classification_report(y_test, y_pred, digits=4, sample_weight=w_test)
+    cm = confusion_matrix(y_test, y_pred, sample_weight=w_test).astype(int)
 
     roc_auc = None
     if hasattr(clf, "predict_proba") and len(set(y_test)) > 1:
         try:
-            roc_auc = roc_auc_score(y_test, clf.predict_proba(X_test)[:, 1])
+            roc_auc = roc_auc_score(y_test, clf.predict_proba(X_test)[:, 1], sample_weight=w_test)
         except Exception:
             roc_auc = None
 
@@ -132,7 +233,8 @@ def main():
         f.write("  - Gradient Boosting\n")
         f.write("  - AdaBoost\n")
         f.write("  - Logistic Regression\n\n")
-        f.write(f"Voting strategy: soft (probabilidades)\n\n")
+        f.write(f"Voting strategy: soft (probabilidades)\n")
+        f.write(f"Modo: {mode}\n\n")
         f.write(f"F1-Score (CV): {cv_scores.mean():.4f} (+/- {cv_scores.std():.4f})\n\n")
         f.write(f"Accuracy: {acc:.6f}\n")
         if roc_auc is not None:
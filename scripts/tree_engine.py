@@ -0,0 +1,219 @@
+"""Evaluación compilada de ensembles de árboles para inferencia de baja latencia.
+
+`compile_model` aplana los árboles de un modelo entrenado (Gradient Boosting,
+Random Forest, AdaBoost o un Voting Classifier suave que los combine) en
+arreglos NumPy contiguos y los recorre de forma vectorizada: en cada nivel se
+avanzan a la vez todas las filas en todos los árboles. Para lotes pequeños
+evita el costo fijo por llamada de scikit-learn (validación, un recorrido en
+Cython por árbol, construcción de DataFrames).
+
+Los tres tipos de ensemble se reducen a la misma forma:
+
+    P(ataque) = link((bias + suma de los valores de las hojas alcanzadas) / divisor)
+
+ - Gradient Boosting: link sigmoide, bias = predicción inicial (log-odds a
+   priori), hoja = learning_rate * valor de la hoja.
+ - AdaBoost (SAMME binario): link sigmoide, bias = 0, hoja = +-2 w / sum(w)
+   según la clase que predice la hoja.
+ - Random Forest: link identidad, hoja = fracción de ataques, divisor =
+   n_árboles.
+
+La suma se acumula árbol por árbol a partir de `bias` y se divide al final,
+en el mismo orden que scikit-learn: una P(ataque) de exactamente 0.5 (p. ej.
+la mitad de los árboles de un Random Forest con hojas puras) da 0.5 exacto y
+la misma clase que `predict`.
+
+Las entradas deben ser finitas (el codificador de kdd_schema nunca produce NaN).
+"""
+import numpy as np
+from scipy.special import expit
+
+
+class UnsupportedModel(TypeError):
+    """El modelo no se puede compilar; se debe usar `predict_proba` de sklearn."""
+
+
+class CompiledTrees:
+    """Árboles concatenados en arreglos planos.
+
+    Nodo i: la fila va a `children[2 i]` si X[feature[i]] <= threshold[i] y a
+    `children[2 i + 1]` en caso contrario. Las hojas apuntan a sí mismas
+    (threshold = +inf), de modo que basta con iterar `depth` niveles.
+
+    Los arreglos se guardan sin copiar ni convertir: `from_trees` los crea en
+    int32/float64 y tree_export los carga en formato compacto (feature int16,
+    threshold float32) como vistas de solo lectura de un archivo
+    mapeado en memoria.
+    """
+
+    def __init__(self, feature, threshold, children, value, roots, depth, bias=0.0, link="identity",
+                 divisor=1.0):
+        self.feature = np.asarray(feature)
+        self.threshold = np.asarray(threshold)
+        self.children = np.asarray(children)
+        self.value = np.asarray(value)
+        self.roots = np.asarray(roots)
+        self.depth = int(depth)
+        self.bias = float(bias)
+        self.link = link
+        self.divisor = float(divisor)
+
+    @classmethod
+    def from_trees(cls, trees, leaf_values, bias=0.0, link="identity", divisor=1.0):
+        """`trees`: objetos `sklearn.tree._tree.Tree`; `leaf_values`: un arreglo
+        por árbol con el valor (ya escalado) de cada nodo."""
+        n_nodes = sum(t.node_count for t in trees)
+        feature = np.zeros(n_nodes, dtype=np.int32)
+        threshold = np.full(n_nodes, np.inf)
+        children = np.empty(2 * n_nodes, dtype=np.int32)
+        value = np.zeros(n_nodes)
+        roots = np.empty(len(trees), dtype=np.int32)
+
+        offset = 0
+        for k, (tree, values) in enumerate(zip(trees, leaf_values)):
+            n = tree.node_count
+            idx = np.arange(offset, offset + n)
+            left, right = tree.children_left, tree.children_right
+            is_leaf = left == -1
+            feature[idx] = np.where(is_leaf, 0, tree.feature)
+            threshold[idx] = np.where(is_leaf, np.inf, tree.threshold)
+            children[2 * idx] = np.where(is_leaf, idx, left + offset)
+            children[2 * idx + 1] = np.where(is_leaf, idx, right + offset)
+            value[idx] = np.where(is_leaf, values, 0.0)
+            roots[k] = offset
+            offset += n
+
+        depth = max(t.max_depth for t in trees) if trees else 0
+        return cls(feature, threshold, children, value, roots, depth, bias, link, divisor)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def leaves(self, X):
+        """Índice de la hoja alcanzada por cada fila en cada árbol, (n, n_árboles)."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n, n_features = X.shape
+        Xf = X.ravel()
+        row_offset = (np.arange(n, dtype=np.int64) * n_features)[:, None]
+        node = np.broadcast_to(self.roots, (n, len(self.roots)))
+        for _ in range(self.depth):
+            go_right = Xf.take(row_offset + self.feature.take(node)) > self.threshold.take(node)
+            node = self.children.take(2 * node + go_right)
+        return node
+
+    def raw(self, X):
+        # (n_árboles, n): la reducción sobre el eje 0 suma un árbol tras otro
+        leaf_values = self.value.take(self.leaves(X).T)
+        return np.sum(leaf_values, axis=0, dtype=np.float64, initial=self.bias) / self.divisor
+
+    def predict_attack(self, X):
+        """P(ataque) para cada fila de X."""
+        raw = self.raw(X)
+        return expit(raw) if self.link == "sigmoid" else raw
+
+
+class CompiledLinear:
+    """Modelo lineal con link sigmoide (regresión logística binaria)."""
+
+    def __init__(self, coef, intercept):
+        self.coef = np.ascontiguousarray(coef, dtype=np.float64)
+        self.intercept = float(intercept)
+
+    def predict_attack(self, X):
+        return expit(np.asarray(X, dtype=np.float64) @ self.coef + self.intercept)
+
+
+class CompiledVoting:
+    """Votación suave: promedio (ponderado) de las P(ataque) de los miembros."""
+
+    def __init__(self, members, weights=None):
+        self.members = list(members)
+        self.weights = None if weights is None else np.asarray(weights, dtype=np.float64)
+
+    def predict_attack(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        probas = np.stack([m.predict_attack(X) for m in self.members])
+        return np.average(probas, axis=0, weights=self.weights)
+
+
+def _check_binary(model):
+    classes = getattr(model, "classes_", None)
+    if classes is None or len(classes) != 2:
+        raise UnsupportedModel(f"{type(model).__name__}: solo se compilan clasificadores binarios")
+
+
+def _class_values(tree):
+    """Distribución de clases normalizada por nodo, (n_nodes, 2)."""
+    value = tree.value[:, 0, :]
+    total = value.sum(axis=1, keepdims=True)
+    return value / np.where(total > 0, total, 1.0)
+
+
+def _compile_gradient_boosting(model):
+    if model.n_trees_per_iteration_ != 1 or type(model._loss).__name__ != "HalfBinomialLoss":
+        raise UnsupportedModel("GradientBoostingClassifier: solo pérdida log_loss binaria")
+    if not (model.init_ == "zero" or type(model.init_).__name__ == "DummyClassifier"):
+        raise UnsupportedModel("GradientBoostingClassifier: estimador init no constante")
+    bias = model._raw_predict_init(np.zeros((1, model.n_features_in_), dtype=np.float32))[0, 0]
+    trees = [est.tree_ for est in model.estimators_[:, 0]]
+    values = [model.learning_rate * t.value[:, 0, 0] for t in trees]
+    return CompiledTrees.from_trees(trees, values, bias=bias, link="sigmoid")
+
+
+def _compile_random_forest(model):
+    trees = [est.tree_ for est in model.estimators_]
+    # El valor de cada nodo ya es la distribución de clases (scikit-learn >= 1.4)
+    # y es lo que suma predict_proba del bosque; no se vuelve a normalizar
+    values = [t.value[:, 0, 1] for t in trees]
+    return CompiledTrees.from_trees(trees, values, link="identity", divisor=len(trees))
+
+
+def _compile_adaboost(model):
+    pairs = list(zip(model.estimators_, model.estimator_weights_))
+    total = model.estimator_weights_.sum()
+    trees, values = [], []
+    for est, w in pairs:
+        if not hasattr(est, "tree_"):
+            raise UnsupportedModel("AdaBoostClassifier: solo con árboles de decisión como estimador base")
+        # El árbol predice la clase con mayor fracción (empate -> clase 0, como argmax)
+        predicts_attack = np.argmax(_class_values(est.tree_), axis=1) == 1
+        trees.append(est.tree_)
+        values.append(np.where(predicts_attack, 2.0 * w / total, -2.0 * w / total))
+    return CompiledTrees.from_trees(trees, values, link="sigmoid")
+
+
+def _compile_voting(model):
+    if model.voting != "soft":
+        raise UnsupportedModel("VotingClassifier: solo votación suave")
+    members = [compile_model(est) for est in model.estimators_]
+    weights = None
+    if model.weights is not None:
+        weights = [w for est, w in zip(model.estimators, model.weights) if est[1] != "drop"]
+    return CompiledVoting(members, weights)
+
+
+def _compile_logistic_regression(model):
+    return CompiledLinear(model.coef_[0], model.intercept_[0])
+
+
+_COMPILERS = {
+    "GradientBoostingClassifier": _compile_gradient_boosting,
+    "RandomForestClassifier": _compile_random_forest,
+    "ExtraTreesClassifier": _compile_random_forest,
+    "AdaBoostClassifier": _compile_adaboost,
+    "VotingClassifier": _compile_voting,
+    "LogisticRegression": _compile_logistic_regression,
+}
+
+
+def compile_model(model):
+    """Compila un modelo entrenado; lanza `UnsupportedModel` si no es posible."""
+    # FrozenEstimator (Voting Classifier en modo prefit) envuelve al modelo real
+    if type(model).__name__ == "FrozenEstimator":
+        model = model.estimator
+    compiler = _COMPILERS.get(type(model).__name__)
+    if compiler is None:
+        raise UnsupportedModel(f"{type(model).__name__} no se puede compilar")
+    _check_binary(model)
+    return compiler(model)
@@ -0,0 +1,315 @@
+"""Exportación de ensembles de árboles a un formato binario compacto.
+
+`joblib.load` de un Random Forest o de un Voting Classifier reconstruye miles
+de objetos Python (un estimador y un `Tree` por árbol) que después
+`tree_engine.compile_model` vuelve a aplanar. Este módulo guarda directamente
+el motor compilado (arreglos planos de nodos) en un archivo versionado que el
+backend mapea en memoria: cargarlo cuesta milisegundos, no crea objetos por
+árbol y todos los procesos que abren el mismo archivo comparten sus páginas
+(caché del sistema operativo) en lugar de tener cada uno su copia.
+
+    python scripts/tree_export.py                       # todos los modelos de output/
+    python scripts/tree_export.py rf voting_classifier  # solo algunos
+
+Cada `output/<nombre>_kdd_model.joblib` se exporta junto a él como
+`output/<nombre>_kdd_model.trees`. Los modelos que `compile_model` no admite
+(p. ej. el pipeline de Histogram Gradient Boosting) se omiten.
+
+Formato (little-endian):
+
+    MAGIC (8 bytes) | versión uint32 | longitud de la cabecera uint32
+    cabecera JSON (utf-8)
+    arreglos, cada uno alineado a 64 bytes desde el inicio de la sección
+
+La cabecera describe el modelo (tipo, clases, columnas, hiperparámetros,
+importancia de las características y firma del joblib del que salió) y el
+motor: árboles (`"kind": "trees"`, con el índice de cada arreglo en
+`arrays`), votación suave con sus miembros o modelo lineal.
+
+Por nodo se guardan feature (int16), threshold (float32), value (float64) y
+los dos hijos (int32): 22 bytes frente a 28 del motor en memoria. Los umbrales
+se redondean hacia abajo a float32; como las filas se evalúan en float32,
+x <= t si y solo si x <= t32, así que cada fila llega exactamente a las mismas
+hojas. Los valores de las hojas se guardan sin redondear: en float32 una
+P(ataque) de exactamente 0.5 podía quedar a 1e-8 del umbral y cambiar de
+clase respecto del joblib.
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import argparse
+
+import joblib
+import numpy as np
+
+from tree_engine import CompiledLinear, CompiledTrees, CompiledVoting, UnsupportedModel, compile_model
+
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+OUTPUT_DIR = os.path.join(BASE_DIR, "output")
+
+MODEL_SUFFIX = "_kdd_model.joblib"
+EXPORT_SUFFIX = "_kdd_model.trees"
+
+MAGIC = b"KDDTREES"
+FORMAT_VERSION = 2
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGN = 64
+
+# Hiperparámetros que se copian del modelo a la cabecera (los que muestra /api/model-info)
+MODEL_PARAMS = ("n_estimators", "learning_rate", "max_depth")
+
+
+def export_path(model_path):
+    """Ruta de la exportación compacta de `output/<nombre>_kdd_model.joblib`."""
+    if model_path.endswith(MODEL_SUFFIX):
+        return model_path[:-len(MODEL_SUFFIX)] + EXPORT_SUFFIX
+    return os.path.splitext(model_path)[0] + ".trees"
+
+
+def file_signature(path):
+    """Firma barata de un archivo: (tamaño, fecha de modificación en ns)."""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def _aligned(n):
+    return -(-n // _ALIGN) * _ALIGN
+
+
+def float32_floor(x):
+    """Mayor float32 <= x, elemento a elemento (±inf se conservan)."""
+    x = np.asarray(x, dtype=np.float64)
+    x32 = x.astype(np.float32)
+    return np.where(x32 > x, np.nextafter(x32, np.float32(-np.inf)), x32)
+
+
+class ExportedModel:
+    """Modelo cargado desde una exportación compacta.
+
+    Sustituye al estimador de scikit-learn en el backend: expone el motor
+    compilado (`engine`), `predict_proba` y los atributos que se consultan para
+    describir el modelo (`classes_`, `n_features_in_`, `feature_names_in_`,
+    `feature_importances_` si el modelo la tenía e hiperparámetros).
+    """
+
+    def __init__(self, path, header, engine):
+        self.path = path
+        self.header = header
+        self.engine = engine
+        self.format_version = header["format_version"]
+        self.estimator_name = header["estimator"]
+        self.source_signature = tuple(header["source"]) if header.get("source") else None
+        self.classes_ = np.asarray(header["classes"])
+        self.n_features_in_ = header["n_features"]
+        if header.get("feature_names") is not None:
+            self.feature_names_in_ = np.asarray(header["feature_names"], dtype=object)
+        if header.get("feature_importances") is not None:
+            self.feature_importances_ = np.asarray(header["feature_importances"])
+        for key, value in header.get("params", {}).items():
+            setattr(self, key, value)
+
+    def predict_attack(self, X):
+        return self.engine.predict_attack(X)
+
+    def predict_proba(self, X):
+        p = self.engine.predict_attack(X)
+        return np.column_stack((1.0 - p, p))
+
+    def predict(self, X):
+        return self.classes_[(self.engine.predict_attack(X) > 0.5).astype(np.intp)]
+
+
+# --- Escritura ----------------------------------------------------------------
+
+def _engine_spec(engine, arrays):
+    """Describe `engine` para la cabecera y añade sus arreglos (ya empaquetados) a `arrays`."""
+    def add(array, dtype):
+        arrays.append(np.ascontiguousarray(array, dtype=dtype))
+        return len(arrays) - 1
+
+    if isinstance(engine, CompiledTrees):
+        if engine.feature.size and engine.feature.max() > np.iinfo(np.int16).max:
+            raise UnsupportedModel("Demasiadas características para el formato compacto (máximo 32767)")
+        return {
+            "kind": "trees",
+            "depth": engine.depth,
+            "bias": engine.bias,
+            "link": engine.link,
+            "divisor": engine.divisor,
+            "feature": add(engine.feature, "<i2"),
+            "threshold": add(float32_floor(engine.threshold), "<f4"),
+            "children": add(engine.children, "<i4"),
+            "value": add(engine.value, "<f8"),
+            "roots": add(engine.roots, "<i4"),
+        }
+    if isinstance(engine, CompiledVoting):
+        return {
+            "kind": "voting",
+            "weights": None if engine.weights is None else engine.weights.tolist(),
+            "members": [_engine_spec(m, arrays) for m in engine.members],
+        }
+    if isinstance(engine, CompiledLinear):
+        return {"kind": "linear", "coef": engine.coef.tolist(), "intercept": engine.intercept}
+    raise UnsupportedModel(f"{type(engine).__name__} no se puede exportar")
+
+
+def _json_value(value):
+    """Hiperparámetro como valor JSON (None si no es un número o None)."""
+    if value is None or isinstance(value, (bool, np.bool_)):
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return float(value)
+    return None
+
+
+def build_header(model, engine_spec, source=None):
+    est = model.estimator if type(model).__name__ == "FrozenEstimator" else model
+    names = getattr(est, "feature_names_in_", None)
+    importances = None
+    if hasattr(type(est), "feature_importances_"):
+        try:
+            importances = np.asarray(est.feature_importances_, dtype=np.float64).tolist()
+        except (AttributeError, ValueError):
+            importances = None
+    params = {key: _json_value(getattr(est, key, None)) for key in MODEL_PARAMS}
+    return {
+        "format_version": FORMAT_VERSION,
+        "estimator": type(est).__name__,
+        "classes": [c.item() if hasattr(c, "item") else c for c in est.classes_],
+        "n_features": int(est.n_features_in_),
+        "feature_names": None if names is None else [str(n) for n in names],
+        "feature_importances": importances,
+        "params": {key: value for key, value in params.items() if value is not None},
+        "source": None if source is None else list(file_signature(source)),
+        "exported_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "engine": engine_spec,
+    }
+
+
+def export_model(model, path, source=None):
+    """Compila `model` y lo guarda en `path`. Devuelve el tamaño en bytes.
+
+    `source` es el joblib del que sale el modelo: su firma (tamaño, mtime) queda
+    en la cabecera para detectar exportaciones desactualizadas. Lanza
+    `UnsupportedModel` si el modelo no se puede compilar.
+    """
+    arrays = []
+    header = build_header(model, _engine_spec(compile_model(model), arrays), source)
+
+    offset, table = 0, []
+    for array in arrays:
+        table.append({"offset": offset, "dtype": array.dtype.str, "count": int(array.size)})
+        offset = _aligned(offset + array.nbytes)
+    header["arrays"] = table
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_start = _aligned(_PREAMBLE.size + len(header_bytes))
+
+    # Se escribe aparte y se reemplaza: los procesos que tienen mapeada la
+    # versión anterior la siguen leyendo intacta
+    tmp = f"{path}.tmp-{os.getpid()}"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+            f.write(header_bytes)
+            for array, entry in zip(arrays, table):
+                f.seek(data_start + entry["offset"])
+                f.write(array.tobytes())
+            f.truncate(data_start + offset)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return data_start + offset
+
+
+# --- Lectura ------------------------------------------------------------------
+
+def _build_engine(spec, arrays):
+    kind = spec["kind"]
+    if kind == "trees":
+        return CompiledTrees(
+            arrays[spec["feature"]], arrays[spec["threshold"]], arrays[spec["children"]],
+            arrays[spec["value"]], arrays[spec["roots"]], spec["depth"], spec["bias"], spec["link"],
+            spec["divisor"],
+        )
+    if kind == "voting":
+        return CompiledVoting([_build_engine(m, arrays) for m in spec["members"]], spec["weights"])
+    if kind == "linear":
+        return CompiledLinear(spec["coef"], spec["intercept"])
+    raise ValueError(f"Tipo de motor desconocido en la exportación: {kind}")
+
+
+def load_export(path):
+    """Carga una exportación mapeándola en memoria (los arreglos son de solo lectura).
+
+    Lanza ValueError si el archivo no es una exportación o es de otra versión.
+    """
+    with open(path, "rb") as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # archivo vacío
+            raise ValueError(f"{path} no es una exportación de árboles") from None
+    if len(buf) < _PREAMBLE.size:
+        raise ValueError(f"{path} no es una exportación de árboles")
+    magic, version, header_len = _PREAMBLE.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} no es una exportación de árboles")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"{path}: versión de formato {version} no soportada (se esperaba {FORMAT_VERSION}); "
+                         "vuelve a exportar el modelo")
+    header = json.loads(buf[_PREAMBLE.size:_PREAMBLE.size + header_len].decode("utf-8"))
+    data_start = _aligned(_PREAMBLE.size + header_len)
+    end = max((data_start + a["offset"] + np.dtype(a["dtype"]).itemsize * a["count"] for a in header["arrays"]),
+              default=data_start)
+    if len(buf) < end:
+        raise ValueError(f"{path}: archivo truncado")
+    arrays = [np.frombuffer(buf, dtype=a["dtype"], count=a["count"], offset=data_start + a["offset"])
+              for a in header["arrays"]]
+    return ExportedModel(path, header, _build_engine(header["engine"], arrays))
+
+
+# --- CLI ----------------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta los modelos entrenados al formato compacto (.trees)")
+    parser.add_argument("models", nargs="*",
+                        help="nombres de los modelos (p. ej. rf, voting_classifier); por defecto, todos")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="directorio de los artefactos (output/)")
+    args = parser.parse_args(argv)
+
+    names = args.models or sorted(f[:-len(MODEL_SUFFIX)] for f in os.listdir(args.output_dir)
+                                  if f.endswith(MODEL_SUFFIX))
+    if not names:
+        raise SystemExit(f"No hay modelos en {args.output_dir}")
+
+    for name in names:
+        model_path = os.path.join(args.output_dir, f"{name}{MODEL_SUFFIX}")
+        if not os.path.exists(model_path):
+            raise SystemExit(f"Modelo no encontrado: {model_path}")
+        start = time.perf_counter()
+        model = joblib.load(model_path)
+        joblib_seconds = time.perf_counter() - start
+
+        out = export_path(model_path)
+        try:
+            size = export_model(model, out, source=model_path)
+        except UnsupportedModel as e:
+            print(f"{name}: se omite ({e})")
+            continue
+
+        start = time.perf_counter()
+        load_export(out)
+        load_seconds = time.perf_counter() - start
+        print(f"{name}: {out} ({size / 1024:.0f} KB; joblib {os.path.getsize(model_path) / 1024:.0f} KB). "
+              f"Carga: {load_seconds * 1000:.1f} ms (joblib {joblib_seconds * 1000:.0f} ms)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,225 +1,718 @@
 import os
-import joblib
-import pandas as pd
+import sys
+import itertools
+import time
+import warnings
 import numpy as np
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from sklearn.metrics import (
-    confusion_matrix,
-    classification_report,
-    roc_curve,
-    auc,
-    precision_recall_curve,
-    accuracy_score
-)
 import json
 
+# Configuración de rutas
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, os.path.join(BASE_DIR, "scripts"))
+
+from kdd_schema import labels_from_classes  # noqa: E402
+from model_registry import ModelRegistry, UnknownModel  # noqa: E402
+from response_cache import ResponseCache  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from jobs import JobManager, UnknownJob, in_pool_worker  # noqa: E402
+from uploads import detach_upload, iter_upload_chunks, parse_upload  # noqa: E402
+from evaluation import confusion, evaluate  # noqa: E402
+from binary_io import BINARY_MIMETYPES, read_matrix, response_mimetype, write_result  # noqa: E402
+from tree_export import file_signature  # noqa: E402
+
 app = Flask(__name__)
 CORS(app)
 
-# Configuración de rutas
-BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
-MODEL_PATH = os.path.join(BASE_DIR, "output", "gradient_boosting_kdd_model.joblib")
-METRICS_PATH = os.path.join(BASE_DIR, "output", "gradient_boosting_kdd_metrics.txt")
+# Modelos servidos: todos los output/<nombre>_kdd_model.joblib. Cada petición
+# puede elegir uno con `model`; sin él se usa KDD_MODEL (gradient_boosting por
+# defecto; p. ej. KDD_MODEL=hist_gradient_boosting)
+OUTPUT_DIR = os.path.join(BASE_DIR, "output")
+MODEL_NAME = os.environ.get("KDD_MODEL", "gradient_boosting")
+MODEL_PATH = os.path.join(OUTPUT_DIR, f"{MODEL_NAME}_kdd_model.joblib")
 PLOTS_DIR = os.path.join(BASE_DIR, "output", "plots")
 
-# Cargar modelo al iniciar
-print("Cargando modelo Gradient Boosting...")
-if not os.path.exists(MODEL_PATH):
-    raise FileNotFoundError(f"Modelo no encontrado en: {MODEL_PATH}")
+# Umbral de decisión: una fila es ataque si P(ataque) > umbral. Con 0.5 coincide
+# con model.predict; se puede cambiar por petición con el parámetro `threshold`.
+DECISION_THRESHOLD = float(os.environ.get("KDD_THRESHOLD", "0.5"))
+
+# Máximo de registros por petición en /api/score (pensado para lotes pequeños)
+SCORE_MAX_RECORDS = int(os.environ.get("KDD_SCORE_MAX_RECORDS", "1000"))
+
+# Micro-batching de /api/score (KDD_MICRO_BATCH=1): las peticiones concurrentes
+# se agrupan durante hasta KDD_BATCH_WAIT_MS o hasta KDD_BATCH_MAX_ROWS filas
+MICRO_BATCH = os.environ.get("KDD_MICRO_BATCH", "0").lower() in ("1", "true", "yes")
+BATCH_WAIT_MS = float(os.environ.get("KDD_BATCH_WAIT_MS", "2"))
+BATCH_MAX_ROWS = int(os.environ.get("KDD_BATCH_MAX_ROWS", "256"))
+
+# Caché LRU de predicciones por fila de características (KDD_PREDICTION_CACHE
+# filas por modelo y endpoint; 0 la desactiva). Ver row_cache.py
+PREDICTION_CACHE = int(os.environ.get("KDD_PREDICTION_CACHE", "0"))
+
+# Modelos a cargar al iniciar ("all" para todos; por defecto solo KDD_MODEL, el
+# resto se carga en su primera petición) y cada cuántos segundos se revisan los
+# archivos para recargarlos en caliente (0 desactiva la recarga)
+PRELOAD_MODELS = os.environ.get("KDD_PRELOAD_MODELS", MODEL_NAME)
+RELOAD_INTERVAL = float(os.environ.get("KDD_RELOAD_INTERVAL", "2"))
+
+# Máximo de puntos por curva (ROC / Precision-Recall) en la evaluación de
+# /api/predict; se cambia por petición con `curve_points` (0 = todos)
+CURVE_POINTS = int(os.environ.get("KDD_CURVE_POINTS", "200"))
+
+# Trabajos asíncronos (/api/jobs): directorio de resultados, procesos del pool
+# y filas por bloque. Cada proceso del servidor tiene su pool: por defecto los
+# núcleos se reparten entre los KDD_WORKERS workers de serve.py
+JOBS_DIR = os.environ.get("KDD_JOBS_DIR", os.path.join(OUTPUT_DIR, "jobs"))
+SERVER_WORKERS = max(1, int(os.environ.get("KDD_WORKERS", "1")))
+JOB_WORKERS = int(os.environ.get("KDD_JOB_WORKERS", str(max(1, (os.cpu_count() or 1) // SERVER_WORKERS))))
+JOB_CHUNK_ROWS = int(os.environ.get("KDD_JOB_CHUNK_ROWS", "50000"))
+
+# Directorio donde cada proceso del servidor pre-fork deja sus métricas para que
+# /metrics las combine (serve.py lo define; sin él, métricas del proceso actual)
+METRICS_DIR = os.environ.get("KDD_METRICS_DIR") or None
+
+# Filas por bloque en el modo streaming de /api/predict (stream=1)
+STREAM_CHUNK_ROWS = int(os.environ.get("KDD_STREAM_CHUNK_ROWS", "10000"))
+
+MODEL_TYPES = {
+    'GradientBoostingClassifier': 'Gradient Boosting Classifier',
+    'HistGradientBoostingClassifier': 'Histogram Gradient Boosting Classifier',
+    'RandomForestClassifier': 'Random Forest Classifier',
+    'AdaBoostClassifier': 'AdaBoost Classifier',
+    'VotingClassifier': 'Voting Classifier',
+}
+
+
+def collect_model_metrics():
+    samples = []
+    for served in registry.loaded():
+        samples.append(('kdd_model_load_seconds', {'model': served.name}, served.load_seconds))
+        stats = served.batcher_stats()
+        if stats is not None:
+            samples.append(('kdd_batcher_queue_depth', {'model': served.name}, stats['queue_depth']))
+            samples.append(('kdd_batcher_batches_total', {'model': served.name}, stats['batches']))
+            samples.append(('kdd_batcher_rows_total', {'model': served.name}, stats['rows']))
+        for kind, stats in served.cache_stats().items():
+            labels = {'model': served.name, 'kind': kind}
+            samples.append(('kdd_prediction_cache_hits_total', labels, stats['hits']))
+            samples.append(('kdd_prediction_cache_misses_total', labels, stats['misses']))
+            samples.append(('kdd_prediction_cache_evictions_total', labels, stats['evictions']))
+            samples.append(('kdd_prediction_cache_entries', labels, stats['entries']))
+    return samples
+
+
+# Los procesos del pool de /api/jobs se crean con spawn y multiprocessing
+# reimporta en ellos el script principal (este archivo con `python app.py`, o
+# el script que lo importe). Solo necesitan jobs.py: no cargan modelos ni
+# crean el registro, las métricas, el gestor de trabajos ni las cachés
+if not in_pool_worker():
+    # Cargar modelos al iniciar (ver model_registry.py)
+    if not os.path.exists(MODEL_PATH):
+        raise FileNotFoundError(f"Modelo no encontrado en: {MODEL_PATH}")
+
+    registry = ModelRegistry(
+        OUTPUT_DIR, MODEL_NAME,
+        batching=(BATCH_WAIT_MS, BATCH_MAX_ROWS) if MICRO_BATCH else None,
+        poll_interval=RELOAD_INTERVAL,
+        cache_size=PREDICTION_CACHE,
+    )
+    registry.preload(None if PRELOAD_MODELS == "all" else [n.strip() for n in PRELOAD_MODELS.split(",") if n.strip()])
+
+    # Métricas en formato Prometheus (GET /metrics)
+    metrics = Metrics(METRICS_DIR)
+    metrics.counter('kdd_http_requests_total', 'Peticiones HTTP por endpoint, método y código de estado')
+    metrics.histogram('kdd_http_request_duration_seconds',
+                      'Latencia de las peticiones hasta devolver la respuesta (sin el cuerpo en streaming)')
+    metrics.histogram('kdd_stage_duration_seconds',
+                      'Duración de cada etapa (parse, predict, score, evaluate, serialize) por endpoint')
+    metrics.counter('kdd_rows_scored_total', 'Filas puntuadas por endpoint y modelo')
+    metrics.gauge('kdd_model_load_seconds', 'Segundos de carga (y compilación) de la versión publicada del modelo',
+                  merge='max')
+    metrics.gauge('kdd_batcher_queue_depth', 'Peticiones en la cola del micro-batcher')
+    metrics.counter('kdd_batcher_batches_total', 'Lotes evaluados por el micro-batcher')
+    metrics.counter('kdd_batcher_rows_total', 'Filas evaluadas por el micro-batcher')
+    metrics.counter('kdd_prediction_cache_hits_total', 'Filas respondidas desde la caché de predicciones')
+    metrics.counter('kdd_prediction_cache_misses_total', 'Filas evaluadas por el modelo con la caché activa')
+    metrics.counter('kdd_prediction_cache_evictions_total', 'Entradas descartadas por la caché de predicciones (LRU)')
+    metrics.gauge('kdd_prediction_cache_entries', 'Entradas en la caché de predicciones')
+
+    metrics.add_collector(collect_model_metrics)
+
+    jobs = JobManager(JOBS_DIR, JOB_WORKERS, JOB_CHUNK_ROWS, metrics=metrics)
+
+    # Respuestas de los endpoints de solo lectura, una por versión de sus archivos
+    responses = ResponseCache()
+
+
+@app.before_request
+def start_background_threads():
+    """El vigilante de recarga, la reanudación de trabajos y la escritura de
+    métricas arrancan con la primera petición de cada proceso (en un servidor
+    pre-fork, en cada worker y no en el maestro)."""
+    registry.start_watcher()
+    jobs.start()
+    metrics.start_flusher()
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    endpoint = request.endpoint or 'unmatched'
+    metrics.inc('kdd_http_requests_total', endpoint=endpoint, method=request.method,
+                status=response.status_code)
+    metrics.observe('kdd_http_request_duration_seconds', time.perf_counter() - g.request_start,
+                    endpoint=endpoint)
+    return response
+
+
+def stage(name):
+    """Mide una etapa de la petición actual en kdd_stage_duration_seconds."""
+    return metrics.time('kdd_stage_duration_seconds', endpoint=request.endpoint or 'unmatched', stage=name)
+
+
+def served_model(payload=None):
+    """Modelo pedido en la petición: campo `model` del JSON, parámetro `model`
+    o cabecera X-KDD-Model; sin ninguno, el modelo por defecto.
+
+    Se resuelve una sola vez por petición, así que una recarga en caliente
+    nunca mezcla dos versiones dentro de la misma respuesta.
+    """
+    name = payload.get('model') if isinstance(payload, dict) else None
+    return registry.get(name or request.values.get('model') or request.headers.get('X-KDD-Model'))
+
+
+def final_estimator(model):
+    """Último paso si el modelo es un Pipeline, o el propio modelo."""
+    return model.steps[-1][1] if hasattr(model, 'steps') else model
+
+
+def model_type(model):
+    # Un modelo cargado desde la exportación compacta guarda el tipo original
+    name = getattr(model, 'estimator_name', None) or type(final_estimator(model)).__name__
+    return MODEL_TYPES.get(name, name)
+
+
+def describe_model(model):
+    """Hiperparámetros principales del modelo, sea cual sea su tipo."""
+    est = final_estimator(model)
+    n_estimators = getattr(est, 'n_iter_', None) or getattr(est, 'n_estimators', None)
+    learning_rate = getattr(est, 'learning_rate', None)
+    max_depth = getattr(est, 'max_depth', None)
+    return {
+        'model_type': model_type(model),
+        'n_estimators': int(n_estimators) if n_estimators is not None else None,
+        'learning_rate': float(learning_rate) if learning_rate is not None else None,
+        'max_depth': int(max_depth) if max_depth is not None else None,
+        'n_features': int(model.n_features_in_),
+    }
+
+
+def optional_signature(path):
+    """(tamaño, mtime_ns) del archivo, o None si no existe."""
+    try:
+        return file_signature(path)
+    except FileNotFoundError:
+        return None
+
+
+def latest_mtime(*signatures):
+    """Fecha de modificación más reciente (en segundos) entre varias firmas."""
+    mtimes = [sig[1] for sig in signatures if sig]
+    return max(mtimes) / 1e9 if mtimes else None
+
+
+def build_model_info(served):
+    """Hiperparámetros del modelo y métricas leídas de su archivo de métricas."""
+    # Leer métricas del archivo
+    metrics_data = {}
+    if os.path.exists(served.metrics_path):
+        with open(served.metrics_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+            metrics_data['raw_metrics'] = content
+
+            # Extraer métricas específicas
+            lines = content.split('\n')
+            for line in lines:
+                if 'Accuracy:' in line:
+                    metrics_data['accuracy'] = float(line.split(':')[1].strip())
+                elif 'ROC AUC:' in line:
+                    metrics_data['roc_auc'] = float(line.split(':')[1].strip())
+                elif 'Best F1-Score (CV):' in line:
+                    metrics_data['best_f1_cv'] = float(line.split(':')[1].strip())
+
+    # Información del modelo
+    model_info = describe_model(served.model)
+    model_info['name'] = served.name
+    model_info['metrics'] = metrics_data
+    return model_info
+
+
+def build_feature_importance(model):
+    """Las 20 características más importantes del modelo."""
+    feature_importance = [
+        {'feature': f'feature_{i}', 'importance': float(imp)}
+        for i, imp in enumerate(model.feature_importances_)
+    ]
+
+    # Ordenar por importancia
+    feature_importance.sort(key=lambda x: x['importance'], reverse=True)
+
+    return {'feature_importance': feature_importance[:20]}  # Top 20
+
+
+# Se predice sobre matrices NumPy ya alineadas con el esquema
+warnings.filterwarnings('ignore', message='X does not have valid feature names')
+
+
+def parse_records(payload, encoder):
+    """Convierte un cuerpo JSON {"records": [...]} en (X, y_true).
+
+    Cada registro puede ser una lista de campos crudos o un dict con nombres de columna.
+    """
+    records = payload.get('records') if isinstance(payload, dict) else None
+    if not records:
+        raise ValueError("El cuerpo JSON debe incluir una lista no vacía 'records'")
+
+    if isinstance(records[0], dict):
+        X = encoder.encode_records(records)
+        y_true = labels_from_classes([r['class'] for r in records]) if 'class' in records[0] else None
+    else:
+        X = encoder.encode_raw(records)
+        y_true = labels_from_classes([r[41] for r in records]) if len(records[0]) > 41 else None
+    return X, y_true
+
+
+def prediction_options(payload=None):
+    """Lee `threshold` y `output` ("full" o "labels") del cuerpo JSON o de los
+    parámetros de la petición (query string / campos del formulario)."""
+    source = payload if isinstance(payload, dict) else request.values
+    try:
+        threshold = float(source.get('threshold', DECISION_THRESHOLD))
+    except (TypeError, ValueError):
+        raise ValueError("'threshold' debe ser un número entre 0 y 1")
+    if not 0.0 <= threshold <= 1.0:
+        raise ValueError("'threshold' debe ser un número entre 0 y 1")
+    output = source.get('output', 'full')
+    if output not in ('full', 'labels'):
+        raise ValueError("'output' debe ser 'full' o 'labels'")
+    return threshold, output
+
+
+def curve_points_option(payload=None):
+    """Máximo de puntos por curva en la evaluación (`curve_points`, 0 = todos)."""
+    source = payload if isinstance(payload, dict) else request.values
+    try:
+        points = int(source.get('curve_points', CURVE_POINTS))
+    except (TypeError, ValueError):
+        raise ValueError("'curve_points' debe ser un entero >= 0")
+    if points < 0:
+        raise ValueError("'curve_points' debe ser un entero >= 0")
+    return points
+
+
+def wants_stream():
+    """Modo streaming: parámetro `stream=1` o cabecera Accept: application/x-ndjson."""
+    flag = str(request.values.get('stream', '')).lower() in ('1', 'true', 'yes')
+    return flag or request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def summarize_predictions(n_normal, n_attack):
+    total = n_normal + n_attack
+    return {
+        'normal': int(n_normal),
+        'attack': int(n_attack),
+        'normal_percentage': float(n_normal / total * 100) if total else 0.0,
+        'attack_percentage': float(n_attack / total * 100) if total else 0.0,
+    }
+
+
+def stream_predictions(served, chunks, threshold, output):
+    """Genera la respuesta NDJSON: una línea por bloque con sus predicciones y el
+    resumen acumulado, y una línea final con el total (y accuracy y matriz de
+    confusión si el archivo trae etiquetas). La memoria queda acotada por el
+    tamaño del bloque; un error a mitad del archivo se reporta como una línea
+    {"error": ...} porque el código HTTP ya se envió."""
+    counts = np.zeros(2, dtype=np.int64)
+    cm = np.zeros((2, 2), dtype=np.int64)
+    offset = 0
+    has_labels = False
+    chunks = iter(chunks)
+    try:
+        for i in itertools.count():
+            with stage('parse'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            X, y_true = chunk
+            y_proba, y_pred = predict_with_threshold(served, X, threshold)
+            counts += np.bincount(y_pred, minlength=2)[:2]
+            line = {'chunk': i, 'offset': offset, 'rows': len(X), 'predictions': y_pred.tolist()}
+            if output == 'full':
+                line['probabilities'] = y_proba.tolist()
+            if y_true is not None:
+                has_labels = True
+                cm += confusion(y_true, y_pred)
+            offset += len(X)
+            line['summary'] = summarize_predictions(*counts)
+            with stage('serialize'):
+                text = json.dumps(line) + '\n'
+            yield text
+    except Exception as e:
+        yield json.dumps({'error': str(e), 'offset': offset}) + '\n'
+        return
+
+    final = {
+        'done': True,
+        'model': served.name,
+        'total_samples': offset,
+        'threshold': threshold,
+        'prediction_summary': summarize_predictions(*counts),
+    }
+    if has_labels and offset:
+        final['evaluation'] = {
+            'accuracy': float(np.trace(cm) / offset),
+            'confusion_matrix': cm.tolist(),
+        }
+    yield json.dumps(final) + '\n'
+
+
+def predict_with_threshold(served, X, threshold=DECISION_THRESHOLD):
+    """Una sola pasada del modelo: retorna (probabilidades, etiquetas).
 
-model = joblib.load(MODEL_PATH)
-print("Modelo cargado exitosamente")
+    Las etiquetas se derivan de P(ataque) en lugar de llamar además a
+    `model.predict`, que recorrería el ensemble una segunda vez.
+    """
+    with stage('predict'):
+        y_proba = served.predict_proba(X)
+    y_pred = (y_proba[:, 1] > threshold).astype(np.int64)
+    metrics.inc('kdd_rows_scored_total', len(X), endpoint=request.endpoint, model=served.name)
+    return y_proba, y_pred
 
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Verificar que el servidor está funcionando."""
+    served = registry.get()
     return jsonify({
         'status': 'ok',
-        'model': 'Gradient Boosting Classifier',
-        'model_path': MODEL_PATH
+        'model': model_type(served.model),
+        'model_path': served.path,
+        'models': list(registry.discover()),
     })
 
 
+@app.route('/api/models', methods=['GET'])
+def list_models():
+    """Modelos disponibles, cuáles están cargados y cuál es el por defecto."""
+    return jsonify(registry.status())
+
+
 @app.route('/api/model-info', methods=['GET'])
 def get_model_info():
-    """Obtener información del modelo entrenado."""
+    """Obtener información del modelo entrenado (precalculada por versión del
+    modelo y de su archivo de métricas)."""
     try:
-        # Leer métricas del archivo
-        metrics_data = {}
-        if os.path.exists(METRICS_PATH):
-            with open(METRICS_PATH, 'r', encoding='utf-8') as f:
-                content = f.read()
-                metrics_data['raw_metrics'] = content
-                
-                # Extraer métricas específicas
-                lines = content.split('\n')
-                for line in lines:
-                    if 'Accuracy:' in line:
-                        metrics_data['accuracy'] = float(line.split(':')[1].strip())
-                    elif 'ROC AUC:' in line:
-                        metrics_data['roc_auc'] = float(line.split(':')[1].strip())
-                    elif 'Best F1-Score (CV):' in line:
-                        metrics_data['best_f1_cv'] = float(line.split(':')[1].strip())
-        
-        # Información del modelo
-        model_info = {
-            'model_type': 'Gradient Boosting Classifier',
-            'n_estimators': model.n_estimators,
-            'learning_rate': float(model.learning_rate),
-            'max_depth': int(model.max_depth),
-            'n_features': model.n_features_in_,
-            'metrics': metrics_data
-        }
-        
-        return jsonify(model_info)
+        served = served_model()
+        metrics_signature = optional_signature(served.metrics_path)
+        return responses.get(
+            ('model-info', served.name), (served.signature, metrics_signature),
+            lambda: build_model_info(served),
+            last_modified=latest_mtime(served.signature, metrics_signature),
+        )
     
+    except UnknownModel as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/predict', methods=['POST'])
 def predict():
-    """Realizar predicciones sobre datos cargados."""
+    """Realizar predicciones sobre datos cargados.
+
+    Opciones: `threshold` (umbral de decisión), `output=labels` para responder
+    solo con las etiquetas, sin la lista de probabilidades, y `stream=1` para
+    procesar el archivo por bloques y responder en NDJSON. Con un cuerpo binario
+    (.npy o Arrow IPC, ver binary_io.py) la respuesta también es binaria.
+    `model` elige el modelo (ver /api/models).
+    """
     try:
-        # Verificar si se envió un archivo
-        if 'file' not in request.files:
-            return jsonify({'error': 'No se proporcionó ningún archivo'}), 400
-        
-        file = request.files['file']
-        
-        if file.filename == '':
-            return jsonify({'error': 'Nombre de archivo vacío'}), 400
-        
-        # Leer el archivo CSV
-        df = pd.read_csv(file)
-        
-        # Verificar si tiene la columna 'binario' (etiquetas reales)
-        has_labels = 'binario' in df.columns
-        
-        if has_labels:
-            y_true = df['binario']
-            X = df.drop(columns=['binario'])
+        if request.mimetype in BINARY_MIMETYPES:
+            return predict_binary(served_model())
+
+        if request.is_json:
+            with stage('parse'):
+                payload = request.get_json()
+                served = served_model(payload)
+                threshold, output = prediction_options(payload)
+                curve_points = curve_points_option(payload)
+                X, y_true = parse_records(payload, served.encoder)
         else:
-            y_true = None
-            X = df
+            served = served_model()
+            threshold, output = prediction_options()
+            curve_points = curve_points_option()
+
+            # Verificar si se envió un archivo
+            if 'file' not in request.files:
+                return jsonify({'error': 'No se proporcionó ningún archivo'}), 400
+
+            file = request.files['file']
+
+            if file.filename == '':
+                return jsonify({'error': 'Nombre de archivo vacío'}), 400
+
+            if wants_stream():
+                chunks = iter_upload_chunks(detach_upload(file), served.encoder, STREAM_CHUNK_ROWS)
+                body = stream_predictions(served, chunks, threshold, output)
+                return Response(stream_with_context(body), mimetype='application/x-ndjson')
+
+            with stage('parse'):
+                X, y_true = parse_upload(file, served.encoder)
+
+        # Verificar si hay etiquetas reales
+        has_labels = y_true is not None
         
-        # Realizar predicciones
-        y_pred = model.predict(X)
-        y_proba = model.predict_proba(X)
+        # Realizar predicciones (una sola pasada por el modelo)
+        y_proba, y_pred = predict_with_threshold(served, X, threshold)
         
         # Preparar respuesta
         response = {
+            'model': served.name,
             'total_samples': len(X),
-            'predictions': y_pred.tolist(),
-            'probabilities': y_proba.tolist(),
-            'prediction_summary': {
-                'normal': int(np.sum(y_pred == 0)),
-                'attack': int(np.sum(y_pred == 1)),
-                'normal_percentage': float(np.mean(y_pred == 0) * 100),
-                'attack_percentage': float(np.mean(y_pred == 1) * 100)
-            }
+            'threshold': threshold,
+            'prediction_summary': summarize_predictions(np.sum(y_pred == 0), np.sum(y_pred == 1))
         }
         
-        # Si hay etiquetas reales, calcular métricas
+        # Si hay etiquetas reales, calcular métricas (un solo ordenamiento,
+        # curvas limitadas a curve_points puntos; ver evaluation.py)
         if has_labels:
-            y_true_array = y_true.values
-            
-            # Métricas básicas
-            acc = accuracy_score(y_true_array, y_pred)
-            cm = confusion_matrix(y_true_array, y_pred)
-            report = classification_report(y_true_array, y_pred, output_dict=True)
-            
-            # ROC curve
-            fpr, tpr, _ = roc_curve(y_true_array, y_proba[:, 1])
-            roc_auc = auc(fpr, tpr)
-            
-            # Precision-Recall curve
-            precision, recall, _ = precision_recall_curve(y_true_array, y_proba[:, 1])
-            pr_auc = auc(recall, precision)
-            
-            response['evaluation'] = {
-                'accuracy': float(acc),
-                'confusion_matrix': cm.tolist(),
-                'classification_report': report,
-                'roc_curve': {
-                    'fpr': fpr.tolist(),
-                    'tpr': tpr.tolist(),
-                    'auc': float(roc_auc)
-                },
-                'precision_recall_curve': {
-                    'precision': precision.tolist(),
-                    'recall': recall.tolist(),
-                    'auc': float(pr_auc)
-                }
-            }
+            with stage('evaluate'):
+                response['evaluation'] = evaluate(y_true, y_pred, y_proba[:, 1], curve_points)
         
-        return jsonify(response)
+        with stage('serialize'):
+            response['predictions'] = y_pred.tolist()
+            if output == 'full':
+                response['probabilities'] = y_proba.tolist()
+            return jsonify(response)
     
+    except UnknownModel as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def predict_binary(served):
+    """Matriz de características binaria -> P(ataque) y etiquetas en binario."""
+    threshold, output = prediction_options()
+    with stage('parse'):
+        X = read_matrix(request.get_data(cache=False), request.mimetype, served.encoder.feature_columns)
+    y_proba, y_pred = predict_with_threshold(served, X, threshold)
+
+    mimetype = response_mimetype(request.accept_mimetypes, request.mimetype)
+    with stage('serialize'):
+        body = write_result(mimetype, y_proba[:, 1], y_pred, labels_only=(output == 'labels'))
+    return Response(body, mimetype=mimetype, headers={
+        'X-Model': served.name,
+        'X-Total-Samples': str(len(X)),
+        'X-Attack-Count': str(int(y_pred.sum())),
+        'X-Threshold': str(threshold),
+    })
+
+
+@app.route('/api/score', methods=['POST'])
+def score():
+    """Puntuación de baja latencia para uno o pocos registros en JSON.
+
+    Cuerpo: {"record": [...]} o {"records": [[...], ...]} (listas de campos
+    crudos o dicts), más las opciones `threshold` y `output` de /api/predict.
+    No construye DataFrames: los registros se codifican directamente a NumPy y
+    se evalúan con el motor compilado (tree_engine.py).
+    """
+    start = time.perf_counter()
+    try:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({'error': 'Se esperaba un cuerpo JSON con "record" o "records"'}), 400
+        if 'record' in payload:
+            payload = dict(payload, records=[payload['record']])
+        records = payload.get('records') or []
+        if len(records) > SCORE_MAX_RECORDS:
+            return jsonify({'error': f'Máximo {SCORE_MAX_RECORDS} registros por petición; '
+                                     'usa /api/predict para lotes grandes'}), 413
+
+        served = served_model(payload)
+        threshold, output = prediction_options(payload)
+        with stage('parse'):
+            X, _ = parse_records(payload, served.encoder)
+        with stage('score'):
+            p_attack = served.score(X)
+        y_pred = (p_attack > threshold).astype(np.int64)
+        metrics.inc('kdd_rows_scored_total', len(X), endpoint='score', model=served.name)
+
+        response = {
+            'model': served.name,
+            'predictions': y_pred.tolist(),
+            'threshold': threshold,
+            'engine': 'compiled' if served.engine is not None else 'sklearn',
+            'batched': served.batcher is not None,
+        }
+        if output == 'full':
+            response['probabilities'] = p_attack.tolist()
+        response['elapsed_ms'] = (time.perf_counter() - start) * 1000
+        with stage('serialize'):
+            return jsonify(response)
+
+    except UnknownModel as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/score/stats', methods=['GET'])
+def score_stats():
+    """Métricas del micro-batcher (profundidad de la cola y tamaño de los lotes)
+    y de la caché de predicciones (aciertos, fallos y descartes) de este proceso."""
+    try:
+        served = served_model()
+    except UnknownModel as e:
+        return jsonify({'error': str(e)}), 404
+    cache = served.cache_stats() or None
+    if served.batcher is None:
+        return jsonify({'enabled': False, 'model': served.name, 'cache': cache})
+    return jsonify(dict(served.batcher.stats(), enabled=True, model=served.name, cache=cache))
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Encola la puntuación de un archivo grande y responde de inmediato (202).
+
+    Acepta el mismo archivo y las mismas opciones (`model`, `threshold`,
+    `output`) que /api/predict; el progreso se consulta en /api/jobs/<id> y
+    el resultado en /api/jobs/<id>/result.
+    """
+    try:
+        served = served_model()
+        threshold, output = prediction_options()
+        file = request.files.get('file')
+        if file is None or file.filename == '':
+            return jsonify({'error': 'No se proporcionó ningún archivo'}), 400
+
+        status = jobs.submit(file, served, threshold, output)
+        return jsonify(dict(status,
+                            status_url=f"/api/jobs/{status['id']}",
+                            result_url=f"/api/jobs/{status['id']}/result")), 202
+
+    except UnknownModel as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """Trabajos guardados en disco, del más antiguo al más reciente."""
+    return jsonify({'jobs': jobs.list()})
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id):
+    """Estado y progreso de un trabajo (o su eliminación con DELETE)."""
+    try:
+        if request.method == 'DELETE':
+            jobs.delete(job_id)
+            return jsonify({'deleted': job_id})
+        return jsonify(jobs.status(job_id))
+    except UnknownJob as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Predicciones de un trabajo terminado, en NDJSON."""
+    try:
+        return Response(jobs.iter_result(job_id), mimetype='application/x-ndjson')
+    except UnknownJob as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Métricas en el formato de texto de Prometheus (ver metrics.py)."""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route('/api/feature-importance', methods=['GET'])
 def get_feature_importance():
     """Obtener la importancia de características del modelo."""
     try:
-        if hasattr(model, 'feature_importances_'):
-            importances = model.feature_importances_
-            
-            # Crear lista de características con sus importancias
-            feature_importance = [
-                {'feature': f'feature_{i}', 'importance': float(imp)}
-                for i, imp in enumerate(importances)
-            ]
-            
-            # Ordenar por importancia
-            feature_importance.sort(key=lambda x: x['importance'], reverse=True)
-            
-            return jsonify({
-                'feature_importance': feature_importance[:20]  # Top 20
-            })
-        else:
+        served = served_model()
+        if not hasattr(served.model, 'feature_importances_'):
             return jsonify({'error': 'El modelo no tiene feature_importances_'}), 400
+        return responses.get(
+            ('feature-importance', served.name), served.signature,
+            lambda: build_feature_importance(served.model),
+            last_modified=latest_mtime(served.signature),
+        )
     
+    except UnknownModel as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def build_plot_list():
+    plots = []
+    if os.path.exists(PLOTS_DIR):
+        for filename in os.listdir(PLOTS_DIR):
+            if filename.endswith('.html'):
+                plots.append({
+                    'name': filename.replace('.html', '').replace('_', ' ').title(),
+                    'filename': filename,
+                    'path': os.path.join(PLOTS_DIR, filename)
+                })
+    return {'plots': plots}
+
+
 @app.route('/api/plots', methods=['GET'])
 def list_plots():
     """Listar los plots disponibles."""
     try:
-        plots = []
-        if os.path.exists(PLOTS_DIR):
-            for filename in os.listdir(PLOTS_DIR):
-                if filename.endswith('.html'):
-                    plots.append({
-                        'name': filename.replace('.html', '').replace('_', ' ').title(),
-                        'filename': filename,
-                        'path': os.path.join(PLOTS_DIR, filename)
-                    })
-        
-        return jsonify({'plots': plots})
+        # El mtime del directorio cambia al crear, borrar o renombrar archivos
+        version = optional_signature(PLOTS_DIR)
+        return responses.get('plots', version, build_plot_list, last_modified=latest_mtime(version))
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def build_plot(plot_path):
+    with open(plot_path, 'r', encoding='utf-8') as f:
+        return {'html': f.read()}
+
+
 @app.route('/api/plot/<filename>', methods=['GET'])
 def get_plot(filename):
     """Obtener el contenido HTML de un plot específico."""
     try:
-        plot_path = os.path.join(PLOTS_DIR, filename)
+        plot_path = os.path.join(PLOTS_DIR, os.path.basename(filename))
+        version = optional_signature(plot_path)
         
-        if not os.path.exists(plot_path):
+        if version is None or not os.path.isfile(plot_path):
             return jsonify({'error': 'Plot no encontrado'}), 404
         
-        with open(plot_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        return jsonify({'html': content})
+        return responses.get(('plot', plot_path), version, lambda: build_plot(plot_path),
+                             last_modified=latest_mtime(version))
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -227,9 +720,10 @@ def get_plot(filename):
 
 if __name__ == '__main__':
     print("\n" + "="*70)
-    print("SERVIDOR FLASK - GRADIENT BOOSTING MODEL")
+    print(f"SERVIDOR FLASK - {model_type(registry.get().model).upper()}")
     print("="*70)
-    print(f"Modelo: {MODEL_PATH}")
+    print(f"Modelo por defecto: {MODEL_PATH}")
+    print(f"Modelos disponibles: {', '.join(registry.discover())}")
     print(f"Puerto: 5000")
     print("="*70 + "\n")
     
@@ -0,0 +1,122 @@
+"""Formatos binarios de entrada y salida para /api/predict.
+
+Los clientes por lotes pueden enviar directamente la matriz de
+características (en el orden del esquema del modelo) sin codificarla como
+texto:
+
+  - `application/x-npy`: arreglo `.npy` 2-D (float32 idealmente). Se lee sin
+    copiar con `np.frombuffer`; nunca se aceptan arreglos de objetos (pickle).
+  - `application/vnd.apache.arrow.stream` / `application/vnd.apache.arrow.file`:
+    tabla Arrow IPC con las columnas del esquema (por nombre) o con exactamente
+    tantas columnas como características (por posición). Requiere pyarrow.
+
+La respuesta usa el formato pedido en la cabecera Accept o, si no se pide
+ninguno, el mismo de la entrada: P(ataque) en float32 y/o la etiqueta en uint8.
+"""
+import io
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:  # pyarrow es opcional: sin él solo se acepta .npy
+    pa = None
+    ipc = None
+
+
+NPY_MIMETYPE = "application/x-npy"
+ARROW_STREAM_MIMETYPE = "application/vnd.apache.arrow.stream"
+ARROW_FILE_MIMETYPE = "application/vnd.apache.arrow.file"
+BINARY_MIMETYPES = (NPY_MIMETYPE, ARROW_STREAM_MIMETYPE, ARROW_FILE_MIMETYPE)
+ARROW_MIMETYPES = (ARROW_STREAM_MIMETYPE, ARROW_FILE_MIMETYPE)
+
+
+def _require_arrow():
+    if pa is None:
+        raise ValueError("pyarrow no está instalado en el servidor: usa application/x-npy")
+
+
+def _read_npy(body: bytes, n_features: int) -> np.ndarray:
+    buf = io.BytesIO(body)
+    try:
+        version = np.lib.format.read_magic(buf)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(buf)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(buf)
+    except ValueError as e:
+        raise ValueError(f"Archivo .npy inválido: {e}")
+    if dtype.hasobject:
+        raise ValueError("No se aceptan arreglos .npy de objetos")
+    if len(shape) != 2 or shape[1] != n_features:
+        raise ValueError(f"Se esperaba una matriz (n, {n_features}) y se recibió {shape}")
+
+    count = shape[0] * shape[1]
+    if len(body) - buf.tell() < count * dtype.itemsize:
+        raise ValueError("Archivo .npy truncado")
+    X = np.frombuffer(body, dtype=dtype, count=count, offset=buf.tell())
+    X = X.reshape(shape, order="F" if fortran else "C")
+    return X if X.dtype == np.float32 else X.astype(np.float32)
+
+
+def _read_arrow(body: bytes, mimetype: str, feature_columns) -> np.ndarray:
+    _require_arrow()
+    try:
+        if mimetype == ARROW_FILE_MIMETYPE:
+            table = ipc.open_file(pa.BufferReader(body)).read_all()
+        else:
+            table = ipc.open_stream(pa.BufferReader(body)).read_all()
+    except pa.ArrowInvalid as e:
+        raise ValueError(f"Datos Arrow IPC inválidos: {e}")
+
+    names = set(table.column_names)
+    if names.issuperset(feature_columns):
+        columns = [table.column(c) for c in feature_columns]
+    elif table.num_columns == len(feature_columns):
+        columns = table.columns
+    else:
+        missing = [c for c in feature_columns if c not in names]
+        raise ValueError(f"Faltan {len(missing)} columnas del esquema en la tabla Arrow (p. ej. {missing[:3]})")
+
+    X = np.empty((table.num_rows, len(feature_columns)), dtype=np.float32)
+    for j, col in enumerate(columns):
+        X[:, j] = col.to_numpy()
+    return X
+
+
+def read_matrix(body: bytes, mimetype: str, feature_columns) -> np.ndarray:
+    """Matriz float32 (n, n_features) a partir del cuerpo binario de la petición."""
+    if mimetype == NPY_MIMETYPE:
+        return _read_npy(body, len(feature_columns))
+    if mimetype in ARROW_MIMETYPES:
+        return _read_arrow(body, mimetype, feature_columns)
+    raise ValueError(f"Formato binario no soportado: {mimetype}")
+
+
+def response_mimetype(accept, request_mimetype: str) -> str:
+    """Formato de salida: el primer formato binario de Accept o el de la entrada."""
+    for value, _ in accept:
+        if value in BINARY_MIMETYPES:
+            return value
+    return request_mimetype
+
+
+def write_result(mimetype: str, p_attack: np.ndarray, y_pred: np.ndarray, labels_only: bool = False) -> bytes:
+    """Serializa el resultado: `.npy` 1-D (probabilidades o etiquetas) o una tabla
+    Arrow con las columnas `probability` (float32) y `prediction` (uint8)."""
+    y_pred = np.asarray(y_pred, dtype=np.uint8)
+    if mimetype == NPY_MIMETYPE:
+        buf = io.BytesIO()
+        np.save(buf, y_pred if labels_only else np.asarray(p_attack, dtype=np.float32), allow_pickle=False)
+        return buf.getvalue()
+
+    _require_arrow()
+    data = {"prediction": pa.array(y_pred)}
+    if not labels_only:
+        data = {"probability": pa.array(np.asarray(p_attack, dtype=np.float32)), **data}
+    table = pa.table(data)
+    sink = pa.BufferOutputStream()
+    writer = ipc.new_file if mimetype == ARROW_FILE_MIMETYPE else ipc.new_stream
+    with writer(sink, table.schema) as w:
+        w.write_table(table)
+    return sink.getvalue().to_pybytes()
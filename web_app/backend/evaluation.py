@@ -0,0 +1,130 @@
+"""Métricas de evaluación de /api/predict calculadas en una sola pasada.
+
+`classification_report`, `confusion_matrix`, `roc_curve` y
+`precision_recall_curve` de scikit-learn vuelven a validar, ordenar o
+recorrer los arreglos completos cada una. Aquí la matriz de confusión (y con
+ella el reporte por clase) sale de un `bincount`, y ambas curvas de un único
+ordenamiento descendente de P(ataque): los verdaderos y falsos positivos
+acumulados en cada umbral distinto dan la ROC y la curva Precision-Recall.
+Los valores coinciden con los de scikit-learn.
+
+Las curvas pueden tener un punto por cada probabilidad distinta (cientos de
+miles en archivos grandes). El AUC se calcula con la curva completa y la
+respuesta lleva como máximo `max_points` puntos, elegidos a intervalos
+regulares de longitud a lo largo de la curva para conservar su forma.
+"""
+import numpy as np
+
+
+def confusion(y_true, y_pred):
+    """Matriz de confusión 2x2 (filas: real, columnas: predicción)."""
+    y_true = np.asarray(y_true, dtype=np.int64)
+    y_pred = np.asarray(y_pred, dtype=np.int64)
+    return np.bincount(2 * y_true + y_pred, minlength=4).reshape(2, 2)
+
+
+def _ratio(num, den):
+    return float(num / den) if den else 0.0
+
+
+def report_from_confusion(cm, labels):
+    """Equivalente a `classification_report(..., output_dict=True)` para etiquetas 0/1."""
+    report = {}
+    total = int(cm.sum())
+    for label in labels:
+        tp = cm[label, label]
+        support = int(cm[label].sum())
+        predicted = cm[:, label].sum()
+        report[str(label)] = {
+            'precision': _ratio(tp, predicted),
+            'recall': _ratio(tp, support),
+            'f1-score': _ratio(2 * tp, support + predicted),
+            'support': float(support),
+        }
+    report['accuracy'] = _ratio(np.trace(cm), total)
+    for avg in ('macro avg', 'weighted avg'):
+        weights = [report[str(l)]['support'] if avg == 'weighted avg' else 1.0 for l in labels]
+        report[avg] = {
+            key: float(np.average([report[str(l)][key] for l in labels], weights=weights))
+            if sum(weights) else 0.0
+            for key in ('precision', 'recall', 'f1-score')
+        }
+        report[avg]['support'] = float(total)
+    return report
+
+
+def _cumulative_counts(y_true, scores):
+    """Falsos y verdaderos positivos acumulados en cada umbral distinto (un solo sort)."""
+    order = np.argsort(scores, kind='mergesort')[::-1]
+    scores = scores[order]
+    y_true = y_true[order]
+    last = np.r_[np.flatnonzero(np.diff(scores)), len(scores) - 1]
+    tps = np.cumsum(y_true, dtype=np.int64)[last]
+    fps = 1 + last - tps
+    return fps, tps
+
+
+def _trapezoid(x, y):
+    return float(abs(np.trapezoid(y, x)))
+
+
+def downsample(x, y, max_points):
+    """Índices de como máximo `max_points` puntos repartidos a lo largo de la curva."""
+    n = len(x)
+    if not max_points or n <= max_points:
+        return np.arange(n)
+    length = np.r_[0.0, np.cumsum(np.hypot(np.diff(x), np.diff(y)))]
+    targets = np.linspace(0.0, length[-1], max_points)
+    idx = np.unique(np.searchsorted(length, targets).clip(0, n - 1))
+    return np.union1d(idx, [0, n - 1])
+
+
+def curves(y_true, scores, max_points=None):
+    """ROC y Precision-Recall (con AUC) a partir de un único ordenamiento."""
+    fps, tps = _cumulative_counts(np.asarray(y_true, dtype=np.int64), np.asarray(scores, dtype=np.float64))
+
+    # ROC sin puntos intermedios colineales, como roc_curve(drop_intermediate=True)
+    keep = np.r_[True, np.logical_or(np.diff(fps, 2), np.diff(tps, 2)), True]
+    roc_fps = np.r_[0, fps[keep]]
+    roc_tps = np.r_[0, tps[keep]]
+    fpr = roc_fps / roc_fps[-1]
+    tpr = roc_tps / roc_tps[-1]
+
+    precision = tps / (tps + fps)
+    recall = tps / tps[-1]
+    precision = np.r_[precision[::-1], 1.0]
+    recall = np.r_[recall[::-1], 0.0]
+
+    roc_idx = downsample(fpr, tpr, max_points)
+    pr_idx = downsample(recall, precision, max_points)
+    return {
+        'roc_curve': {
+            'fpr': fpr[roc_idx].tolist(),
+            'tpr': tpr[roc_idx].tolist(),
+            'auc': _trapezoid(fpr, tpr),
+        },
+        'precision_recall_curve': {
+            'precision': precision[pr_idx].tolist(),
+            'recall': recall[pr_idx].tolist(),
+            'auc': _trapezoid(recall, precision),
+        },
+    }
+
+
+def evaluate(y_true, y_pred, scores, max_points=None):
+    """Bloque 'evaluation' de /api/predict: accuracy, matriz de confusión,
+    reporte por clase y curvas ROC / Precision-Recall (si hay ambas clases)."""
+    y_true = np.asarray(y_true, dtype=np.int64)
+    y_pred = np.asarray(y_pred, dtype=np.int64)
+    cm = confusion(y_true, y_pred)
+    present = cm.sum(axis=1) + cm.sum(axis=0)
+    labels = [label for label in (0, 1) if present[label]]
+
+    evaluation = {
+        'accuracy': _ratio(np.trace(cm), len(y_true)),
+        'confusion_matrix': cm[np.ix_(labels, labels)].tolist(),
+        'classification_report': report_from_confusion(cm, labels),
+    }
+    if 0 < y_true.sum() < len(y_true):
+        evaluation.update(curves(y_true, scores, max_points))
+    return evaluation
@@ -0,0 +1,329 @@
+"""Trabajos asíncronos de puntuación masiva (/api/jobs).
+
+Un archivo grande no se procesa dentro de la petición: se guarda en
+`output/jobs/<id>/input` y la petición responde de inmediato con el id del
+trabajo. Un hilo coordinador divide el archivo en bloques de líneas
+(`uploads.split_lines`) y los reparte en un pool de procesos; cada proceso
+carga el modelo una vez, parsea y puntúa su bloque y lo guarda en
+`chunks/<n>.npz`. El estado (`status.json`) se reescribe de forma atómica
+tras cada bloque, así que cualquier proceso del backend puede consultarlo.
+
+Todo queda en disco: tras un reinicio, los trabajos terminados siguen
+disponibles y los que estaban en curso se reanudan desde los bloques que
+faltan. Un bloqueo por trabajo (flock) evita que dos procesos del servidor
+pre-fork coordinen el mismo trabajo.
+"""
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+from evaluation import confusion
+from model_registry import ServedModel
+from uploads import parse_text, split_lines
+
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+ACTIVE_STATES = ('queued', 'running')
+
+
+class UnknownJob(LookupError):
+    """No existe el trabajo pedido."""
+
+
+def in_pool_worker():
+    """Si este proceso es un worker de un pool de multiprocessing (p. ej. el de
+    los trabajos). Ya es cierto mientras se reimporta el script principal."""
+    return multiprocessing.current_process().name != 'MainProcess'
+
+
+def _now():
+    return time.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _write_json(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+# --- Procesos del pool -------------------------------------------------------
+
+_worker_models = {}  # ruta -> ServedModel cargado en este proceso
+
+# Se predice sobre matrices NumPy ya alineadas con el esquema
+warnings.filterwarnings('ignore', message='X does not have valid feature names')
+
+
+def _worker_model(name, path, signature):
+    served = _worker_models.get(path)
+    if served is None or served.signature != signature:
+        served = _worker_models[path] = ServedModel(name, path)
+    if served.signature != signature:
+        raise ValueError(f"El modelo {name} cambió durante el trabajo; vuelve a enviar el archivo")
+    return served
+
+
+def score_chunk(job_dir, index, start, end, header, model_name, model_path, signature, threshold):
+    """Puntúa las líneas [start, end) del archivo del trabajo y guarda el bloque."""
+    served = _worker_model(model_name, model_path, tuple(signature))
+    with open(os.path.join(job_dir, 'input'), 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    X, y_true = parse_text(((header or b'') + data).decode('utf-8'), served.encoder)
+
+    proba = served.predict_proba(X)[:, 1]
+    arrays = {'proba': proba.astype(np.float32), 'pred': (proba > threshold).astype(np.uint8)}
+    if y_true is not None:
+        arrays['y_true'] = np.asarray(y_true, dtype=np.uint8)
+    path = _chunk_path(job_dir, index)
+    tmp = path[:-len('.npz')] + '.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+    return len(X)
+
+
+def _chunk_path(job_dir, index):
+    return os.path.join(job_dir, 'chunks', f"{index:06d}.npz")
+
+
+# --- Coordinación (proceso del servidor web) ---------------------------------
+
+class JobManager:
+    def __init__(self, jobs_dir, workers=None, chunk_rows=50000, metrics=None):
+        self.jobs_dir = jobs_dir
+        self.metrics = metrics
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_rows = chunk_rows
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._started_pid = None
+
+    def _dir(self, job_id):
+        if not JOB_ID_PATTERN.match(job_id or '') or not os.path.isdir(os.path.join(self.jobs_dir, job_id)):
+            raise UnknownJob(f"Trabajo no encontrado: {job_id}")
+        return os.path.join(self.jobs_dir, job_id)
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn: no se hace fork de un servidor con hilos
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _reset_pool(self, pool):
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def start(self):
+        """Reanuda los trabajos interrumpidos (una vez por proceso)."""
+        if self._started_pid == os.getpid():
+            return
+        self._started_pid = os.getpid()
+        for status in self.list():
+            if status['state'] in ACTIVE_STATES:
+                self._start_thread(status['id'])
+
+    def _start_thread(self, job_id):
+        threading.Thread(target=self._run, args=(job_id,), name=f"job-{job_id[:8]}", daemon=True).start()
+
+    def submit(self, file, served, threshold, output):
+        """Guarda el archivo subido y encola el trabajo; retorna su estado inicial."""
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(os.path.join(job_dir, 'chunks'))
+        file.save(os.path.join(job_dir, 'input'))
+
+        status = {
+            'id': job_id,
+            'state': 'queued',
+            'filename': file.filename,
+            'model': served.name,
+            'model_path': served.path,
+            'model_signature': list(served.signature),
+            'threshold': threshold,
+            'output': output,
+            'created_at': _now(),
+            'started_at': None,
+            'finished_at': None,
+            'total_chunks': None,
+            'chunks_done': 0,
+            'rows_done': 0,
+            'progress': 0.0,
+            'error': None,
+        }
+        _write_json(os.path.join(job_dir, 'status.json'), status)
+        self._start_thread(job_id)
+        return status
+
+    def status(self, job_id):
+        with open(os.path.join(self._dir(job_id), 'status.json'), encoding='utf-8') as f:
+            return json.load(f)
+
+    def list(self):
+        jobs = []
+        if os.path.isdir(self.jobs_dir):
+            for job_id in os.listdir(self.jobs_dir):
+                try:
+                    jobs.append(self.status(job_id))
+                except (UnknownJob, OSError, ValueError):
+                    continue
+        return sorted(jobs, key=lambda s: s['created_at'])
+
+    def delete(self, job_id):
+        job_dir = self._dir(job_id)
+        if self.status(job_id)['state'] in ACTIVE_STATES:
+            raise ValueError("El trabajo sigue en curso")
+        shutil.rmtree(job_dir)
+
+    def _lock(self, job_dir):
+        """Bloqueo exclusivo del trabajo, o None si otro proceso lo coordina."""
+        handle = open(os.path.join(job_dir, 'lock'), 'w')
+        if fcntl is not None:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                return None
+        return handle
+
+    def _run(self, job_id):
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        lock = self._lock(job_dir)
+        if lock is None:
+            return
+        status_path = os.path.join(job_dir, 'status.json')
+        try:
+            status = self.status(job_id)
+            if status['state'] not in ACTIVE_STATES:
+                return
+            for key in ('total_samples', 'prediction_summary', 'evaluation'):
+                status.pop(key, None)
+            status.update(state='running', started_at=status['started_at'] or _now(), error=None)
+            _write_json(status_path, status)
+            try:
+                self._score(job_dir, status, status_path)
+            except Exception as e:
+                status.update(state='failed', error=str(e) or type(e).__name__, finished_at=_now())
+                _write_json(status_path, status)
+        finally:
+            lock.close()
+
+    def _score(self, job_dir, status, status_path):
+        chunks_path = os.path.join(job_dir, 'chunks.json')
+        if os.path.exists(chunks_path):
+            with open(chunks_path, encoding='utf-8') as f:
+                chunks = json.load(f)
+        else:
+            header, ranges = split_lines(os.path.join(job_dir, 'input'), self.chunk_rows)
+            chunks = {'header': header.decode('utf-8') if header else None, 'ranges': ranges}
+            _write_json(chunks_path, chunks)
+        header = chunks['header'].encode('utf-8') if chunks['header'] else None
+        ranges = chunks['ranges']
+
+        # Bloques ya guardados (trabajo reanudado tras un reinicio)
+        rows_done = 0
+        pending = []
+        for i in range(len(ranges)):
+            if os.path.exists(_chunk_path(job_dir, i)):
+                with np.load(_chunk_path(job_dir, i)) as chunk:
+                    rows_done += len(chunk['pred'])
+            else:
+                pending.append(i)
+        status.update(total_chunks=len(ranges), chunks_done=len(ranges) - len(pending), rows_done=rows_done)
+        _write_json(status_path, status)
+
+        pool = self._get_pool()
+        futures = [
+            pool.submit(score_chunk, job_dir, i, *ranges[i], header, status['model'],
+                        status['model_path'], status['model_signature'], status['threshold'])
+            for i in pending
+        ]
+        try:
+            for future in as_completed(futures):
+                rows = future.result()
+                if self.metrics is not None:
+                    self.metrics.inc('kdd_rows_scored_total', rows, endpoint='jobs', model=status['model'])
+                status['rows_done'] += rows
+                status['chunks_done'] += 1
+                status['progress'] = status['chunks_done'] / len(ranges)
+                _write_json(status_path, status)
+        except BrokenProcessPool:
+            self._reset_pool(pool)
+            raise
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+        status.update(self._summary(job_dir, len(ranges)), state='done', progress=1.0, finished_at=_now())
+        _write_json(status_path, status)
+
+    def _summary(self, job_dir, n_chunks):
+        counts = np.zeros(2, dtype=np.int64)
+        cm = np.zeros((2, 2), dtype=np.int64)
+        has_labels = n_chunks > 0
+        for i in range(n_chunks):
+            with np.load(_chunk_path(job_dir, i)) as chunk:
+                pred = chunk['pred']
+                counts += np.bincount(pred, minlength=2)[:2]
+                if 'y_true' in chunk:
+                    cm += confusion(chunk['y_true'], pred)
+                else:
+                    has_labels = False
+        total = int(counts.sum())
+        summary = {
+            'total_samples': total,
+            'prediction_summary': {
+                'normal': int(counts[0]),
+                'attack': int(counts[1]),
+                'normal_percentage': float(counts[0] / total * 100) if total else 0.0,
+                'attack_percentage': float(counts[1] / total * 100) if total else 0.0,
+            },
+        }
+        if has_labels and total:
+            summary['evaluation'] = {'accuracy': float(np.trace(cm) / total), 'confusion_matrix': cm.tolist()}
+        return summary
+
+    def iter_result(self, job_id):
+        """Resultado del trabajo terminado en NDJSON: una línea por bloque (como
+        /api/predict con stream=1) y una línea final con el resumen."""
+        job_dir = self._dir(job_id)
+        status = self.status(job_id)
+        if status['state'] != 'done':
+            raise ValueError(f"El trabajo no ha terminado (estado: {status['state']})")
+
+        def lines():
+            offset = 0
+            for i in range(status['total_chunks']):
+                with np.load(_chunk_path(job_dir, i)) as chunk:
+                    line = {'chunk': i, 'offset': offset, 'rows': len(chunk['pred']),
+                            'predictions': chunk['pred'].tolist()}
+                    if status['output'] == 'full':
+                        line['probabilities'] = chunk['proba'].tolist()
+                offset += line['rows']
+                yield json.dumps(line) + '\n'
+            final = {'done': True, 'model': status['model'], 'threshold': status['threshold'],
+                     'total_samples': status['total_samples'], 'prediction_summary': status['prediction_summary']}
+            if 'evaluation' in status:
+                final['evaluation'] = status['evaluation']
+            yield json.dumps(final) + '\n'
+
+        return lines()
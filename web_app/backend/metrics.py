@@ -0,0 +1,286 @@
+"""Métricas del backend en el formato de texto de Prometheus (/metrics).
+
+Contadores, gauges e histogramas con etiquetas, sin dependencias externas.
+`time()` mide una etapa con un `with`; los collectors son funciones que se
+llaman al exportar y devuelven valores que viven en otros objetos (cola del
+micro-batcher, tiempo de carga de los modelos).
+
+Con el servidor pre-fork (serve.py) cada worker tiene sus propias métricas y
+una petición a /metrics la atiende un worker cualquiera. Si se define
+`snapshot_dir`, cada proceso escribe ahí su estado cada `flush_interval`
+segundos y /metrics combina los de todos: los contadores e histogramas se
+suman (también los de workers ya terminados, para que nunca retrocedan) y los
+gauges se suman o se toma el máximo según se declaren, solo entre procesos
+vivos. El archivo de un worker terminado se suma a `retired.json` y se borra,
+así que el directorio tiene un archivo por worker vivo más ese agregado.
+"""
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+
+RETIRED_FILE = 'retired.json'
+LOCK_FILE = '.lock'
+
+# Límites (segundos) de los histogramas de latencia
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class Metrics:
+    def __init__(self, snapshot_dir=None, flush_interval=1.0):
+        self.snapshot_dir = snapshot_dir
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._meta = {}        # nombre -> {'type', 'help', 'buckets', 'merge'}
+        self._values = {}      # (nombre, etiquetas) -> float (contadores y gauges)
+        self._histograms = {}  # (nombre, etiquetas) -> [conteo por bucket..., suma, total]
+        self._collectors = []
+        self._flusher_pid = None
+
+    # --- Declaración y registro ---------------------------------------------
+
+    def counter(self, name, help):
+        self._meta[name] = {'type': 'counter', 'help': help}
+
+    def gauge(self, name, help, merge='sum'):
+        """`merge`: cómo se combinan los procesos ('sum' o 'max')."""
+        self._meta[name] = {'type': 'gauge', 'help': help, 'merge': merge}
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        self._meta[name] = {'type': 'histogram', 'help': help, 'buckets': tuple(buckets)}
+
+    def add_collector(self, fn):
+        """`fn()` retorna [(nombre, etiquetas, valor), ...] al momento de exportar."""
+        self._collectors.append(fn)
+
+    def inc(self, name, value=1.0, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, _label_key(labels))] = float(value)
+
+    def observe(self, name, value, **labels):
+        buckets = self._meta[name]['buckets']
+        key = (name, _label_key(labels))
+        with self._lock:
+            state = self._histograms.get(key)
+            if state is None:
+                state = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0, 0]
+            state[bisect_left(buckets, value)] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, name, **labels):
+        """Observa en el histograma `name` la duración del bloque `with`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    # --- Exportación ---------------------------------------------------------
+
+    def snapshot(self):
+        """Estado de este proceso, serializable en JSON."""
+        collected = []
+        for fn in self._collectors:
+            try:
+                collected.extend(fn())
+            except Exception:
+                continue
+        with self._lock:
+            values = [[n, list(map(list, k)), v] for (n, k), v in self._values.items()]
+            histograms = [[n, list(map(list, k)), list(s)] for (n, k), s in self._histograms.items()]
+        values += [[n, list(map(list, _label_key(l))), float(v)] for n, l, v in collected]
+        return {'pid': os.getpid(), 'values': values, 'histograms': histograms}
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.snapshot_dir, f"{pid}.json")
+
+    def _write_snapshot(self, path=None, data=None):
+        path = path or self._snapshot_path(os.getpid())
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot() if data is None else data, f)
+        os.replace(tmp, path)
+
+    @contextmanager
+    def _dir_lock(self, exclusive):
+        """Bloqueo del directorio de snapshots: exclusivo para retirar archivos,
+        compartido para leerlos (así una lectura no ve un snapshot retirado a
+        medias, ni en su archivo ni en `retired.json`)."""
+        with open(os.path.join(self.snapshot_dir, LOCK_FILE), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _retire(self, path):
+        """Suma los contadores e histogramas del snapshot `path` (de un proceso
+        terminado) a `retired.json` y borra el archivo. El bloqueo evita que
+        dos workers sumen el mismo snapshot."""
+        with self._dir_lock(exclusive=True):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    dead = json.load(f)
+            except FileNotFoundError:
+                return  # ya lo retiró otro worker
+            except ValueError:
+                dead = {'values': [], 'histograms': []}
+            retired_path = os.path.join(self.snapshot_dir, RETIRED_FILE)
+            try:
+                with open(retired_path, encoding='utf-8') as f:
+                    retired = json.load(f)
+            except (OSError, ValueError):
+                retired = {'pid': None, 'values': [], 'histograms': []}
+
+            values = {(n, tuple(map(tuple, l))): v for n, l, v in retired['values']}
+            for name, labels, value in dead['values']:
+                if self._meta.get(name, {}).get('type') == 'counter':
+                    key = (name, tuple(map(tuple, labels)))
+                    values[key] = values.get(key, 0.0) + value
+            histograms = {(n, tuple(map(tuple, l))): s for n, l, s in retired['histograms']}
+            for name, labels, state in dead['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                current = histograms.get(key)
+                histograms[key] = state if current is None else [a + b for a, b in zip(current, state)]
+
+            retired['values'] = [[n, list(map(list, k)), v] for (n, k), v in values.items()]
+            retired['histograms'] = [[n, list(map(list, k)), s] for (n, k), s in histograms.items()]
+            self._write_snapshot(retired_path, retired)
+            os.remove(path)
+            if os.path.exists(f"{path}.tmp"):  # escritura interrumpida al terminar
+                os.remove(f"{path}.tmp")
+
+    def _flush(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self._write_snapshot()
+            except OSError:
+                pass
+
+    def start_flusher(self):
+        """Inicia la escritura periódica del estado (una vez por proceso)."""
+        if not self.snapshot_dir or self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid != os.getpid():
+                os.makedirs(self.snapshot_dir, exist_ok=True)
+                # Un archivo con este pid es de un proceso anterior que lo reutilizaba
+                if os.path.exists(self._snapshot_path(os.getpid())):
+                    self._retire(self._snapshot_path(os.getpid()))
+                threading.Thread(target=self._flush, name="metrics-flusher", daemon=True).start()
+                self._flusher_pid = os.getpid()
+
+    def _retire_dead(self):
+        for path in glob.glob(os.path.join(self.snapshot_dir, '*.json')):
+            name = os.path.basename(path)[:-len('.json')]
+            if name.isdigit() and int(name) != os.getpid() and not _pid_alive(int(name)):
+                try:
+                    self._retire(path)
+                except OSError:
+                    continue
+
+    def _snapshots(self):
+        snapshots = [self.snapshot()]
+        if self.snapshot_dir:
+            self._retire_dead()
+            with self._dir_lock(exclusive=False):
+                for path in glob.glob(os.path.join(self.snapshot_dir, '*.json')):
+                    try:
+                        with open(path, encoding='utf-8') as f:
+                            data = json.load(f)
+                    except (OSError, ValueError):
+                        continue
+                    if data['pid'] != os.getpid():
+                        snapshots.append(data)
+        return snapshots
+
+    def render(self):
+        """Texto en el formato de exposición de Prometheus (versión 0.0.4)."""
+        values, histograms = {}, {}
+        for snap in self._snapshots():
+            alive = snap['pid'] is not None and (snap['pid'] == os.getpid() or _pid_alive(snap['pid']))
+            for name, labels, value in snap['values']:
+                meta = self._meta.get(name)
+                if meta is None:
+                    continue
+                key = (name, tuple(map(tuple, labels)))
+                if meta['type'] == 'gauge':
+                    if not alive:
+                        continue
+                    if meta['merge'] == 'max':
+                        values[key] = max(values.get(key, value), value)
+                        continue
+                values[key] = values.get(key, 0.0) + value
+            for name, labels, state in snap['histograms']:
+                if name not in self._meta:
+                    continue
+                key = (name, tuple(map(tuple, labels)))
+                current = histograms.get(key)
+                histograms[key] = state if current is None else [a + b for a, b in zip(current, state)]
+
+        lines = []
+        for name in sorted(self._meta):
+            meta = self._meta[name]
+            lines.append(f"# HELP {name} {meta['help']}")
+            lines.append(f"# TYPE {name} {meta['type']}")
+            if meta['type'] == 'histogram':
+                for (n, labels), state in sorted(histograms.items()):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for le, count in zip(meta['buckets'] + (float('inf'),), state[:-2]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, [('le', _format_value(le))])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(state[-2])}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {state[-1]}")
+            else:
+                for (n, labels), value in sorted(values.items()):
+                    if n == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,143 @@
+"""Micro-batching en proceso para peticiones de puntuación concurrentes.
+
+Las peticiones pequeñas que llegan a la vez se encolan; un hilo trabajador
+espera como máximo `max_wait_ms` desde la llegada de la primera (o hasta
+juntar `max_rows` filas), evalúa todas las matrices con una sola llamada a
+`predict_fn` y devuelve a cada petición su parte del resultado. Así el costo
+fijo por llamada del modelo se paga una vez por lote y no una vez por
+petición, a cambio de unos milisegundos de latencia adicional.
+
+`stats()` expone la profundidad de la cola y la distribución del tamaño de
+los lotes para ajustar `max_wait_ms` / `max_rows`.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+# Límites superiores (en filas) del histograma de tamaños de lote
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+class BatcherClosed(RuntimeError):
+    """El micro-batcher se cerró (p. ej. el modelo se recargó)."""
+
+
+class MicroBatcher:
+    def __init__(self, predict_fn, max_wait_ms=2.0, max_rows=256):
+        self.predict_fn = predict_fn
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_rows = max_rows
+
+        self._queue = deque()  # (X, Future, hora de llegada)
+        self._queued_rows = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._batches = 0
+        self._requests = 0
+        self._rows = 0
+        self._max_batch_rows = 0
+        self._max_queue_depth = 0
+        self._wait_seconds = 0.0
+        self._buckets = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, X) -> Future:
+        """Encola la matriz X; el Future se resuelve con `predict_fn` aplicado a X."""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise BatcherClosed("El micro-batcher está cerrado")
+            self._queue.append((X, future, time.perf_counter()))
+            self._queued_rows += len(X)
+            self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+            self._cond.notify()
+        return future
+
+    def predict(self, X, timeout=None):
+        """Versión bloqueante de `submit`."""
+        return self.submit(X).result(timeout)
+
+    def _next_batch(self):
+        """Espera al primer elemento y junta el lote (o None si se cerró)."""
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            deadline = self._queue[0][2] + self.max_wait
+            while self._queued_rows < self.max_rows and not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch, rows = [], 0
+            while self._queue and (not batch or rows + len(self._queue[0][0]) <= self.max_rows):
+                item = self._queue.popleft()
+                batch.append(item)
+                rows += len(item[0])
+            self._queued_rows -= rows
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            sizes = [len(X) for X, _, _ in batch]
+            try:
+                X = batch[0][0] if len(batch) == 1 else np.concatenate([X for X, _, _ in batch])
+                result = self.predict_fn(X)
+            except Exception as e:  # el error se entrega a cada petición del lote
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            else:
+                offset = 0
+                for size, (_, future, _) in zip(sizes, batch):
+                    future.set_result(result[offset:offset + size])
+                    offset += size
+            self._record(batch, sum(sizes), started)
+
+    def _record(self, batch, rows, started):
+        with self._cond:
+            self._batches += 1
+            self._requests += len(batch)
+            self._rows += rows
+            self._max_batch_rows = max(self._max_batch_rows, rows)
+            self._wait_seconds += sum(started - arrived for _, _, arrived in batch)
+            bucket = next((i for i, limit in enumerate(BATCH_SIZE_BUCKETS) if rows <= limit),
+                          len(BATCH_SIZE_BUCKETS))
+            self._buckets[bucket] += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            labels = [f"<={b}" for b in BATCH_SIZE_BUCKETS] + [f">{BATCH_SIZE_BUCKETS[-1]}"]
+            return {
+                'max_wait_ms': self.max_wait * 1000,
+                'max_rows': self.max_rows,
+                'queue_depth': len(self._queue),
+                'queued_rows': self._queued_rows,
+                'max_queue_depth': self._max_queue_depth,
+                'batches': self._batches,
+                'requests': self._requests,
+                'rows': self._rows,
+                'avg_batch_rows': self._rows / self._batches if self._batches else 0.0,
+                'avg_batch_requests': self._requests / self._batches if self._batches else 0.0,
+                'max_batch_rows': self._max_batch_rows,
+                'avg_queue_wait_ms': self._wait_seconds / self._requests * 1000 if self._requests else 0.0,
+                'batch_rows_histogram': dict(zip(labels, self._buckets)),
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join()
@@ -0,0 +1,290 @@
+"""Registro de modelos servidos por el backend, con recarga en caliente.
+
+Descubre los artefactos `output/<nombre>_kdd_model.joblib` y los carga bajo
+demanda. Si junto al joblib hay una exportación compacta al día
+(`<nombre>_kdd_model.trees`, ver scripts/tree_export.py) se carga esa: se
+mapea en memoria en milisegundos en lugar de deserializar los árboles, y los
+procesos que sirven el mismo modelo comparten una sola copia.
+
+Cada modelo cargado es un `ServedModel` inmutable que agrupa todo lo que
+depende del artefacto (esquema, codificador, motor compilado, micro-batcher y
+caché de predicciones). Una petición obtiene su `ServedModel` una sola vez y
+lo usa hasta terminar.
+
+Un hilo vigila los archivos (joblib y exportación) y, cuando uno cambia, carga
+la versión nueva en segundo plano y la publica con una sola asignación: las
+peticiones en curso siguen con la versión anterior, ninguna espera la carga y
+ninguna ve un modelo a medio cargar. Un archivo solo se recarga cuando su tamaño y mtime no
+cambiaron durante un intervalo completo (el trainer pudo estar escribiéndolo);
+si la carga falla se sigue sirviendo la versión anterior.
+
+Los hilos (vigilante y micro-batcher) se crean en el proceso que atiende las
+peticiones y no al cargar: con un servidor pre-fork (serve.py) los modelos se
+cargan en el proceso maestro, se comparten con los workers y cada worker
+arranca sus propios hilos.
+"""
+import glob
+import os
+import threading
+import time
+
+import joblib
+
+from kdd_schema import SCHEMA_PATH, KDDEncoder, load_schema, schema_from_columns
+from tree_engine import UnsupportedModel, compile_model
+from tree_export import ExportedModel, export_path, file_signature, load_export
+from micro_batcher import BatcherClosed, MicroBatcher
+from row_cache import RowCache
+
+
+MODEL_SUFFIX = "_kdd_model.joblib"
+METRICS_SUFFIX = "_kdd_metrics.txt"
+
+
+class UnknownModel(LookupError):
+    """No existe `output/<nombre>_kdd_model.joblib`."""
+
+
+def artifact_signatures(path):
+    """(firma del joblib, firma de su exportación compacta o None si no existe)."""
+    try:
+        exported = file_signature(export_path(path))
+    except FileNotFoundError:
+        exported = None
+    return file_signature(path), exported
+
+
+class ServedModel:
+    """Un artefacto cargado y todo lo que depende de él. Nunca se modifica:
+    una recarga crea un `ServedModel` nuevo."""
+
+    def __init__(self, name, path, batching=None, cache_size=0):
+        self.name = name
+        self.path = path
+        self.metrics_path = path[:-len(MODEL_SUFFIX)] + METRICS_SUFFIX
+        # Las firmas se toman antes de leer: si un archivo cambia durante la
+        # carga, el vigilante lo detecta en la siguiente pasada
+        self.signature, self.export_signature = artifact_signatures(path)
+        start = time.perf_counter()
+        self.model = self._load_export() if self.export_signature is not None else None
+        if self.model is None:
+            self.model = joblib.load(path)
+        self.loaded_at = time.time()
+
+        # Esquema de características compartido con el entrenamiento
+        columns = getattr(self.model, 'feature_names_in_', None)
+        schema = load_schema(SCHEMA_PATH, fallback_columns=columns)
+        if columns is not None and list(schema['feature_columns']) != list(columns):
+            print(f"Advertencia ({name}): el esquema guardado no coincide con el modelo; "
+                  "se usa el orden del modelo")
+            schema = schema_from_columns(columns)
+        self.encoder = KDDEncoder(schema)
+
+        # Motor compilado (árboles aplanados en arreglos NumPy) para /api/score
+        if isinstance(self.model, ExportedModel):
+            self.engine = self.model.engine
+        else:
+            try:
+                self.engine = compile_model(self.model)
+            except UnsupportedModel as e:
+                self.engine = None
+                print(f"Motor compilado no disponible para {name} ({e}); se usará scikit-learn")
+        self.load_seconds = time.perf_counter() - start
+
+        # Cachés de predicciones de esta versión (se descartan con ella al
+        # recargar): P(ataque) de /api/score y filas de predict_proba de /api/predict
+        self.caches = {kind: RowCache(cache_size) for kind in ('score', 'predict')} if cache_size > 0 else {}
+
+        self.batching = batching
+        self._batcher = None
+        self._batcher_pid = None
+        self._batcher_lock = threading.Lock()
+
+    @property
+    def artifact(self):
+        """'trees' si se sirve la exportación compacta, 'joblib' si no."""
+        return 'trees' if isinstance(self.model, ExportedModel) else 'joblib'
+
+    def _load_export(self):
+        """Exportación compacta del joblib, o None si falta, está desactualizada o no se puede leer."""
+        path = export_path(self.path)
+        try:
+            exported = load_export(path)
+        except (OSError, ValueError) as e:
+            print(f"No se pudo cargar {path} ({e}); se usará el joblib")
+            return None
+        if exported.source_signature != self.signature:
+            print(f"{path} no corresponde al joblib actual (vuelve a ejecutar tree_export.py); se usará el joblib")
+            return None
+        return exported
+
+    @property
+    def batcher(self):
+        """Micro-batcher de este proceso (se crea en el primer uso; None si está desactivado)."""
+        if not self.batching:
+            return None
+        if self._batcher_pid != os.getpid():
+            with self._batcher_lock:
+                if self._batcher_pid != os.getpid():
+                    self._batcher = MicroBatcher(self.score_matrix, *self.batching)
+                    self._batcher_pid = os.getpid()
+        return self._batcher
+
+    def batcher_stats(self):
+        """`stats()` del micro-batcher de este proceso, o None si aún no se usó."""
+        if self._batcher is None or self._batcher_pid != os.getpid():
+            return None
+        return self._batcher.stats()
+
+    def cache_stats(self):
+        """{'score': stats, 'predict': stats} de las cachés de predicciones ({} si están desactivadas)."""
+        return {kind: cache.stats() for kind, cache in self.caches.items()}
+
+    def predict_proba(self, X):
+        if self.caches:
+            return self.caches['predict'].lookup(X, self.model.predict_proba)
+        return self.model.predict_proba(X)
+
+    def score_matrix(self, X):
+        """P(ataque) con el motor compilado, o con scikit-learn si no está disponible."""
+        if self.engine is not None:
+            return self.engine.predict_attack(X)
+        return self.model.predict_proba(X)[:, 1]
+
+    def score(self, X):
+        """Como `score_matrix`, pasando por la caché y el micro-batcher si están activos."""
+        if self.caches:
+            return self.caches['score'].lookup(X, self._score_uncached)
+        return self._score_uncached(X)
+
+    def _score_uncached(self, X):
+        if self.batcher is not None:
+            try:
+                return self.batcher.predict(X)
+            except BatcherClosed:  # versión ya reemplazada: se evalúa directamente
+                pass
+        return self.score_matrix(X)
+
+    def close(self):
+        if self._batcher is not None and self._batcher_pid == os.getpid():
+            self._batcher.close()
+
+
+class ModelRegistry:
+    def __init__(self, models_dir, default, batching=None, poll_interval=2.0, cache_size=0):
+        self.models_dir = models_dir
+        self.default = default
+        self.batching = batching
+        self.cache_size = cache_size
+        self.poll_interval = poll_interval
+
+        self._models = {}           # nombre -> ServedModel publicado
+        self._load_locks = {}       # nombre -> Lock (evita cargas duplicadas)
+        self._lock = threading.Lock()
+        self._pending = {}          # nombre -> firma vista cambiada (esperando estabilidad)
+        self._failed = {}           # nombre -> firma cuya carga falló
+        self._reloads = 0
+        self._watcher = None
+        self._watcher_pid = None
+
+    def path_for(self, name):
+        return os.path.join(self.models_dir, f"{name}{MODEL_SUFFIX}")
+
+    def discover(self):
+        """{nombre: ruta} de los artefactos disponibles en `models_dir`."""
+        paths = glob.glob(os.path.join(self.models_dir, f"*{MODEL_SUFFIX}"))
+        return {os.path.basename(p)[:-len(MODEL_SUFFIX)]: p for p in sorted(paths)}
+
+    def _load_lock(self, name):
+        with self._lock:
+            return self._load_locks.setdefault(name, threading.Lock())
+
+    def get(self, name=None) -> ServedModel:
+        """Modelo publicado `name` (o el por defecto), cargándolo si hace falta."""
+        name = name or self.default
+        served = self._models.get(name)
+        if served is not None:
+            return served
+        if os.path.sep in name or not os.path.exists(self.path_for(name)):
+            raise UnknownModel(f"Modelo no encontrado: {name} (disponibles: {', '.join(self.discover())})")
+        with self._load_lock(name):
+            served = self._models.get(name)
+            if served is None:
+                print(f"Cargando modelo {name}...")
+                served = ServedModel(name, self.path_for(name), self.batching, self.cache_size)
+                self._models[name] = served
+                print(f"Modelo {name} cargado exitosamente")
+        return served
+
+    def loaded(self):
+        """Versiones publicadas de los modelos cargados."""
+        return list(self._models.values())
+
+    def preload(self, names=None):
+        """Carga por adelantado `names` (todos los descubiertos si es None)."""
+        for name in (names if names is not None else self.discover()):
+            self.get(name)
+
+    def refresh(self, wait_stable=True):
+        """Recarga los modelos publicados cuyo archivo cambió y ya está estable
+        (o de inmediato con `wait_stable=False`)."""
+        for name, served in list(self._models.items()):
+            path = served.path
+            try:
+                signature = artifact_signatures(path)
+            except FileNotFoundError:
+                continue  # artefacto eliminado: se sigue sirviendo la versión cargada
+            if signature == (served.signature, served.export_signature) or signature == self._failed.get(name):
+                self._pending.pop(name, None)
+                continue
+            if wait_stable and self._pending.get(name) != signature:
+                self._pending[name] = signature  # esperar a que deje de cambiar
+                continue
+
+            self._pending.pop(name, None)
+            try:
+                with self._load_lock(name):
+                    fresh = ServedModel(name, path, self.batching, self.cache_size)
+                    self._models[name] = fresh  # publicación atómica
+            except Exception as e:
+                self._failed[name] = signature
+                print(f"No se pudo recargar {name} ({e}); se mantiene la versión anterior")
+                continue
+            self._reloads += 1
+            print(f"Modelo {name} recargado")
+            served.close()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error vigilando modelos: {e}")
+
+    def start_watcher(self):
+        """Inicia el hilo de recarga en caliente (una vez por proceso)."""
+        if self.poll_interval <= 0 or self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid != os.getpid():
+                self._watcher = threading.Thread(target=self._watch, name="model-watcher", daemon=True)
+                self._watcher.start()
+                self._watcher_pid = os.getpid()
+
+    def status(self):
+        """Modelos disponibles y estado de carga de cada uno."""
+        models = []
+        for name, path in self.discover().items():
+            served = self._models.get(name)
+            models.append({
+                'name': name,
+                'path': path,
+                'default': name == self.default,
+                'loaded': served is not None,
+                'loaded_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(served.loaded_at)) if served else None,
+                'engine': None if served is None else ('compiled' if served.engine is not None else 'sklearn'),
+                'artifact': served.artifact if served else None,
+                'reload_pending': name in self._pending,
+            })
+        return {'default': self.default, 'reloads': self._reloads, 'models': models}
@@ -0,0 +1,55 @@
+"""Respuestas JSON precalculadas para los endpoints de solo lectura.
+
+/api/model-info, /api/feature-importance, /api/plots y /api/plot/<archivo>
+dependen solo de archivos en disco (modelo, métricas, plots), pero el
+dashboard y la extensión los consultan constantemente. Cada respuesta se
+construye una vez por versión de sus archivos de origen (tamaño y mtime) y
+se guarda serializada y comprimida con gzip, con un ETag por codificación. Una consulta
+repetida solo compara la versión; si el cliente envía If-None-Match o
+If-Modified-Since y nada cambió, recibe un 304 sin cuerpo.
+"""
+import gzip
+import hashlib
+import json
+from datetime import datetime, timezone
+
+from flask import Response, request
+
+
+GZIP_LEVEL = 6
+
+
+class CachedResponse:
+    def __init__(self, payload, version, last_modified=None):
+        self.version = version
+        self.body = json.dumps(payload).encode('utf-8')
+        self.gzipped = gzip.compress(self.body, GZIP_LEVEL)
+        self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+        self.last_modified = (datetime.fromtimestamp(last_modified, timezone.utc).replace(microsecond=0)
+                              if last_modified else None)
+
+    def to_response(self):
+        """Respuesta HTTP (comprimida si el cliente acepta gzip; 304 si no cambió)."""
+        use_gzip = 'gzip' in request.accept_encodings
+        response = Response(self.gzipped if use_gzip else self.body, mimetype='application/json')
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'no-cache'  # revalidar siempre (respuesta 304 barata)
+        # Cada codificación es una representación distinta: ETag fuerte propio
+        response.set_etag(self.etag + '-gz' if use_gzip else self.etag)
+        response.last_modified = self.last_modified
+        return response.make_conditional(request)
+
+
+class ResponseCache:
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, key, version, build, last_modified=None):
+        """Respuesta guardada para `key` si su `version` no cambió; si no, la
+        construye con `build()` (que retorna el cuerpo JSON) y la guarda."""
+        entry = self._entries.get(key)
+        if entry is None or entry.version != version:
+            entry = self._entries[key] = CachedResponse(build(), version, last_modified)
+        return entry.to_response()
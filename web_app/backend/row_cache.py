@@ -0,0 +1,98 @@
+"""Caché LRU de predicciones por fila de características.
+
+El tráfico KDD es muy repetitivo: una inundación smurf o neptune genera miles
+de conexiones con exactamente las mismas características, y los sensores
+reenvían los mismos resúmenes. Antes de evaluar el modelo, las filas
+codificadas se resumen en un hash de 128 bits, las repetidas dentro del lote se
+agrupan y cada fila distinta se busca por su hash; solo las que no están en
+caché pasan por el ensemble.
+
+El hash es multilineal sobre las palabras de 32 bits de cada fila, con
+coeficientes aleatorios por proceso: se calcula para todo el lote con una sola
+multiplicación de matrices en lugar de recorrer las filas en Python.
+
+El tamaño está acotado a `max_entries` filas: al llenarse se descarta la
+usada hace más tiempo. Cada versión de un modelo (`ServedModel`) tiene su
+propia caché, así que una recarga en caliente la invalida sin más.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+_rng = np.random.default_rng()
+_coefficients = {}  # palabras por fila -> coeficientes (impares) de los dos hashes de 64 bits
+
+
+def _hash_coefficients(width):
+    if width not in _coefficients:
+        _coefficients[width] = _rng.integers(1, 2**63, size=(width, 2), dtype=np.uint64) | np.uint64(1)
+    return _coefficients[width]
+
+
+def row_keys(X):
+    """Hash de cada fila distinta de X, posición de su primera aparición y, para
+    cada fila de X, el índice de su fila distinta."""
+    words = np.ascontiguousarray(X).view(np.uint32).astype(np.uint64)
+    hashes = np.ascontiguousarray(words @ _hash_coefficients(words.shape[1]))  # módulo 2**64
+    hashes = hashes.view(np.dtype((np.void, 16))).ravel()
+    uniques, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    return uniques.tolist(), first, inverse.ravel()
+
+
+class RowCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # hash de la fila -> predicción (más reciente al final)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, X, predict):
+        """Equivale a `predict(X)`, evaluando solo las filas distintas que no
+        están en caché. `predict` retorna una predicción por fila (P(ataque)
+        o la fila de `predict_proba`)."""
+        if len(X) == 0:
+            return predict(X)
+        keys, first, inverse = row_keys(X)
+        values = [None] * len(keys)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                value = self._entries.get(key)
+                if value is None:
+                    missing.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    values[i] = value
+            # Aciertos y fallos se cuentan en filas: las repetidas dentro del
+            # mismo lote tampoco se evalúan
+            self.hits += len(X) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            # tolist(): valores exactos sin retener el arreglo completo del lote
+            computed = np.asarray(predict(X[first[missing]])).tolist()
+            with self._lock:
+                for i, value in zip(missing, computed):
+                    values[i] = value
+                    self._entries[keys[i]] = value
+                    self._entries.move_to_end(keys[i])
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+
+        return np.asarray(values)[inverse]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
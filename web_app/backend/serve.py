@@ -0,0 +1,116 @@
+"""Servidor de producción del backend: gunicorn en modo pre-fork.
+
+    python serve.py
+
+`app.run(debug=True)` es un servidor de desarrollo de un solo proceso. Aquí el
+proceso maestro importa app.py (y con él carga los modelos) antes de crear los
+workers con fork: los arreglos de los árboles quedan en páginas compartidas
+copy-on-write en lugar de duplicarse por worker, y cada worker atiende sus
+peticiones en su propio núcleo.
+
+Cada worker usa a lo sumo KDD_WORKER_THREADS hilos para atender peticiones y
+acepta como máximo KDD_WORKER_CONNECTIONS conexiones simultáneas; el resto
+espera en la cola del socket.
+
+Reinicio ordenado: `kill -HUP <pid del maestro>`. El maestro recarga los
+modelos cuyo archivo cambió, crea workers nuevos y los anteriores dejan de
+aceptar conexiones y terminan sus peticiones en curso (hasta
+KDD_GRACEFUL_TIMEOUT segundos). SIGTERM detiene el servidor del mismo modo.
+
+Cada worker deja sus métricas en un directorio compartido (KDD_METRICS_DIR,
+temporal por defecto) para que /metrics muestre el total del servidor y no
+solo el del worker que atiende la petición.
+"""
+import gc
+import os
+import shutil
+import tempfile
+
+# Un hilo de BLAS/OpenMP por worker: el paralelismo lo dan los procesos
+for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(var, "1")
+
+from gunicorn.app.base import BaseApplication  # noqa: E402
+
+
+HOST = os.environ.get("KDD_HOST", "0.0.0.0")
+PORT = int(os.environ.get("KDD_PORT", "5000"))
+WORKERS = int(os.environ.get("KDD_WORKERS", str(os.cpu_count() or 1)))
+# app.py reparte los núcleos del pool de /api/jobs entre los workers
+os.environ["KDD_WORKERS"] = str(WORKERS)
+WORKER_THREADS = int(os.environ.get("KDD_WORKER_THREADS", "4"))
+WORKER_CONNECTIONS = int(os.environ.get("KDD_WORKER_CONNECTIONS", str(WORKER_THREADS * 8)))
+WORKER_TIMEOUT = int(os.environ.get("KDD_WORKER_TIMEOUT", "120"))
+GRACEFUL_TIMEOUT = int(os.environ.get("KDD_GRACEFUL_TIMEOUT", "30"))
+# Reciclar cada worker tras N peticiones (0 = nunca)
+MAX_REQUESTS = int(os.environ.get("KDD_MAX_REQUESTS", "0"))
+
+_temp_metrics_dir = None  # directorio de métricas creado por este servidor
+
+
+def pre_fork(server, worker):
+    # Pasa los objetos ya cargados a la generación permanente del GC: el
+    # recolector de los workers no los recorre y no escribe en sus páginas,
+    # que siguen compartidas con el maestro
+    gc.freeze()
+
+
+def on_exit(server):
+    if _temp_metrics_dir:
+        shutil.rmtree(_temp_metrics_dir, ignore_errors=True)
+
+
+def on_reload(server):
+    # SIGHUP: los workers nuevos se crean a partir del maestro, así que antes
+    # se recargan en él los modelos cuyo archivo cambió
+    from app import registry
+    registry.refresh(wait_stable=False)
+
+
+class KDDServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app import app
+        return app
+
+
+def main():
+    global _temp_metrics_dir
+    if not os.environ.get("KDD_METRICS_DIR"):
+        _temp_metrics_dir = os.environ["KDD_METRICS_DIR"] = tempfile.mkdtemp(prefix="kdd-metrics-")
+
+    options = {
+        'bind': f"{HOST}:{PORT}",
+        'workers': WORKERS,
+        'worker_class': 'gthread',
+        'threads': WORKER_THREADS,
+        'worker_connections': WORKER_CONNECTIONS,
+        'timeout': WORKER_TIMEOUT,
+        'graceful_timeout': GRACEFUL_TIMEOUT,
+        'max_requests': MAX_REQUESTS,
+        'max_requests_jitter': MAX_REQUESTS // 10,
+        'preload_app': True,
+        'pre_fork': pre_fork,
+        'on_reload': on_reload,
+        'on_exit': on_exit,
+    }
+
+    print("\n" + "="*70)
+    print("SERVIDOR DE PRODUCCIÓN (gunicorn pre-fork)")
+    print("="*70)
+    print(f"Dirección: {HOST}:{PORT}")
+    print(f"Workers: {WORKERS} x {WORKER_THREADS} hilos (máx. {WORKER_CONNECTIONS} conexiones por worker)")
+    print("="*70 + "\n")
+
+    KDDServer(options).run()
+
+
+if __name__ == '__main__':
+    main()
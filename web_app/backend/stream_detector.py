@@ -0,0 +1,514 @@
+"""Detección de intrusiones en tiempo real sobre un flujo de conexiones.
+
+    python stream_detector.py conn.log --follow          # seguir un conn.log de Zeek
+    zcat conn.*.log.gz | python stream_detector.py -     # stdin
+    python stream_detector.py --listen /run/kdd.sock     # socket Unix local
+    python stream_detector.py --listen 127.0.0.1:9999 --format kdd
+
+A diferencia de /api/predict, que puntúa un archivo completo, este proceso
+queda leyendo eventos y escribe una alerta (JSON por línea) por cada conexión
+con P(ataque) > KDD_THRESHOLD. Dos hilos unidos por una cola acotada:
+
+ - Lector: lee líneas de la fuente. Con `--format zeek`/`json` cada línea es
+   una conexión de conn.log y `ConnectionFeatureExtractor` calcula sus 41
+   campos KDD; con `--format kdd` la línea ya trae los campos. El registro se
+   encola con su hora de llegada.
+ - Evaluador: toma lotes de hasta KDD_STREAM_BATCH_ROWS eventos, o los que
+   haya cuando el primero lleva KDD_STREAM_MAX_WAIT_MS esperando. Los codifica
+   con el esquema del entrenamiento (`KDDEncoder`) y los puntúa con el modelo
+   cargado (motor compilado si está disponible). Después escribe las alertas.
+
+Contrapresión: la cola admite como máximo KDD_STREAM_QUEUE eventos. Cuando se
+llena, el lector deja de leer (`block`, por defecto) y la presión llega a la
+fuente: la tubería o el socket se llenan y el emisor espera, o el archivo
+seguido se lee con retraso. Con KDD_STREAM_OVERFLOW=drop se descartan los
+eventos nuevos y se cuentan. En ambos casos la latencia de extremo a extremo
+queda acotada por aproximadamente KDD_STREAM_QUEUE / throughput +
+KDD_STREAM_MAX_WAIT_MS.
+
+Cada KDD_STREAM_REPORT_INTERVAL segundos se escribe en stderr una línea JSON
+con los contadores (eventos leídos, puntuados, alertas, descartados,
+throughput, profundidad de la cola, tiempo bloqueado, latencia y retraso
+respecto de la hora de la conexión). Con `--metrics-port` se exponen además
+en formato Prometheus en http://127.0.0.1:<puerto>/metrics.
+
+El modelo se recarga en caliente como en el backend: cuando cambia
+`output/<modelo>_kdd_model.joblib`, los lotes siguientes usan la versión nueva.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, os.path.join(BASE_DIR, "scripts"))
+
+from connection_features import PARSERS, ConnectionFeatureExtractor, open_lines  # noqa: E402
+from kdd_schema import RAW_FEATURE_COLUMNS  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from model_registry import ModelRegistry  # noqa: E402
+
+
+OUTPUT_DIR = os.path.join(BASE_DIR, "output")
+MODEL_NAME = os.environ.get("KDD_MODEL", "gradient_boosting")
+DECISION_THRESHOLD = float(os.environ.get("KDD_THRESHOLD", "0.5"))
+RELOAD_INTERVAL = float(os.environ.get("KDD_RELOAD_INTERVAL", "2"))
+
+# Tamaño máximo del lote y espera máxima del primer evento antes de evaluar
+BATCH_ROWS = int(os.environ.get("KDD_STREAM_BATCH_ROWS", "256"))
+MAX_WAIT_MS = float(os.environ.get("KDD_STREAM_MAX_WAIT_MS", "50"))
+# Eventos en espera entre el lector y el evaluador; al llenarse se aplica la
+# política de desborde: "block" (frenar la lectura) o "drop" (descartar)
+QUEUE_SIZE = int(os.environ.get("KDD_STREAM_QUEUE", "10000"))
+OVERFLOW = os.environ.get("KDD_STREAM_OVERFLOW", "block")
+REPORT_INTERVAL = float(os.environ.get("KDD_STREAM_REPORT_INTERVAL", "10"))
+# Intervalo de sondeo de un archivo seguido con --follow
+FOLLOW_POLL = float(os.environ.get("KDD_STREAM_FOLLOW_POLL", "0.2"))
+
+OVERFLOW_POLICIES = ("block", "drop")
+SOURCE_FORMATS = tuple(sorted(PARSERS)) + ("kdd",)
+FIELD_COUNTS = (len(RAW_FEATURE_COLUMNS), len(RAW_FEATURE_COLUMNS) + 1, len(RAW_FEATURE_COLUMNS) + 2)
+
+
+class EventQueue:
+    """Cola acotada entre el lector y el evaluador.
+
+    `put` bloquea (o descarta, con `overflow="drop"`) cuando hay `capacity`
+    eventos en espera; `take` devuelve lotes de hasta `max_items` eventos sin
+    esperar más de `max_wait` segundos desde la llegada del primero.
+    """
+
+    def __init__(self, capacity, overflow="block"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Política de desborde desconocida: {overflow}")
+        self.capacity = capacity
+        self.overflow = overflow
+        self._items = deque()  # (hora de llegada, registro, conexión)
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closed = False
+
+        self.dropped = 0
+        self.blocked_seconds = 0.0
+        self.max_depth = 0
+
+    def put(self, item):
+        """Encola `item`; retorna False si se descartó o la cola está cerrada."""
+        with self._lock:
+            if len(self._items) >= self.capacity:
+                if self.overflow == "drop":
+                    self.dropped += 1
+                    return False
+                start = time.perf_counter()
+                while len(self._items) >= self.capacity and not self._closed:
+                    self._not_full.wait()
+                self.blocked_seconds += time.perf_counter() - start
+            if self._closed:
+                return False
+            self._items.append(item)
+            if len(self._items) > self.max_depth:
+                self.max_depth = len(self._items)
+            self._not_empty.notify()
+            return True
+
+    def take(self, max_items, max_wait, idle_timeout=None):
+        """Siguiente lote. Retorna [] si pasa `idle_timeout` sin eventos y
+        None cuando la cola está cerrada y vacía."""
+        with self._lock:
+            if not self._items and not self._closed:
+                self._not_empty.wait(idle_timeout)
+            if not self._items:
+                return None if self._closed else []
+            deadline = self._items[0][0] + max_wait
+            while len(self._items) < max_items and not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._not_empty.wait(remaining)
+            n = min(max_items, len(self._items))
+            batch = [self._items.popleft() for _ in range(n)]
+            self._not_full.notify()
+            return batch
+
+    def depth(self):
+        return len(self._items)
+
+    def close(self):
+        """El lector terminó (o se detiene el servicio): `take` vacía lo pendiente."""
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+
+# --- Fuentes de líneas -------------------------------------------------------
+
+def follow_lines(path, from_start=False, poll_interval=FOLLOW_POLL, stop=None):
+    """Líneas completas de un archivo que sigue creciendo (como `tail -F`).
+
+    Sin `from_start` empieza al final del archivo, pero antes entrega las
+    líneas de cabecera (`#...`) para que un conn.log en TSV conserve su
+    `#fields`. Si el archivo se trunca o se rota (otro inodo en la misma ruta)
+    se vuelve a abrir desde el principio.
+    """
+    f = open(path, "r", encoding="utf-8", errors="replace")
+    if not from_start:
+        for line in f:
+            if not line.startswith("#"):
+                break
+            yield line
+        f.seek(0, os.SEEK_END)
+    partial = ""
+    while stop is None or not stop.is_set():
+        line = f.readline()
+        if line:
+            if not line.endswith("\n"):  # el escritor aún no terminó la línea
+                partial += line
+                continue
+            yield partial + line
+            partial = ""
+            continue
+        try:
+            st = os.stat(path)
+            rotated = st.st_ino != os.fstat(f.fileno()).st_ino or st.st_size < f.tell()
+        except FileNotFoundError:
+            rotated = False  # rotación en curso: la ruta nueva aún no existe
+        if rotated:
+            f.close()
+            f = open(path, "r", encoding="utf-8", errors="replace")
+            partial = ""
+            continue
+        time.sleep(poll_interval)
+    f.close()
+
+
+def is_unix_address(address):
+    return ":" not in address or address.startswith(("/", "."))
+
+
+def listen_lines(address, stop=None):
+    """Líneas recibidas en un socket local: ruta de un socket Unix o `host:puerto`.
+
+    Atiende un emisor a la vez (las características dependen del orden de las
+    conexiones); al cerrarse uno se acepta el siguiente. Mientras el lector
+    está bloqueado por contrapresión no se lee del socket y el emisor espera.
+    """
+    if is_unix_address(address):
+        if os.path.exists(address):
+            os.unlink(address)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(address)
+        server.listen(1)
+    else:
+        host, _, port = address.rpartition(":")
+        server = socket.create_server((host or "127.0.0.1", int(port)))
+    try:
+        while stop is None or not stop.is_set():
+            conn, _ = server.accept()
+            with conn, conn.makefile("r", encoding="utf-8", errors="replace", newline="\n") as lines:
+                yield from lines
+    finally:
+        server.close()
+
+
+# --- Servicio ----------------------------------------------------------------
+
+class StreamDetector:
+    def __init__(self, registry, model_name, output, threshold=DECISION_THRESHOLD, source_format="zeek",
+                 batch_rows=BATCH_ROWS, max_wait_ms=MAX_WAIT_MS, queue_size=QUEUE_SIZE,
+                 overflow=OVERFLOW, report_interval=REPORT_INTERVAL, emit_all=False, extractor=None):
+        if source_format not in SOURCE_FORMATS:
+            raise ValueError(f"Formato desconocido: {source_format}")
+        self.registry = registry
+        self.model_name = model_name
+        self.output = output
+        self.threshold = threshold
+        self.source_format = source_format
+        self.batch_rows = batch_rows
+        self.max_wait = max_wait_ms / 1000.0
+        self.report_interval = report_interval
+        self.emit_all = emit_all
+        self.extractor = extractor or ConnectionFeatureExtractor()
+        self.queue = EventQueue(queue_size, overflow)
+        self.stop = threading.Event()
+
+        # Contadores: el lector escribe los suyos y el evaluador el resto
+        self.started = time.perf_counter()
+        self.lines_read = 0
+        self.parse_errors = 0
+        self.events_scored = 0
+        self.alerts = 0
+        self.batches = 0
+        self.latency_max = 0.0
+        self.latency_last = 0.0
+        self.event_lag = None
+        self._last_report = (self.started, 0)
+
+        self.metrics = Metrics()
+        self.metrics.counter('kdd_stream_events_total', 'Eventos leídos de la fuente')
+        self.metrics.counter('kdd_stream_scored_total', 'Eventos puntuados por el modelo')
+        self.metrics.counter('kdd_stream_alerts_total', 'Eventos con P(ataque) sobre el umbral')
+        self.metrics.counter('kdd_stream_dropped_total', 'Eventos descartados con la cola llena (overflow=drop)')
+        self.metrics.counter('kdd_stream_parse_errors_total', 'Líneas descartadas por formato inválido')
+        self.metrics.counter('kdd_stream_blocked_seconds_total',
+                             'Segundos que el lector estuvo detenido por contrapresión')
+        self.metrics.gauge('kdd_stream_queue_depth', 'Eventos en espera de ser puntuados')
+        self.metrics.gauge('kdd_stream_event_lag_seconds',
+                           'Hora actual menos la hora de la última conexión puntuada')
+        self.metrics.histogram('kdd_stream_batch_latency_seconds',
+                               'Desde la llegada del evento más antiguo del lote hasta escribir sus alertas')
+        self.metrics.histogram('kdd_stream_batch_rows', 'Eventos por lote evaluado',
+                               buckets=(1, 4, 16, 64, 256, 1024, 4096))
+        self.metrics.add_collector(self._collect)
+
+    # --- Lector ---------------------------------------------------------------
+
+    def _on_parse_error(self, line, error):
+        self.parse_errors += 1
+
+    def _events(self, lines):
+        """(registro de 41 campos, conexión o None) por cada línea válida."""
+        if self.source_format == "kdd":
+            for line in lines:
+                fields = line.strip().split(",")
+                if len(fields) in FIELD_COUNTS:
+                    yield fields[:len(RAW_FEATURE_COLUMNS)], None  # sin `class` ni `difficulty`
+                elif line.strip():
+                    self.parse_errors += 1
+            return
+        update = self.extractor.update
+        for conn in PARSERS[self.source_format](lines, on_error=self._on_parse_error):
+            yield update(conn), conn
+
+    def _count_lines(self, lines):
+        for line in lines:
+            self.lines_read += 1
+            yield line
+
+    def read(self, lines):
+        """Lee la fuente hasta agotarla (o hasta `stop`) y cierra la cola."""
+        put, clock = self.queue.put, time.perf_counter
+        try:
+            for record, conn in self._events(self._count_lines(lines)):
+                put((clock(), record, conn))
+                if self.stop.is_set():
+                    break
+        except Exception as e:
+            print(f"Error leyendo la fuente: {e}", file=sys.stderr)
+        finally:
+            self.queue.close()
+
+    # --- Evaluador ------------------------------------------------------------
+
+    def _alert(self, record, conn, probability, model_name):
+        alert = {
+            'protocol_type': record[1],
+            'service': record[2],
+            'flag': record[3],
+            'probability': round(float(probability), 6),
+            'attack': bool(probability > self.threshold),
+            'model': model_name,
+        }
+        if conn is not None:
+            alert.update(ts=conn[0], src=conn[1], src_port=conn[2], dst=conn[3], dst_port=conn[4])
+        return json.dumps(alert)
+
+    def score_batch(self, batch):
+        served = self.registry.get(self.model_name)
+        records = [record for _, record, _ in batch]
+        p_attack = served.score(served.encoder.encode_raw(records))
+
+        selected = range(len(batch)) if self.emit_all else np.flatnonzero(p_attack > self.threshold)
+        lines = [self._alert(batch[i][1], batch[i][2], p_attack[i], served.name) for i in selected]
+        if lines:
+            self.output.write("\n".join(lines) + "\n")
+            self.output.flush()
+
+        now = time.perf_counter()
+        latency = now - batch[0][0]
+        n_alerts = int(np.count_nonzero(p_attack > self.threshold))
+        self.events_scored += len(batch)
+        self.alerts += n_alerts
+        self.batches += 1
+        self.latency_last = latency
+        self.latency_max = max(self.latency_max, latency)
+        last_conn = batch[-1][2]
+        if last_conn is not None:
+            self.event_lag = time.time() - last_conn[0]
+        self.metrics.inc('kdd_stream_scored_total', len(batch))
+        self.metrics.inc('kdd_stream_alerts_total', n_alerts)
+        self.metrics.observe('kdd_stream_batch_latency_seconds', latency)
+        self.metrics.observe('kdd_stream_batch_rows', len(batch))
+
+    def run(self):
+        """Evalúa lotes hasta que la cola se cierre y quede vacía."""
+        while True:
+            idle = max(0.0, self._last_report[0] + self.report_interval - time.perf_counter())
+            batch = self.queue.take(self.batch_rows, self.max_wait, idle_timeout=idle)
+            if batch is None:
+                break
+            if batch:
+                self.score_batch(batch)
+            if time.perf_counter() - self._last_report[0] >= self.report_interval:
+                self.report()
+        self.report()
+
+    # --- Contadores -----------------------------------------------------------
+
+    def stats(self):
+        now = time.perf_counter()
+        last_time, last_scored = self._last_report
+        interval = now - last_time
+        return {
+            'uptime_seconds': round(now - self.started, 3),
+            'lines_read': self.lines_read,
+            'events_scored': self.events_scored,
+            'alerts': self.alerts,
+            'dropped': self.queue.dropped,
+            'parse_errors': self.parse_errors,
+            'batches': self.batches,
+            'avg_batch_rows': round(self.events_scored / self.batches, 1) if self.batches else 0.0,
+            'throughput_eps': round((self.events_scored - last_scored) / interval, 1) if interval > 0 else 0.0,
+            'avg_throughput_eps': round(self.events_scored / (now - self.started), 1),
+            'queue_depth': self.queue.depth(),
+            'max_queue_depth': self.queue.max_depth,
+            'blocked_seconds': round(self.queue.blocked_seconds, 3),
+            'latency_ms': round(self.latency_last * 1000, 3),
+            'max_latency_ms': round(self.latency_max * 1000, 3),
+            'event_lag_seconds': None if self.event_lag is None else round(self.event_lag, 3),
+        }
+
+    def report(self):
+        stats = self.stats()
+        self._last_report = (time.perf_counter(), self.events_scored)
+        print(json.dumps(stats), file=sys.stderr, flush=True)
+
+    def _collect(self):
+        samples = [
+            ('kdd_stream_events_total', {}, self.lines_read),
+            ('kdd_stream_dropped_total', {}, self.queue.dropped),
+            ('kdd_stream_parse_errors_total', {}, self.parse_errors),
+            ('kdd_stream_blocked_seconds_total', {}, self.queue.blocked_seconds),
+            ('kdd_stream_queue_depth', {}, self.queue.depth()),
+        ]
+        if self.event_lag is not None:
+            samples.append(('kdd_stream_event_lag_seconds', {}, self.event_lag))
+        return samples
+
+    def serve_metrics(self, port):
+        """Expone `metrics.render()` en http://127.0.0.1:<port>/metrics."""
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=server.serve_forever, name="stream-metrics", daemon=True).start()
+        return server
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Detección de intrusiones en tiempo real sobre un flujo de conexiones.")
+    parser.add_argument("source", nargs="?", default="-",
+                        help="conn.log de Zeek o registros KDD: archivo, '-' para stdin o tcp://host:puerto")
+    parser.add_argument("--listen", default=None,
+                        help="Escuchar en un socket local (ruta de socket Unix o host:puerto) en lugar de leer SOURCE")
+    parser.add_argument("--follow", action="store_true", help="Seguir el archivo a medida que crece (como tail -F)")
+    parser.add_argument("--from-start", action="store_true", help="Con --follow, procesar también el contenido existente")
+    parser.add_argument("--format", choices=SOURCE_FORMATS, default="zeek",
+                        help="zeek (conn.log TSV), json (conn.log JSON) o kdd (41-43 campos por línea)")
+    parser.add_argument("-o", "--output", default="-", help="Archivo de alertas (por defecto stdout)")
+    parser.add_argument("--model", default=MODEL_NAME, help="Modelo de output/<modelo>_kdd_model.joblib")
+    parser.add_argument("--threshold", type=float, default=DECISION_THRESHOLD, help="Umbral de P(ataque)")
+    parser.add_argument("--all", action="store_true", help="Escribir todos los eventos puntuados, no solo las alertas")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help="Eventos máximos por lote")
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS,
+                        help="Espera máxima del primer evento de un lote")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="Eventos máximos en espera")
+    parser.add_argument("--overflow", choices=OVERFLOW_POLICIES, default=OVERFLOW,
+                        help="Con la cola llena: frenar la lectura (block) o descartar eventos (drop)")
+    parser.add_argument("--report-interval", type=float, default=REPORT_INTERVAL,
+                        help="Segundos entre líneas de contadores en stderr")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Exponer los contadores en formato Prometheus en 127.0.0.1:<puerto>/metrics")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    output = sys.stdout if args.output == "-" else open(args.output, "a", encoding="utf-8")
+    # stdout queda solo para las alertas: los mensajes (carga y recarga del
+    # modelo) van a stderr
+    sys.stdout = sys.stderr
+
+    registry = ModelRegistry(OUTPUT_DIR, args.model, poll_interval=RELOAD_INTERVAL)
+    try:
+        served = registry.get()
+    except LookupError as e:
+        raise SystemExit(str(e))
+    registry.start_watcher()
+
+    detector = StreamDetector(
+        registry, args.model, output, threshold=args.threshold, source_format=args.format,
+        batch_rows=args.batch_rows, max_wait_ms=args.max_wait_ms, queue_size=args.queue_size,
+        overflow=args.overflow, report_interval=args.report_interval, emit_all=args.all,
+    )
+    if args.metrics_port:
+        detector.serve_metrics(args.metrics_port)
+
+    if args.listen:
+        lines = listen_lines(args.listen, stop=detector.stop)
+    elif args.follow:
+        if args.source == "-":
+            raise SystemExit("--follow necesita la ruta de un archivo")
+        lines = follow_lines(args.source, from_start=args.from_start, stop=detector.stop)
+    else:
+        lines = open_lines(args.source)
+
+    def shutdown(signum, frame):
+        # Deja de leer y termina de puntuar lo que ya está en la cola
+        detector.stop.set()
+        detector.queue.close()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    print(f"Detector en marcha: modelo {served.name} "
+          f"({'compilado' if served.engine is not None else 'scikit-learn'}), umbral {args.threshold}, "
+          f"lotes de hasta {args.batch_rows} eventos / {args.max_wait_ms:g} ms, "
+          f"cola de {args.queue_size} ({args.overflow})", file=sys.stderr, flush=True)
+    reader = threading.Thread(target=detector.read, args=(lines,), name="stream-reader", daemon=True)
+    reader.start()
+    try:
+        detector.run()
+    finally:
+        if output is not sys.__stdout__:
+            output.close()
+        # El lector puede seguir bloqueado en accept(): el socket se borra aquí
+        if args.listen and is_unix_address(args.listen) and os.path.exists(args.listen):
+            os.unlink(args.listen)
+
+
+if __name__ == '__main__':
+    main()
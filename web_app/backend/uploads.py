@@ -0,0 +1,126 @@
+"""Lectura de los archivos subidos al backend (CSV procesado, CSV crudo o
+texto KDD sin cabecera) como matrices alineadas con el esquema del modelo.
+
+Sin dependencias de Flask: lo usan tanto app.py como los procesos de
+jobs.py.
+"""
+import csv
+import io
+import itertools
+import os
+
+import pandas as pd
+
+from kdd_schema import LABEL_COLUMN, labels_from_classes
+
+
+def is_number(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def from_raw_rows(encoder, rows):
+    """(X, y_true) de registros KDD crudos ya separados en campos."""
+    X = encoder.encode_raw(rows)
+    y_true = labels_from_classes([r[41] for r in rows]) if rows and len(rows[0]) > 41 else None
+    return X, y_true
+
+
+def from_frame(encoder, df):
+    """(X, y_true) de un DataFrame con cabecera, procesado (one-hot) o crudo."""
+    y_true = None
+    if LABEL_COLUMN in df.columns:
+        y_true = df[LABEL_COLUMN].to_numpy()
+    elif 'class' in df.columns:
+        y_true = labels_from_classes(df['class'])
+
+    if 'protocol_type' in df.columns:
+        X = encoder.encode_frame(df)
+    else:
+        X = encoder.align(df)
+    return X, y_true
+
+
+def parse_text(content, encoder):
+    """Convierte el contenido de un archivo en (X, y_true) alineados con el esquema del modelo.
+
+    Formatos aceptados:
+      - CSV procesado (one-hot), con o sin la columna 'binario'
+      - CSV crudo con cabecera (protocol_type, service, flag, ...)
+      - Texto KDD crudo sin cabecera (41, 42 o 43 campos por línea)
+    """
+    first_field = content.split('\n', 1)[0].split(',', 1)[0].strip()
+
+    if is_number(first_field):
+        # Registros crudos sin cabecera: sin pandas
+        return from_raw_rows(encoder, [row for row in csv.reader(io.StringIO(content)) if row])
+
+    return from_frame(encoder, pd.read_csv(io.StringIO(content)))
+
+
+def parse_upload(file, encoder):
+    """`parse_text` sobre un archivo subido (FileStorage de Flask)."""
+    return parse_text(file.read().decode('utf-8'), encoder)
+
+
+def detach_upload(file):
+    """Manejador binario propio del archivo subido.
+
+    Flask cierra `request.files` al terminar la vista, antes de que se consuma
+    una respuesta en streaming. Si la subida está en un archivo temporal se
+    duplica su descriptor; si está en memoria (archivos pequeños) se copia.
+    """
+    try:
+        handle = os.fdopen(os.dup(file.stream.fileno()), 'rb')
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return io.BytesIO(file.stream.read())
+    handle.seek(0)
+    return handle
+
+
+def iter_upload_chunks(stream, encoder, chunk_rows):
+    """Como `parse_upload`, pero lee el archivo binario `stream` por bloques de
+    `chunk_rows` filas y produce un (X, y_true) por bloque sin cargarlo completo."""
+    with io.TextIOWrapper(stream, encoding='utf-8', newline='') as text:
+        first_field = text.readline().split(',', 1)[0].strip()
+        text.seek(0)
+
+        if is_number(first_field):
+            reader = (row for row in csv.reader(text) if row)
+            while True:
+                rows = list(itertools.islice(reader, chunk_rows))
+                if not rows:
+                    break
+                yield from_raw_rows(encoder, rows)
+        else:
+            for df in pd.read_csv(text, chunksize=chunk_rows):
+                yield from_frame(encoder, df)
+
+
+def split_lines(path, chunk_rows):
+    """Divide un archivo en bloques de `chunk_rows` líneas sin parsearlo.
+
+    Retorna (cabecera, [(inicio, fin), ...]): la línea de cabecera en bytes (o
+    None si el archivo no tiene) y los rangos de bytes de cada bloque, que
+    siempre empiezan y terminan en un salto de línea.
+    """
+    ranges = []
+    with open(path, 'rb') as f:
+        first = f.readline()
+        header = None if is_number(first.split(b',', 1)[0].strip().decode('utf-8', 'replace')) else first
+        if header is None:
+            f.seek(0)
+        start, rows = f.tell(), 0
+        for line in f:
+            if line.strip():
+                rows += 1
+            if rows == chunk_rows:
+                end = f.tell()
+                ranges.append((start, end))
+                start, rows = end, 0
+        if rows:
+            ranges.append((start, f.tell()))
+    return header, ranges